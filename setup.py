@@ -6,5 +6,6 @@ setup(
     packages=find_packages(include=["src"]),
     package_dir={"": "src"},
     install_requires=["click", "requests", "fastapi", "gunicorn"],
+    extras_require={"async": ["sqlalchemy[asyncio]", "asyncpg"], "cache": ["redis"]},
     entry_points={"console_scripts": ["todo-cli=todo.__main__:todo_cli"]},
 )
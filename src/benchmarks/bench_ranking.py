@@ -0,0 +1,45 @@
+#!/bin/env python3
+
+import random
+import string
+import timeit
+
+from todo.backend.ranking import get_lexical_rank
+from todo.backend.rank_engine import rank_after, rank_before, rank_midpoint
+
+# Compares the rank engine with the original convert_base based ranking on keys of various lengths.
+# Run with: python src/benchmarks/bench_ranking.py
+
+KEY_LENGTHS = [1, 8, 32, 128]
+NUMBER = 2000
+
+
+def random_rank(length: int) -> str:
+    # Ranks never start or end with "a"
+    rank = [random.choice(string.ascii_lowercase) for _ in range(length)]
+    rank[0] = random.choice(string.ascii_lowercase[1:])
+    rank[-1] = random.choice(string.ascii_lowercase[1:])
+    return "".join(rank)
+
+
+def bench(func, pairs) -> float:
+    seconds = timeit.timeit(lambda: [func(lower, upper) for lower, upper in pairs], number=NUMBER // len(pairs))
+    return seconds / (NUMBER // len(pairs) * len(pairs)) * 1_000_000
+
+
+def main():
+    random.seed(0)
+    print(f"{'length':>8} {'get_lexical_rank':>18} {'rank_midpoint':>15} {'rank_before':>13} {'rank_after':>12}")
+    for length in KEY_LENGTHS:
+        pairs = [tuple(sorted((random_rank(length), random_rank(length)))) for _ in range(100)]
+        pairs = [(lower, upper) for lower, upper in pairs if lower != upper]
+
+        old = bench(get_lexical_rank, pairs)
+        new = bench(rank_midpoint, pairs)
+        before = bench(lambda lower, upper: rank_before(upper), pairs)
+        after = bench(lambda lower, upper: rank_after(lower), pairs)
+        print(f"{length:>8} {old:>16.2f}us {new:>13.2f}us {before:>11.2f}us {after:>10.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ from todo.backend.routes.users import hash_password
 from todo.backend.storage import models
 from todo.backend.dependencies import get_db
 from todo.backend.app import init_app
+from todo.backend.user_cache import USER_CACHE
 from fastapi.testclient import TestClient
 
 DB_SEEDED = False
@@ -50,3 +51,4 @@ def db():
     yield db
     savepoint.rollback()
     db.close()
+    USER_CACHE.clear()
@@ -0,0 +1,236 @@
+import anyio.from_thread
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tests.utils import get_token
+from todo.backend.app import init_app
+from todo.backend.config import CONFIG
+from todo.backend.dependencies import get_async_db, get_db
+from todo.backend.pagination import encode_cursor
+from todo.backend.storage import models
+from todo.backend.storage.async_database import async_engine
+from todo.backend.storage.database import get_pool_stats
+
+# The app as TODO_ASYNC_ROUTES=1 serves it. Requests share one event loop, and the async session runs in a
+# transaction that is rolled back after each test, like the sync tests' savepoint.
+
+
+@pytest.fixture
+def async_client(db, monkeypatch):
+    monkeypatch.setattr(CONFIG, "async_routes", True)
+    app = init_app()
+    app.dependency_overrides[get_db] = lambda: db
+
+    with anyio.from_thread.start_blocking_portal() as portal:
+        connection = portal.call(async_engine.connect)
+        transaction = portal.call(connection.begin)
+        async_db = AsyncSession(bind=connection, autoflush=False, expire_on_commit=False)
+        app.dependency_overrides[get_async_db] = lambda: async_db
+
+        client = TestClient(app)
+        # Without the lifespan, so no workers start, but on the portal's loop the connection belongs to
+        client.portal = portal
+        client.async_db = async_db
+        try:
+            yield client
+        finally:
+            portal.call(async_db.close)
+            portal.call(transaction.rollback)
+            portal.call(connection.close)
+            portal.call(async_engine.dispose)
+
+
+def get_headers(username):
+    return {"Authorization": f"Bearer {get_token(username)}"}
+
+
+def test_async_routes_are_served(async_client):
+    endpoints = {route.endpoint.__module__ for route in async_client.app.routes if hasattr(route, "endpoint")}
+    assert "todo.backend.routes.async_todos" in endpoints
+    assert "todo.backend.routes.async_todo_items" in endpoints
+
+
+def test_async_todo_crud(async_client):
+    response = async_client.post("/api/todos", headers=get_headers("user1"), json={"name": "Async Todo"})
+    assert response.status_code == 200
+    todo = response.json()
+    assert todo["name"] == "Async Todo"
+
+    response = async_client.get(f"/api/todos/{todo['id']}", headers=get_headers("user1"))
+    assert response.status_code == 200
+    assert response.json() == todo
+
+    response = async_client.put(f"/api/todos/{todo['id']}", headers=get_headers("user1"), json={"name": "Renamed"})
+    assert response.status_code == 200
+    assert response.json()["name"] == "Renamed"
+
+    response = async_client.put(f"/api/todos/{todo['id']}", headers=get_headers("user2"), json={"name": "Nope"})
+    assert response.status_code == 400
+    response = async_client.delete(f"/api/todos/{todo['id']}", headers=get_headers("user2"))
+    assert response.status_code == 400
+
+    response = async_client.delete(f"/api/todos/{todo['id']}", headers=get_headers("user1"))
+    assert response.status_code == 200
+    response = async_client.get(f"/api/todos/{todo['id']}", headers=get_headers("user1"))
+    assert response.status_code == 400
+
+
+def test_async_list_todos_scoping_and_pages(async_client):
+    response = async_client.get("/api/todos", headers=get_headers("user1"))
+    assert response.status_code == 200
+    assert [todo["name"] for todo in response.json()["items"]] == ["Todo 1"]
+
+    response = async_client.get("/api/todos", headers=get_headers("admin"), params={"limit": 1})
+    data = response.json()
+    assert len(data["items"]) == 1
+    assert data["next_cursor"] is not None
+
+    response = async_client.get(
+        "/api/todos", headers=get_headers("admin"), params={"limit": 1, "cursor": data["next_cursor"]}
+    )
+    next_data = response.json()
+    assert next_data["items"][0]["id"] > data["items"][0]["id"]
+    assert next_data["next_cursor"] is None
+
+    response = async_client.get("/api/todos", headers=get_headers("admin"), params={"cursor": encode_cursor(["x"])})
+    assert response.status_code == 400
+
+
+def test_async_todo_etag_and_include_items(async_client):
+    response = async_client.get("/api/todos/1", headers=get_headers("user1"), params={"include": "items"})
+    assert response.status_code == 200
+    messages = [todo_item["message"] for todo_item in response.json()["items"]]
+    assert messages == [f"Paper Crane {i + 1}" for i in range(10)]
+
+    response = async_client.get(
+        "/api/todos", headers=get_headers("user1"), params={"items_limit": 2, "include": "items"}
+    )
+    assert [len(todo["items"]) for todo in response.json()["items"]] == [2]
+
+    response = async_client.get("/api/todos/1", headers=get_headers("user1"))
+    assert "items" not in response.json()
+    etag = response.headers["ETag"]
+    response = async_client.get("/api/todos/1", headers={**get_headers("user1"), "If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = async_client.put("/api/todoitems/1", headers=get_headers("user1"), json={"message": "Changed"})
+    assert response.status_code == 200
+    response = async_client.get("/api/todos/1", headers={**get_headers("user1"), "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_async_delete_large_todo_is_purged(async_client, monkeypatch):
+    monkeypatch.setattr(CONFIG, "purge_threshold", 5)
+    response = async_client.delete("/api/todos/1", headers=get_headers("user1"))
+    assert response.status_code == 202
+    assert response.json()["id"] == 1
+
+    # Gone for requests right away, together with its items, which are left for the purge worker
+    response = async_client.get("/api/todos/1", headers=get_headers("user1"))
+    assert response.status_code == 400
+    response = async_client.get("/api/todoitems", headers=get_headers("user1"), params={"todo_id": 1})
+    assert response.json()["items"] == []
+    response = async_client.get("/api/todoitems", headers=get_headers("admin"))
+    assert {todo_item["todo_id"] for todo_item in response.json()["items"]} == {2}
+
+    async def get_needs_purge(async_db):
+        return (await async_db.execute(select(models.Todo.id, models.Todo.needs_purge))).all()
+
+    # Small todos are still deleted in the request
+    monkeypatch.setattr(CONFIG, "purge_threshold", 100)
+    response = async_client.delete("/api/todos/2", headers=get_headers("user2"))
+    assert response.status_code == 200
+    assert async_client.portal.call(get_needs_purge, async_client.async_db) == [(1, True)]
+
+
+def test_async_todo_item_crud_and_toggle(async_client, db):
+    user_1 = db.query(models.User).filter_by(username="user1").one()
+    response = async_client.post("/api/todoitems", headers=get_headers("user1"), json={"todo_id": 1, "message": "New"})
+    assert response.status_code == 200
+    todo_item = response.json()
+    assert todo_item["owner_id"] == user_1.id
+    assert todo_item["todo_id"] == 1
+
+    response = async_client.post("/api/todoitems", headers=get_headers("user2"), json={"todo_id": 1, "message": "No"})
+    assert response.status_code == 400
+
+    response = async_client.get("/api/todoitems", headers=get_headers("user1"), params={"todo_id": 1})
+    # Appended after the existing items
+    assert [item["message"] for item in response.json()["items"]][-1] == "New"
+
+    response = async_client.put(f"/api/todoitems/{todo_item['id']}/toggle", headers=get_headers("user1"))
+    assert response.status_code == 200
+    assert not response.json()["active"]
+    response = async_client.put(f"/api/todoitems/{todo_item['id']}/toggle", headers=get_headers("user2"))
+    assert response.status_code == 400
+
+    response = async_client.put(
+        f"/api/todoitems/{todo_item['id']}", headers=get_headers("user1"), json={"message": "Renamed"}
+    )
+    assert response.json()["message"] == "Renamed"
+
+    response = async_client.delete(f"/api/todoitems/{todo_item['id']}", headers=get_headers("user2"))
+    assert response.status_code == 400
+    response = async_client.delete(f"/api/todoitems/{todo_item['id']}", headers=get_headers("user1"))
+    assert response.status_code == 200
+    response = async_client.get(f"/api/todoitems/{todo_item['id']}", headers=get_headers("user1"))
+    assert response.status_code == 400
+
+
+def test_async_list_todo_items_pages(async_client):
+    messages = []
+    cursor = None
+    while True:
+        params = {"limit": 3}
+        if cursor:
+            params["cursor"] = cursor
+        response = async_client.get("/api/todoitems", headers=get_headers("user2"), params=params)
+        assert response.status_code == 200
+        data = response.json()
+        messages += [todo_item["message"] for todo_item in data["items"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    # Only user2's items, in position order
+    assert messages == [f"Paper Boat {i + 1}" for i in range(10)]
+
+
+def test_async_app_reorder(async_client, db):
+    # Reorder has no async version, it runs on the sync session next to the async routes
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    todo_item = todo.todo_items[0]
+    response = async_client.put(
+        "/api/todos/1/reorder", headers=get_headers("user1"), json={"todo_item_id": todo_item.id, "insert_idx": 5}
+    )
+    assert response.status_code == 204
+    db.expire_all()
+    assert [item.id for item in db.query(models.Todo).filter_by(id=1).one().todo_items].index(todo_item.id) == 5
+
+    response = async_client.put(
+        "/api/todos/1/reorder", headers=get_headers("user2"), json={"todo_item_id": todo_item.id, "insert_idx": 0}
+    )
+    assert response.status_code == 400
+
+
+def test_async_update_user_role(async_client, db):
+    user_2 = db.query(models.User).filter_by(username="user2").one()
+    response = async_client.put(f"/api/users/{user_2.id}", headers=get_headers("user2"), json={"role": "admin"})
+    assert response.status_code == 403
+
+    response = async_client.put(f"/api/users/{user_2.id}", headers=get_headers("admin"), json={"role": "admin"})
+    assert response.status_code == 200
+    assert response.json()["role"] == "admin"
+
+    response = async_client.put("/api/users/0", headers=get_headers("admin"), json={"role": "admin"})
+    assert response.status_code == 400
+
+
+def test_async_engine_pool_stats(async_client):
+    stats = get_pool_stats()["async"]
+    assert stats["size"] == CONFIG.pool_size
+    # The fixture's connection
+    assert stats["checkouts"] >= 1 and stats["checked_out"] == 1
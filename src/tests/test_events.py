@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+from tests.conftest import client
+from tests.utils import get_token
+from todo.backend.config import CONFIG
+from todo.backend.events import (
+    EVENT_HUB,
+    PENDING_EVENTS_KEY,
+    EventHub,
+    LocalPubSub,
+    format_event,
+    publish_todo_item_events,
+    stream_todo_events,
+)
+from todo.backend.storage import models
+
+
+def test_todo_item_events_published_after_commit(db):
+    async def receive():
+        with EVENT_HUB.subscribe(1) as subscription:
+            todo_item = db.query(models.TodoItem).filter_by(id=1).one()
+            todo_item.active = False
+            db.add(models.TodoItem(todo_id=1, message="Paper Frog", position="z"))
+            db.delete(db.query(models.TodoItem).filter_by(id=2).one())
+            db.flush()
+            await asyncio.sleep(0)
+            assert subscription.queue.empty()
+
+            # Requests only commit the test's savepoint, so publish the way the outer commit would
+            publish_todo_item_events(db)
+            return json.loads(await asyncio.wait_for(subscription.queue.get(), 1))
+
+    events = asyncio.run(receive())
+    assert [(event["type"], event["todo_item"]["message"]) for event in events] == [
+        ("created", "Paper Frog"),
+        ("toggled", "Paper Crane 1"),
+        ("deleted", "Paper Crane 2"),
+    ]
+    assert all(event["todo_item"]["todo_id"] == 1 for event in events)
+
+
+def test_todo_deleted_events(db, monkeypatch):
+    monkeypatch.setattr(CONFIG, "purge_threshold", 5)
+    admin_token = get_token("admin")
+    for id in [1, 2]:
+        response = client.delete(f"/api/todos/{id}", headers={"Authorization": f"Bearer {admin_token}"})
+        assert response.status_code in (200, 202)
+
+    # Both the todo marked for the purge worker and the one deleted right away, without an event per item
+    assert db.info[PENDING_EVENTS_KEY] == [
+        (1, {"type": "todo_deleted", "todo": {"id": 1}}),
+        (2, {"type": "todo_deleted", "todo": {"id": 2}}),
+    ]
+
+
+def test_todo_deleted_ends_stream(monkeypatch):
+    hub = EventHub(LocalPubSub(), max_pending=10)
+    monkeypatch.setattr("todo.backend.events.EVENT_HUB", hub)
+
+    async def receive():
+        stream = stream_todo_events(1)
+        chunks = [await stream.__anext__()]
+        hub.publish(1, [{"type": "todo_deleted", "todo": {"id": 1}}])
+        chunks += [chunk async for chunk in stream]
+        return chunks
+
+    assert asyncio.run(receive()) == [": subscribed\n\n", format_event("todo_deleted", {"id": 1})]
+
+
+def test_slow_subscribers_overflow():
+    hub = EventHub(LocalPubSub(), max_pending=2)
+
+    async def receive():
+        with hub.subscribe(1) as subscription:
+            for i in range(5):
+                hub.publish(1, [{"type": "created", "todo_item": {"id": i}}])
+            hub.publish(2, [{"type": "created", "todo_item": {"id": 10}}])
+            await asyncio.sleep(0)
+            return [await subscription.queue.get() for _ in range(subscription.queue.qsize())]
+
+    messages = asyncio.run(receive())
+    assert len(messages) == 3
+    assert messages[-1] is None
+    assert hub._subscriptions == {}
+
+
+def test_format_event():
+    assert format_event("toggled", {"id": 1}) == 'event: toggled\ndata: {"id": 1}\n\n'
+
+
+def test_todo_events_permissions():
+    user_2_token = get_token("user2")
+    response = client.get("/api/todos/1/events", headers={"Authorization": f"Bearer {user_2_token}"})
+    assert response.status_code == 400
@@ -0,0 +1,77 @@
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from todo.backend.dependencies import get_db
+from todo.backend.middleware import DBSessionMiddleware
+
+EVENTS = []
+
+
+class FakeSession:
+    def commit(self):
+        EVENTS.append("commit")
+
+    def rollback(self):
+        EVENTS.append("rollback")
+
+    def close(self):
+        EVENTS.append("close")
+
+
+def make_session():
+    EVENTS.append("open")
+    return FakeSession()
+
+
+app = FastAPI()
+app.add_middleware(DBSessionMiddleware, session_factory=make_session)
+
+
+@app.get("/no-db")
+def no_db():
+    return {}
+
+
+@app.get("/ok")
+def ok(db: FakeSession = Depends(get_db)):
+    return {}
+
+
+@app.get("/fail")
+def fail(db: FakeSession = Depends(get_db)):
+    raise HTTPException(400, detail="Nope")
+
+
+@app.get("/stream")
+def stream(db: FakeSession = Depends(get_db)):
+    def body():
+        EVENTS.append("body")
+        yield b"{}"
+
+    return StreamingResponse(body())
+
+
+client = TestClient(app)
+
+
+def test_session_opened_lazily():
+    EVENTS.clear()
+    assert client.get("/no-db").status_code == 200
+    assert EVENTS == []
+
+
+def test_session_committed_or_rolled_back():
+    EVENTS.clear()
+    assert client.get("/ok").status_code == 200
+    assert EVENTS == ["open", "commit", "close"]
+
+    EVENTS.clear()
+    assert client.get("/fail").status_code == 400
+    assert EVENTS == ["open", "rollback", "close"]
+
+
+def test_session_closed_before_body_is_sent():
+    EVENTS.clear()
+    assert client.get("/stream").status_code == 200
+    assert EVENTS == ["open", "commit", "close", "body"]
@@ -0,0 +1,105 @@
+from sqlalchemy import create_engine, event, func, insert, inspect, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from todo.backend.manage import bootstrap_admin, upgrade_database
+from todo.backend.storage import migrations, models
+from todo.backend.storage.database import Base
+from todo.backend.storage.migrations import v0001_initial, v0003_todo_item_owner_id
+from todo.backend.storage.shards import SHARDS
+
+
+def get_schema(engine) -> dict:
+    inspector = inspect(engine)
+    return {
+        table: (
+            {column["name"] for column in inspector.get_columns(table)},
+            {index["name"] for index in inspector.get_indexes(table)},
+        )
+        for table in Base.metadata.tables
+    }
+
+
+def test_upgrade_matches_models():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    applied = migrations.upgrade(engine)
+    assert applied == [module.__name__.rsplit(".", 1)[-1] for module in migrations.get_migrations()]
+    assert migrations.upgrade(engine) == []
+
+    expected_engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=expected_engine)
+    assert get_schema(engine) == get_schema(expected_engine)
+
+
+def test_upgrade_legacy_database():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    v0001_initial.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        connection.execute(
+            insert(v0001_initial.metadata.tables["user"]),
+            [{"id": i, "username": f"user{i}", "hashed_password": "", "role": "user"} for i in (1, 2)],
+        )
+        connection.execute(
+            insert(v0001_initial.metadata.tables["todo"]),
+            [{"id": 1, "name": "Todo 1", "owner_id": 1}, {"id": 2, "name": "Todo 2", "owner_id": 2}],
+        )
+        connection.execute(
+            insert(v0001_initial.metadata.tables["todo_item"]),
+            [{"id": i, "message": "", "position": "n", "todo_id": i % 2 + 1} for i in range(1, 26)],
+        )
+
+    assert len(migrations.upgrade(engine)) == len(migrations.get_migrations())
+
+    with engine.connect() as connection:
+        rows = connection.execute(select(models.TodoItem.todo_id, models.TodoItem.owner_id)).all()
+        assert len(rows) == 25
+        assert all(todo_id == owner_id for todo_id, owner_id in rows)
+        assert not any(needs_rerank for needs_rerank, in connection.execute(select(models.Todo.needs_rerank)))
+
+
+def test_backfill_todo_item_owner_id_commits_batches():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    migrations.upgrade(engine)
+
+    with engine.begin() as connection:
+        connection.execute(
+            insert(models.User),
+            [{"id": i, "username": f"user{i}", "hashed_password": "", "role": "user"} for i in (1, 2)],
+        )
+        connection.execute(
+            insert(models.Todo),
+            [{"id": 1, "name": "Todo 1", "owner_id": 1}, {"id": 2, "name": "Todo 2", "owner_id": 2}],
+        )
+        connection.execute(
+            insert(models.TodoItem),
+            [{"id": i, "message": "", "position": "n", "todo_id": i % 2 + 1, "owner_id": None} for i in range(1, 26)],
+        )
+
+    # One commit per id range, each with the rows backfilled so far
+    committed = []
+    event.listen(
+        engine,
+        "commit",
+        lambda connection: committed.append(
+            connection.scalar(select(func.count()).where(models.TodoItem.owner_id.isnot(None)))
+        ),
+    )
+    assert v0003_todo_item_owner_id.backfill_todo_item_owner_id(engine, batch_size=10) == 25
+    assert committed == [9, 19, 25]
+    assert v0003_todo_item_owner_id.backfill_todo_item_owner_id(engine, batch_size=10) == 0
+
+
+def test_upgrade_database_upgrades_every_shard(monkeypatch):
+    engines = [create_engine("sqlite://", poolclass=StaticPool) for _ in range(3)]
+    monkeypatch.setattr(SHARDS, "session_factories", [sessionmaker(bind=engine) for engine in engines])
+
+    names = [module.__name__.rsplit(".", 1)[-1] for module in migrations.get_migrations()]
+    assert upgrade_database() == {0: names, 1: names, 2: names}
+    assert upgrade_database() == {0: [], 1: [], 2: []}
+    for engine in engines:
+        assert "moving" in {column["name"] for column in inspect(engine).get_columns("user")}
+
+
+def test_bootstrap_admin_is_idempotent():
+    assert not bootstrap_admin("admin", "admin")
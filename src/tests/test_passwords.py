@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from tests.conftest import client
+from todo.backend.passwords import PasswordHasher, pwd_context
+from todo.backend.storage import models
+
+
+def test_password_hasher_sheds_load():
+    hasher = PasswordHasher(workers=0, queue_size=1)
+
+    async def hash_concurrently():
+        return await asyncio.gather(hasher.hash("a"), hasher.hash("b"), return_exceptions=True)
+
+    hashed, shed = asyncio.run(hash_concurrently())
+    assert pwd_context.verify("a", hashed)
+    assert isinstance(shed, HTTPException) and shed.status_code == 503
+
+    assert pwd_context.verify("c", asyncio.run(hasher.hash("c")))
+
+
+def test_password_hasher_process_pool():
+    hasher = PasswordHasher(workers=1, queue_size=0)
+    try:
+        verified, new_hashed_password = asyncio.run(hasher.verify_and_update("a", pwd_context.hash("a")))
+        assert verified and new_hashed_password is None
+    finally:
+        hasher.shutdown()
+
+
+def test_password_hasher_replaces_broken_process_pool():
+    hasher = PasswordHasher(workers=1, queue_size=0)
+    try:
+        assert pwd_context.verify("a", asyncio.run(hasher.hash("a")))
+        executor = hasher._executor
+        for process in list(executor._processes.values()):
+            process.kill()
+            process.join()
+
+        # The dead worker broke the pool, the call is retried on a new one
+        assert pwd_context.verify("b", asyncio.run(hasher.hash("b")))
+        assert hasher._executor is not executor
+
+        # A call that breaks every pool it runs on gets a 503, and the next one still works
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(hasher._run(os._exit, 1))
+        assert exc_info.value.status_code == 503
+        assert pwd_context.verify("c", asyncio.run(hasher.hash("c")))
+    finally:
+        hasher.shutdown()
+
+
+def test_create_token_rehashes_password(db):
+    user = db.query(models.User).filter_by(username="user1").one()
+    old_hashed_password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("user1")
+    user.hashed_password = old_hashed_password
+    db.flush()
+
+    response = client.post(
+        "/api/token",
+        data="username=user1&password=user1",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert response.status_code == 200
+
+    db.refresh(user)
+    assert user.hashed_password != old_hashed_password
+    assert not pwd_context.needs_update(user.hashed_password)
+    assert pwd_context.verify("user1", user.hashed_password)
+
+    response = client.post(
+        "/api/token",
+        data="username=user1&password=wrong",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert response.status_code == 401
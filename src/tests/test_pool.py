@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from tests.conftest import client
+from tests.utils import get_token
+from todo.backend.config import CONFIG
+from todo.backend.storage.pool import InstrumentedQueuePool
+
+
+def test_pool_stats_record_timeouts():
+    engine = create_engine(
+        CONFIG.database_url, poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.01
+    )
+    with engine.connect():
+        assert engine.pool.snapshot()["checked_out"] == 1
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+
+    stats = engine.pool.snapshot()
+    assert stats["checked_out"] == 0
+    assert stats["checkouts"] == 1
+    assert stats["timeouts"] == 1
+    assert stats["wait_seconds_max"] >= 0.01
+
+    # Stats are per pool, and survive the pool being recreated
+    other_engine = create_engine(CONFIG.database_url, poolclass=InstrumentedQueuePool)
+    assert other_engine.pool.snapshot()["checkouts"] == 0
+    engine.dispose()
+    assert engine.pool.snapshot()["timeouts"] == 1
+    other_engine.dispose()
+
+
+def test_get_pool_stats():
+    admin_token = get_token("admin")
+    response = client.get("/api/admin/pool", headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.status_code == 200
+    pools = response.json()["pools"]
+    assert pools["primary"]["checkouts"] > 0
+
+    user_1_token = get_token("user1")
+    response = client.get("/api/admin/pool", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 403
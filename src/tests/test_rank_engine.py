@@ -0,0 +1,98 @@
+import pytest
+
+from todo.backend.ranking import get_lexical_rank
+from todo.backend.rank_engine import (
+    INITIAL_RANK,
+    rank_after,
+    rank_before,
+    rank_between,
+    rank_midpoint,
+    rank_range,
+    rank_reorder,
+)
+
+
+def test_rank_midpoint():
+    for lower, upper in [("b", "z"), ("b", "c"), ("bz", "c"), ("b", "bb"), ("i", "z"), ("bcd", "bcdb")]:
+        rank = rank_midpoint(lower, upper)
+        assert lower < rank < upper
+        assert rank == get_lexical_rank(lower, upper).rstrip("a")
+
+    with pytest.raises(ValueError):
+        rank_midpoint("c", "ca")
+    with pytest.raises(ValueError):
+        rank_midpoint("c", "b")
+    with pytest.raises(ValueError):
+        rank_midpoint("B", "c")
+
+
+def test_rank_after():
+    ranks = [INITIAL_RANK]
+    for _ in range(2000):
+        ranks.append(rank_after(ranks[-1]))
+
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == len(ranks)
+    assert len(ranks[-1]) <= 8
+    assert rank_after("z") == "zb"
+    assert rank_after("bz") == "cb"
+
+
+def test_rank_before():
+    ranks = [INITIAL_RANK]
+    for _ in range(2000):
+        ranks.append(rank_before(ranks[-1]))
+
+    assert ranks == sorted(ranks, reverse=True)
+    assert len(set(ranks)) == len(ranks)
+    assert len(ranks[-1]) <= 8
+    assert not any(rank.endswith("a") for rank in ranks)
+
+    with pytest.raises(ValueError):
+        rank_before("a")
+
+
+def test_rank_between():
+    assert rank_between(None, None) == INITIAL_RANK
+    assert rank_between(None, "n") < "n"
+    assert rank_between("n", None) > "n"
+    assert "b" < rank_between("b", "d") < "d"
+
+
+def test_rank_range():
+    assert rank_range(1) == [INITIAL_RANK]
+    assert rank_range(25) == list("bcdefghijklmnopqrstuvwxyz")
+
+    for count, lower, upper in [(1000, None, None), (50000, None, None), (10, "b", "c"), (100, "bcd", "bcdb")]:
+        ranks = rank_range(count, lower, upper)
+        assert len(ranks) == len(set(ranks)) == count
+        assert ranks == sorted(ranks)
+        assert lower is None or lower < ranks[0]
+        assert upper is None or ranks[-1] < upper
+        assert not any(rank.endswith("a") for rank in ranks)
+
+    assert max(len(rank) for rank in rank_range(50000)) == 4
+
+    with pytest.raises(ValueError):
+        rank_range(3, "c", "ca")
+
+
+def test_rank_reorder():
+    assert rank_reorder([]) == []
+    assert rank_reorder(["b", "c", "d"]) == [None, None, None]
+
+    for ranks, kept in [
+        (["d", "c", "b", "e"], 2),
+        (["c", "b", "d", "f", "e"], 3),
+        (["z", "y", "x", "w"], 1),
+        (["b", "b", "c"], 2),
+    ]:
+        new_ranks = rank_reorder(ranks)
+        result = [new_rank or rank for rank, new_rank in zip(ranks, new_ranks)]
+        assert result == sorted(result)
+        assert len(set(result)) == len(result)
+        # Only the items outside the longest increasing run get a new rank
+        assert new_ranks.count(None) == kept
+
+    with pytest.raises(ValueError):
+        rank_reorder(["b", "a"])
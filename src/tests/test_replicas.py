@@ -0,0 +1,82 @@
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+
+from todo.backend.middleware import DBSessionMiddleware, WritePositionMiddleware
+from todo.backend.storage.replicas import WRITE_LSN_COOKIE, ReplicaSet, parse_lsn
+
+
+def make_replica_set(lags: dict, **kwargs) -> ReplicaSet:
+    engines = [create_engine("sqlite://") for _ in lags]
+    lag_by_engine = dict(zip(engines, lags.values()))
+    checks = []
+
+    def lag_query(engine):
+        checks.append(engine)
+        lag = lag_by_engine[engine]
+        if isinstance(lag, Exception):
+            raise lag
+        return lag
+
+    replica_set = ReplicaSet(engines, lag_query=lag_query, **kwargs)
+    replica_set.checks = checks
+    return replica_set
+
+
+def test_replica_set_routes_to_caught_up_replicas():
+    assert ReplicaSet([]).get_session() is None
+    assert parse_lsn("16/B374D848") == 0x16B374D848
+
+    replica_set = make_replica_set(
+        {"lagging": (10_000_000, 0), "broken": Exception("down"), "ok": (100, 0)}, max_lag_bytes=1024
+    )
+    engines = [replica.engine for replica in replica_set.replicas]
+    for _ in range(5):
+        session = replica_set.get_session()
+        assert session.bind is engines[2]
+        session.close()
+
+    # Lag is only checked once per interval
+    assert len(replica_set.checks) == 3
+
+    replica_set = make_replica_set({"lagging": (10_000_000, 0)}, max_lag_bytes=1024)
+    assert replica_set.get_session() is None
+
+
+def test_replica_set_reads_your_writes():
+    replica_set = make_replica_set({"behind": (0, parse_lsn("0/100")), "ok": (0, parse_lsn("1/0"))})
+    engines = [replica.engine for replica in replica_set.replicas]
+    for _ in range(3):
+        session = replica_set.get_session(parse_lsn("0/200"))
+        assert session.bind is engines[1]
+        session.close()
+
+    assert replica_set.get_session(parse_lsn("1/1")) is None
+    assert replica_set.get_session() is not None
+
+
+def test_write_position_cookie_is_set_after_writes():
+    app = FastAPI()
+
+    @app.get("/read")
+    def read():
+        return {}
+
+    @app.post("/write")
+    def write(request: Request, fail: bool = False):
+        request.state.wrote = True
+        if fail:
+            raise HTTPException(400)
+        return {}
+
+    positions = iter([parse_lsn("0/10"), parse_lsn("0/20")])
+    app.add_middleware(DBSessionMiddleware, session_factory=None)
+    app.add_middleware(
+        WritePositionMiddleware, get_position=lambda: next(positions), cookie_name=WRITE_LSN_COOKIE, max_age_seconds=60
+    )
+    client = TestClient(app)
+
+    assert WRITE_LSN_COOKIE not in client.get("/read").cookies
+    assert WRITE_LSN_COOKIE not in client.post("/write", params={"fail": True}).cookies
+    assert client.post("/write").cookies[WRITE_LSN_COOKIE] == str(0x10)
+    assert client.post("/write").cookies[WRITE_LSN_COOKIE] == str(0x20)
@@ -0,0 +1,116 @@
+import random
+
+from tests.conftest import client
+from sqlalchemy import event
+
+from tests.utils import SharedSession, get_token
+from todo.backend.events import PENDING_EVENTS_KEY
+from todo.backend.rank_engine import MAX_RANK_LENGTH, rank_range
+from todo.backend.rerank import RerankStats, RerankWorker, get_rerank_moves
+from todo.backend.storage import models
+from todo.backend.storage.database import engine
+
+
+def test_get_rerank_moves():
+    random.seed(0)
+    positions = sorted(
+        {"".join(random.choices("bcdefghijklmnopqrstuvwxyz", k=random.randint(1, 6))) for _ in range(200)}
+    )
+    current = list(enumerate(positions))
+    targets = rank_range(len(current))
+
+    while True:
+        moves = get_rerank_moves(current, targets, 7)
+        if not moves:
+            break
+
+        new_positions = {move["id"]: move["position"] for move in moves}
+        current = [(id, new_positions.get(id, pos)) for id, pos in current]
+        # The order is the same after every chunk
+        assert [pos for _, pos in current] == sorted(pos for _, pos in current)
+
+    assert [pos for _, pos in current] == targets
+
+
+def test_rerank_stats():
+    stats = RerankStats()
+    stats.record([1, 2, 3, 100, 200], 4, 0.5)
+    stats.record([1], 0, 0.25)
+
+    assert stats.snapshot() == {
+        "todos_reranked": 2,
+        "rows_rewritten": 4,
+        "seconds_spent": 0.75,
+        "key_length_histogram": {1: 2, 2: 1, 4: 1, 128: 1, 256: 1},
+    }
+
+
+def test_create_todo_items_requests_rerank(db):
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    todo.todo_items[-1].position = "z" * MAX_RANK_LENGTH
+    db.flush()
+
+    user_1_token = get_token("user1")
+    response = client.post(
+        "/api/todoitems",
+        headers={"Authorization": f"Bearer {user_1_token}"},
+        json={"todo_id": 1, "message": "Paper Crane 11"},
+    )
+    assert response.status_code == 200
+    db.refresh(todo)
+    assert todo.needs_rerank
+
+
+def test_get_rerank_stats():
+    admin_token = get_token("admin")
+    response = client.get("/api/admin/rerank", headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.status_code == 200
+    assert "key_length_histogram" in response.json()
+
+    user_1_token = get_token("user1")
+    response = client.get("/api/admin/rerank", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 403
+
+
+def test_rerank_worker_reads_items_once(db):
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    todo.needs_rerank = True
+    db.flush()
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        if "todo_item" in statement.split("WHERE")[0]:
+            statements.append((statement.split()[0], executemany))
+
+    worker = RerankWorker(lambda: SharedSession(db), chunk_size=3, stats=RerankStats())
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        assert worker.run_once() == 1
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+    # One read of the list, then one UPDATE per chunk of up to 3 items
+    updates = [statement for statement in statements if statement[0] == "UPDATE"]
+    assert [statement for statement in statements if statement[0] == "SELECT"] == [("SELECT", False)]
+    assert updates and len(updates) <= 4 and not any(executemany for _, executemany in updates)
+
+    db.refresh(todo)
+    assert not todo.needs_rerank
+    positions = db.query(models.TodoItem.position).filter_by(todo_id=1).order_by(models.TodoItem.position)
+    assert [position for position, in positions] == rank_range(10)
+
+
+def test_rerank_worker_records_events(db):
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    todo.needs_rerank = True
+    db.flush()
+
+    RerankWorker(lambda: SharedSession(db), chunk_size=3, stats=RerankStats()).run_once()
+
+    positions = {
+        todo_item_id: position for todo_item_id, position in db.query(models.TodoItem.id, models.TodoItem.position)
+    }
+    events = [todo_event for _, todo_event in db.info[PENDING_EVENTS_KEY]]
+    assert events and all(event["type"] == "reordered" for event in events)
+    assert all(event["todo_item"]["position"] == positions[event["todo_item"]["id"]] for event in events)
+    assert events[0]["todo_item"]["message"].startswith("Paper Crane")
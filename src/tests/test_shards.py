@@ -0,0 +1,130 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from todo.backend.manage import move_user
+from todo.backend.storage import models
+from todo.backend.storage.database import Base
+from todo.backend.storage.shards import SHARDS, IdAllocator
+from todo.backend.storage.storage_manager import StorageManager
+
+
+@pytest.fixture
+def shard_dbs(tmp_path, monkeypatch):
+    # The last database only holds id_block. On Postgres the allocator shares the primary, but a SQLite
+    # file can't take its writes while a test session has an open write transaction on the primary.
+    engines = [create_engine(f"sqlite:///{tmp_path}/shard_{i}.db") for i in range(4)]
+    for engine in engines:
+        # WAL so the open read transactions of the test's sessions don't block the id allocator's writes
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+        Base.metadata.create_all(bind=engine)
+
+    session_factories = [sessionmaker(autocommit=False, autoflush=False, bind=engine) for engine in engines[:3]]
+    monkeypatch.setattr(SHARDS, "session_factories", session_factories)
+    monkeypatch.setattr(SHARDS, "id_allocator", IdAllocator(engines[3], block_size=3))
+
+    dbs = [session_factory() for session_factory in session_factories]
+    yield dbs
+    for db in dbs:
+        db.close()
+
+
+def make_storage_manager(shard_dbs, username):
+    user = shard_dbs[0].query(models.User).filter_by(username=username).one()
+    return StorageManager(shard_dbs[SHARDS.get_index(user)], user, shard_dbs=shard_dbs)
+
+
+def test_shards(shard_dbs):
+    primary = shard_dbs[0]
+    for username, role in [("shard_admin", "admin"), ("alice", "user"), ("bob", "user")]:
+        user = models.User(username=username, hashed_password="", role=role)
+        primary.add(user)
+        primary.flush()
+        SHARDS.place_user(user)
+    primary.commit()
+    assert [SHARDS.get_index(user) for user in primary.query(models.User).order_by(models.User.id)] == [1, 2, 0]
+
+    for username in ["alice", "bob"]:
+        sm = make_storage_manager(shard_dbs, username)
+        for i in range(2):
+            todo = sm.create(models.Todo, {"name": f"{username} {i}"})
+            sm.db.add_all([models.TodoItem(todo_id=todo.id, message=str(j), position=chr(98 + j)) for j in range(4)])
+            sm.db.flush()
+        sm.db.commit()
+
+    # Ids come from id_block, so they are unique across shards
+    todo_ids = [todo_id for db in shard_dbs for todo_id, in db.query(models.Todo.id)]
+    assert len(todo_ids) == len(set(todo_ids)) == 4
+    assert shard_dbs[0].query(models.Todo).count() == shard_dbs[2].query(models.Todo).count() == 2
+
+    alice_sm = make_storage_manager(shard_dbs, "alice")
+    assert [todo.name for todo in alice_sm.list(models.Todo, order_by=[models.Todo.id])] == ["alice 0", "alice 1"]
+    assert alice_sm.get(models.Todo, {"name": "alice 1"}).name == "alice 1"
+    with pytest.raises(HTTPException):
+        alice_sm.get(models.Todo, {"name": "bob 1"})
+
+    admin_sm = make_storage_manager(shard_dbs, "shard_admin")
+    todos = admin_sm.list(models.Todo, order_by=[models.Todo.id])
+    assert [todo.id for todo in todos] == sorted(todo_ids)
+    assert len(admin_sm.list(models.Todo, order_by=[models.Todo.id], limit=3)) == 3
+    todo_items = list(admin_sm.stream(models.TodoItem, order_by=[models.TodoItem.id]))
+    assert [todo_item.id for todo_item in todo_items] == sorted(todo_item.id for todo_item in todo_items)
+    assert len(todo_items) == 16
+    bob_todo = admin_sm.get(models.Todo, {"name": "bob 1"})
+    assert admin_sm.get_db(bob_todo) is shard_dbs[0]
+
+    for db in shard_dbs:
+        db.rollback()
+
+    # Writes wait for a move in flight and are refused while it runs
+    shard_dbs[2].query(models.User).filter_by(id=alice_sm.user.id).update({"moving": True})
+    shard_dbs[2].commit()
+    with pytest.raises(HTTPException) as exc_info:
+        make_storage_manager(shard_dbs, "alice").create(models.Todo, {"name": "alice 2"})
+    assert exc_info.value.status_code == 503
+    assert make_storage_manager(shard_dbs, "bob").create(models.Todo, {"name": "bob 2"}).name == "bob 2"
+    for db in shard_dbs:
+        db.rollback()
+
+    assert move_user("alice", 1, wait_seconds=0) == 2
+    assert shard_dbs[2].query(models.Todo).count() == shard_dbs[2].query(models.TodoItem).count() == 0
+    assert shard_dbs[2].query(models.User).filter_by(id=alice_sm.user.id).count() == 0
+    assert shard_dbs[1].query(models.Todo).count() == 2
+    assert shard_dbs[1].query(models.TodoItem).filter_by(owner_id=alice_sm.user.id).count() == 8
+    shard_dbs[0].expire_all()
+    alice_sm = make_storage_manager(shard_dbs, "alice")
+    assert alice_sm.db is shard_dbs[1]
+    assert not alice_sm.user.moving
+    assert alice_sm.create(models.Todo, {"name": "alice 2"}).name == "alice 2"
+    alice_sm.db.commit()
+    assert move_user("alice", 1, wait_seconds=0) == 0
+
+    # A worker that still has the user from before the move can't write to the old shard
+    with pytest.raises(HTTPException) as exc_info:
+        StorageManager(shard_dbs[2], alice_sm.user, shard_dbs=shard_dbs).create(models.Todo, {"name": "alice 3"})
+    assert exc_info.value.status_code == 503
+
+    # Moving back to the primary
+    for db in shard_dbs:
+        db.rollback()
+    assert move_user("alice", 0, wait_seconds=0) == 3
+    assert shard_dbs[0].query(models.Todo).filter_by(owner_id=alice_sm.user.id).count() == 3
+    assert shard_dbs[1].query(models.Todo).filter_by(owner_id=alice_sm.user.id).count() == 0
+    shard_dbs[0].expire_all()
+    assert make_storage_manager(shard_dbs, "alice").create(models.Todo, {"name": "alice 3"}).name == "alice 3"
+    with pytest.raises(HTTPException):
+        StorageManager(shard_dbs[1], alice_sm.user, shard_dbs=shard_dbs).create(models.Todo, {"name": "alice 4"})
+
+    # Off the primary, where the user's row stays and shard_id fences the old rows
+    for db in shard_dbs:
+        db.rollback()
+    assert move_user("bob", 2, wait_seconds=0) == 2
+    shard_dbs[0].expire_all()
+    bob = shard_dbs[0].query(models.User).filter_by(username="bob").one()
+    assert not bob.moving
+    assert shard_dbs[0].query(models.Todo).filter_by(owner_id=bob.id).count() == 0
+    with pytest.raises(HTTPException):
+        StorageManager(shard_dbs[0], bob, shard_dbs=shard_dbs).create(models.Todo, {"name": "bob 3"})
+    assert make_storage_manager(shard_dbs, "bob").create(models.Todo, {"name": "bob 3"}).name == "bob 3"
@@ -0,0 +1,115 @@
+from fnmatch import fnmatch
+
+from tests.conftest import client
+from tests.utils import get_token
+from todo.backend.storage import models
+from todo.backend.storage.cache import (
+    STORAGE_CACHE,
+    InProcessCacheBackend,
+    RedisCacheBackend,
+    StorageCache,
+    invalidate_touched_tags,
+)
+from todo.backend.storage.storage_manager import StorageManager
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, px=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.values) if fnmatch(key, match)]
+
+
+def test_in_process_backend_evicts_least_recently_used():
+    backend = InProcessCacheBackend(2)
+    backend.set("a", "1")
+    backend.set("b", "2")
+    assert backend.get("a") == "1"
+
+    backend.set("c", "3")
+    assert backend.get("b") is None
+    assert backend.get("a") == "1"
+    assert backend.get("c") == "3"
+    assert backend.size() == 2
+
+
+def test_cached_lists_invalidated_by_writes(db, monkeypatch):
+    monkeypatch.setattr(STORAGE_CACHE, "backend", InProcessCacheBackend(100))
+    user_1_headers = {"Authorization": f"Bearer {get_token('user1')}"}
+    user_2_headers = {"Authorization": f"Bearer {get_token('user2')}"}
+
+    assert client.get("/api/todos", headers=user_1_headers).status_code == 200
+    assert client.get("/api/todos", headers=user_2_headers).status_code == 200
+    before = STORAGE_CACHE.snapshot()
+
+    response = client.get("/api/todos", headers=user_1_headers)
+    assert response.status_code == 200
+    assert [todo["name"] for todo in response.json()["items"]] == ["Todo 1"]
+    assert STORAGE_CACHE.snapshot()["hits"] == before["hits"] + 1
+
+    response = client.post("/api/todos", headers=user_1_headers, json={"name": "Todo 3"})
+    assert response.status_code == 200
+    # Requests only commit the test's savepoint, so end the outer transaction's part by hand
+    invalidate_touched_tags(db)
+
+    response = client.get("/api/todos", headers=user_1_headers)
+    assert [todo["name"] for todo in response.json()["items"]] == ["Todo 1", "Todo 3"]
+    after = STORAGE_CACHE.snapshot()
+    assert after["misses"] == before["misses"] + 1
+    assert after["invalidations"] > before["invalidations"]
+
+    # Other owners keep their entries
+    assert client.get("/api/todos", headers=user_2_headers).status_code == 200
+    assert STORAGE_CACHE.snapshot()["hits"] == after["hits"] + 1
+
+    admin_token = get_token("admin")
+    response = client.get("/api/admin/storage-cache", headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.status_code == 200
+    assert response.json()["hit_ratio"] > 0
+
+
+def test_redis_backend(db):
+    redis = FakeRedis()
+    cache = StorageCache(RedisCacheBackend(redis), 60)
+    user_1 = db.query(models.User).filter_by(username="user1").one()
+    sm = StorageManager(db, user_1, cache=cache)
+
+    todo = sm.get(models.Todo, {"id": 1})
+    cached_todo = sm.get(models.Todo, {"id": 1})
+    assert cached_todo is not todo
+    assert (cached_todo.id, cached_todo.name, cached_todo.owner_id) == (todo.id, todo.name, todo.owner_id)
+    assert cache.snapshot()["hits"] == 1
+    assert all(key.startswith("todo:storage:") for key in redis.values)
+
+    cache.invalidate({"todo:1"})
+    assert sm.get(models.Todo, {"id": 1}) is todo
+    assert cache.snapshot()["misses"] == 2
+
+    cache.clear()
+    assert redis.values == {}
+
+
+def test_cached_body_matches_etag(db, monkeypatch):
+    monkeypatch.setattr(STORAGE_CACHE, "backend", InProcessCacheBackend(100))
+    user_1_headers = {"Authorization": f"Bearer {get_token('user1')}"}
+
+    response = client.get("/api/todos", headers=user_1_headers)
+    etag = response.headers["etag"]
+
+    # Committed by another worker, whose invalidation this process never sees
+    db.query(models.Todo).filter_by(id=1).update({"name": "Renamed", "version": models.Todo.version + 1})
+
+    response = client.get("/api/todos", headers={**user_1_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert [todo["name"] for todo in response.json()["items"]] == ["Renamed"]
@@ -1,6 +1,14 @@
+import json
+
+from sqlalchemy import event
+
 from tests.conftest import client
 from tests.utils import get_token
+from todo.backend.events import PENDING_EVENTS_KEY
+from todo.backend.pagination import encode_cursor
 from todo.backend.storage import models
+from todo.backend.storage.database import engine
+from todo.backend.storage.storage_manager import StorageManager
 
 
 def test_list_todo_items():
@@ -153,3 +161,273 @@ def test_toggle_todo_item():
         f"/api/todoitems/{id}/toggle", headers={"Authorization": f"Bearer {user_2_token}"}, params={"id": id}
     )
     assert response.status_code == 400
+
+
+def test_create_todo_items_appends(db):
+    user_1_token = get_token("user1")
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    positions = {todo_item.id: todo_item.position for todo_item in todo.todo_items}
+    for i in range(30):
+        response = client.post(
+            "/api/todoitems",
+            headers={"Authorization": f"Bearer {user_1_token}"},
+            json={"todo_id": 1, "message": f"Paper Crane {11 + i}"},
+        )
+        assert response.status_code == 200
+        db.expire(todo, ["todo_items"])
+        assert todo.todo_items[-1].id == response.json()["id"]
+
+    assert {ti.id: ti.position for ti in todo.todo_items[:10]} == positions
+
+
+def test_bulk_create_todo_items(db):
+    user_1_token = get_token("user1")
+    messages = [f"Paper Crane {11 + i}" for i in range(500)]
+    response = client.post(
+        "/api/todoitems/bulk",
+        headers={"Authorization": f"Bearer {user_1_token}"},
+        json={"todo_id": 1, "messages": messages},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["message"] for item in data["items"]] == messages
+
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    assert [todo_item.message for todo_item in todo.todo_items[10:]] == messages
+
+    user_2_token = get_token("user2")
+    response = client.post(
+        "/api/todoitems/bulk",
+        headers={"Authorization": f"Bearer {user_2_token}"},
+        json={"todo_id": 1, "messages": messages},
+    )
+    assert response.status_code == 400
+
+
+def test_list_todo_items_pages():
+    admin_token = get_token("admin")
+    items = []
+    cursor = None
+    while True:
+        params = {"limit": 3}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/todoitems", headers={"Authorization": f"Bearer {admin_token}"}, params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["items"]) <= 3
+        items.extend(data["items"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(items) == 20
+    assert len({item["id"] for item in items}) == 20
+    assert [item["todo_id"] for item in items] == sorted(item["todo_id"] for item in items)
+
+    response = client.get(
+        "/api/todoitems", headers={"Authorization": f"Bearer {admin_token}"}, params={"cursor": "not a cursor"}
+    )
+    assert response.status_code == 400
+
+
+def test_list_todo_items_ndjson():
+    admin_token = get_token("admin")
+    response = client.get(
+        "/api/todoitems", headers={"Authorization": f"Bearer {admin_token}", "Accept": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert len(items) == 20
+
+    user_1_token = get_token("user1")
+    response = client.get(
+        "/api/todoitems",
+        headers={"Authorization": f"Bearer {user_1_token}", "Accept": "application/x-ndjson"},
+        params={"todo_id": 1},
+    )
+    assert response.status_code == 200
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert [item["message"] for item in items] == [f"Paper Crane {i + 1}" for i in range(10)]
+
+
+def test_todo_item_owner_id_follows_todo(db):
+    user_1 = db.query(models.User).filter_by(username="user1").one()
+    user_2 = db.query(models.User).filter_by(username="user2").one()
+    todo_1 = db.query(models.Todo).filter_by(owner_id=user_1.id).first()
+    todo_2 = db.query(models.Todo).filter_by(owner_id=user_2.id).first()
+
+    todo_item = todo_1.todo_items[0]
+    todo_item.todo_id = todo_2.id
+    db.flush()
+    db.refresh(todo_item)
+    assert todo_item.owner_id == user_2.id
+
+    todo_2.owner_id = user_1.id
+    db.flush()
+    assert {owner_id for owner_id, in db.query(models.TodoItem.owner_id).filter_by(todo_id=todo_2.id)} == {user_1.id}
+
+    # Ownership filters only touch todo_item
+    query = db.query(models.TodoItem).filter_by(owner_id=user_1.id)
+    assert " todo " not in str(query.statement.compile()).replace("\n", " ")
+
+
+def test_todo_item_queries_stay_on_todo_item(db):
+    user_1 = db.query(models.User).filter_by(username="user1").one()
+    order_by = [models.TodoItem.todo_id, models.TodoItem.position, models.TodoItem.id]
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(" ".join(statement.split()))
+
+    def list_todo_items():
+        sm = StorageManager(db, user_1)
+        event.listen(engine, "before_cursor_execute", record_statement)
+        try:
+            sm.list(models.TodoItem, None, order_by, limit=5)
+            sm.bulk_update(models.TodoItem, None, {"active": True})
+        finally:
+            event.remove(engine, "before_cursor_execute", record_statement)
+
+    # The ids of purging todos come from their own query, items are filtered on owner_id and todo_id alone
+    list_todo_items()
+    todo_item_statements = [statement for statement in statements if "todo_item" in statement]
+    assert all(" todo " not in statement and "EXISTS" not in statement for statement in todo_item_statements)
+    assert all(" NOT IN " not in statement for statement in todo_item_statements)
+
+    db.query(models.Todo).filter_by(id=1).update({"needs_purge": True})
+    statements.clear()
+    list_todo_items()
+    todo_item_statements = [statement for statement in statements if "todo_item.owner_id = ?" in statement]
+    assert todo_item_statements
+    assert all(" todo " not in statement and " NOT IN " in statement for statement in todo_item_statements)
+
+
+def test_list_todo_items_etag(db):
+    user_1_token = get_token("user1")
+    headers = {"Authorization": f"Bearer {user_1_token}"}
+    response = client.get("/api/todoitems", headers=headers, params={"todo_id": 1})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = client.get("/api/todoitems", headers={**headers, "If-None-Match": etag}, params={"todo_id": 1})
+    assert response.status_code == 304
+
+    # Other pages and formats of the same list get their own ETag
+    response = client.get(
+        "/api/todoitems", headers={**headers, "If-None-Match": etag}, params={"todo_id": 1, "limit": 1}
+    )
+    assert response.status_code == 200
+
+    version = db.query(models.Todo.version).filter_by(id=1).scalar()
+    response = client.put("/api/todoitems/1/toggle", headers=headers)
+    assert response.status_code == 200
+    assert db.query(models.Todo.version).filter_by(id=1).scalar() == version + 1
+
+    response = client.get("/api/todoitems", headers={**headers, "If-None-Match": etag}, params={"todo_id": 1})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = client.post("/api/todoitems", headers=headers, json={"todo_id": 1, "message": "Paper Frog"})
+    assert response.status_code == 200
+
+    response = client.get("/api/todoitems", headers={**headers, "If-None-Match": etag}, params={"todo_id": 1})
+    assert response.status_code == 200
+    assert response.json()["items"][-1]["message"] == "Paper Frog"
+
+
+def test_bulk_toggle_and_delete_todo_items(db):
+    user_1_token = get_token("user1")
+    user_2_token = get_token("user2")
+    version = db.query(models.Todo.version).filter_by(id=1).scalar()
+
+    # Ownership is part of the statement, so other users' items are never touched
+    response = client.put(
+        "/api/todoitems/bulk/toggle",
+        headers={"Authorization": f"Bearer {user_2_token}"},
+        json={"todo_id": 1, "set_active": False},
+    )
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+
+    response = client.put(
+        "/api/todoitems/bulk/toggle",
+        headers={"Authorization": f"Bearer {user_1_token}"},
+        json={"todo_id": 1, "set_active": False},
+    )
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert len(items) == 10
+    assert not any(item["active"] for item in items)
+    assert db.query(models.TodoItem).filter_by(todo_id=1, active=True).count() == 0
+    assert db.query(models.Todo.version).filter_by(id=1).scalar() == version + 1
+
+    response = client.put(
+        "/api/todoitems/bulk/toggle", headers={"Authorization": f"Bearer {user_1_token}"}, json={"ids": [1, 2, 11]}
+    )
+    assert response.status_code == 200
+    assert [(item["id"], item["active"]) for item in response.json()["items"]] == [(1, True), (2, True)]
+
+    response = client.post(
+        "/api/todoitems/bulk/delete",
+        headers={"Authorization": f"Bearer {user_1_token}"},
+        json={"todo_id": 1, "active": False},
+    )
+    assert response.status_code == 200
+    assert len(response.json()["items"]) == 8
+    assert [todo_item.id for todo_item in db.query(models.TodoItem).filter_by(todo_id=1)] == [1, 2]
+
+    response = client.post(
+        "/api/todoitems/bulk/delete", headers={"Authorization": f"Bearer {user_1_token}"}, json={"active": False}
+    )
+    assert response.status_code == 400
+
+
+def test_single_statement_todo_item_writes(db):
+    user_1_token = get_token("user1")
+    todo_item = db.query(models.TodoItem).filter_by(id=2).one()
+    version = db.query(models.Todo.version).filter_by(id=1).scalar()
+    db.info.pop(PENDING_EVENTS_KEY, None)
+
+    response = client.put("/api/todoitems/2/toggle", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 200
+    assert not response.json()["active"]
+    # Objects the session already held are refreshed from the row
+    assert not todo_item.active
+
+    response = client.put(
+        "/api/todoitems/2", headers={"Authorization": f"Bearer {user_1_token}"}, json={"message": "Renamed"}
+    )
+    assert response.status_code == 200
+    assert response.json()["message"] == "Renamed"
+
+    response = client.delete("/api/todoitems/2", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 200
+    assert db.query(models.TodoItem).filter_by(id=2).count() == 0
+
+    response = client.delete("/api/todoitems/2", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 400
+
+    assert db.query(models.Todo.version).filter_by(id=1).scalar() == version + 3
+    events = [todo_item_event["type"] for todo_id, todo_item_event in db.info.pop(PENDING_EVENTS_KEY)]
+    assert events == ["toggled", "updated", "deleted"]
+
+
+def test_list_todo_items_malformed_cursors():
+    admin_token = get_token("admin")
+    # todo_id, position, id
+    for values in [["x", "a", 1], [{}, "a", 1], [1, 2, 3], [True, "a", 1], [1, "a", None], [1, "a", 1.5], [1, "a"]]:
+        response = client.get(
+            "/api/todoitems",
+            headers={"Authorization": f"Bearer {admin_token}"},
+            params={"cursor": encode_cursor(values)},
+        )
+        assert response.status_code == 400, values
+
+    response = client.get(
+        "/api/todoitems",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        params={"cursor": encode_cursor([1, "a", 1])},
+    )
+    assert response.status_code == 200
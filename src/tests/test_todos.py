@@ -1,6 +1,14 @@
+from sqlalchemy import event
+
 from tests.conftest import client
-from tests.utils import get_token
+from tests.utils import SharedSession, get_token
+from todo.backend.config import CONFIG
+from todo.backend.pagination import encode_cursor
+from todo.backend.events import PENDING_EVENTS_KEY
+from todo.backend.purge import PurgeWorker
 from todo.backend.storage import models
+from todo.backend.storage.cache import STORAGE_CACHE, InProcessCacheBackend, invalidate_touched_tags
+from todo.backend.storage.database import engine
 
 
 def test_authentication():
@@ -133,6 +141,50 @@ def test_delete_todo(db):
     assert todo not in todos
 
 
+def test_delete_todo_cascades_to_items(db):
+    user_1_token = get_token("user1")
+    response = client.delete("/api/todos/1", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 200
+    assert db.query(models.TodoItem).filter_by(todo_id=1).count() == 0
+
+
+def test_delete_large_todo_is_purged(db, monkeypatch):
+    monkeypatch.setattr(CONFIG, "purge_threshold", 5)
+    user_1_token = get_token("user1")
+    response = client.delete("/api/todos/1", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 202
+    assert response.json()["id"] == 1
+
+    # Gone for requests right away, the items are deleted by the purge worker
+    response = client.get("/api/todos/1", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 400
+    response = client.get("/api/todos", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.json()["items"] == []
+    assert db.query(models.TodoItem).filter_by(todo_id=1).count() == 10
+
+    # So are its items, for reads and writes
+    headers = {"Authorization": f"Bearer {user_1_token}"}
+    todo_item_id = db.query(models.TodoItem.id).filter_by(todo_id=1).first()[0]
+    response = client.get("/api/todoitems", headers=headers, params={"todo_id": 1})
+    assert response.json()["items"] == []
+    assert client.get(f"/api/todoitems/{todo_item_id}", headers=headers).status_code == 400
+    assert client.put(f"/api/todoitems/{todo_item_id}/toggle", headers=headers).status_code == 400
+    assert client.put(f"/api/todoitems/{todo_item_id}", headers=headers, json={"message": "x"}).status_code == 400
+    assert client.delete(f"/api/todoitems/{todo_item_id}", headers=headers).status_code == 400
+    assert db.query(models.TodoItem).filter_by(todo_id=1).count() == 10
+
+    monkeypatch.setattr(STORAGE_CACHE, "backend", InProcessCacheBackend(100))
+    worker = PurgeWorker(lambda: SharedSession(db), chunk_size=3)
+    assert worker.purge(1) == 10
+    # The worker's commits would invalidate the todo's cached rows
+    invalidations = STORAGE_CACHE.snapshot()["invalidations"]
+    invalidate_touched_tags(db)
+    assert STORAGE_CACHE.snapshot()["invalidations"] == invalidations + 3
+    assert db.query(models.Todo).filter_by(id=1).count() == 0
+    assert db.query(models.TodoItem).filter_by(todo_id=1).count() == 0
+    assert worker.run_once() == 0
+
+
 def test_reorder_todo(db):
     id = 1
     admin_token = get_token("admin")
@@ -174,3 +226,270 @@ def test_reorder_todo(db):
         json={"todo_item_id": todo_item.id, "insert_idx": 7},
     )
     assert response.status_code == 400
+
+
+def test_rerank_todo_items(db):
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    todo_item_ids = [todo_item.id for todo_item in todo.todo_items]
+
+    todo.rerank_todo_items()
+
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    assert [todo_item.id for todo_item in todo.todo_items] == todo_item_ids
+    assert [todo_item.position for todo_item in todo.todo_items] == ["c", "e", "h", "j", "l", "o", "q", "s", "v", "x"]
+
+    # Subscribers see every item move, not just the ones a reorder asked for
+    events = [todo_event for _, todo_event in db.info[PENDING_EVENTS_KEY]]
+    assert [(event["type"], event["todo_item"]["position"]) for event in events] == [
+        ("reordered", todo_item.position) for todo_item in todo.todo_items
+    ]
+
+
+def test_write_positions_in_chunked_updates(db):
+    todo = db.query(models.Todo).filter_by(id=1).one()
+    statements = []
+
+    def record_item_updates(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE todo_item"):
+            statements.append(executemany)
+
+    event.listen(engine, "before_cursor_execute", record_item_updates)
+    try:
+        models.write_positions(db, {todo_item.id: f"b{i}" for i, todo_item in enumerate(todo.todo_items)}, 4)
+    finally:
+        event.remove(engine, "before_cursor_execute", record_item_updates)
+
+    # 10 items in chunks of 4, never an executemany
+    assert statements == [False, False, False]
+    positions = db.query(models.TodoItem.position).filter_by(todo_id=1).order_by(models.TodoItem.id)
+    assert [position for position, in positions] == [f"b{i}" for i in range(10)]
+
+
+def test_reorder_todo_only_moves_item(db):
+    id = 1
+    user_1_token = get_token("user1")
+    todo = db.query(models.Todo).filter_by(id=id).one()
+    positions = {todo_item.id: todo_item.position for todo_item in todo.todo_items}
+    todo_item = todo.todo_items[2]
+    response = client.put(
+        f"/api/todos/{id}/reorder",
+        headers={"Authorization": f"Bearer {user_1_token}"},
+        json={"todo_item_id": todo_item.id, "insert_idx": 6},
+    )
+    assert response.status_code == 204
+    assert todo.todo_items[6] == todo_item
+    assert {ti.id: ti.position for ti in todo.todo_items if ti != todo_item} == {
+        id: position for id, position in positions.items() if id != todo_item.id
+    }
+
+
+def test_batch_reorder_todo(db):
+    id = 1
+    user_1_token = get_token("user1")
+    todo = db.query(models.Todo).filter_by(id=id).one()
+    todo_item_ids = [todo_item.id for todo_item in todo.todo_items]
+    positions = {todo_item.id: todo_item.position for todo_item in todo.todo_items}
+
+    moves = [
+        {"todo_item_id": todo_item_ids[1], "insert_idx": 8},
+        {"todo_item_id": todo_item_ids[3], "insert_idx": 9},
+    ]
+    response = client.put(
+        f"/api/todos/{id}/reorder/batch", headers={"Authorization": f"Bearer {user_1_token}"}, json={"moves": moves}
+    )
+    assert response.status_code == 204
+    expected = [todo_item_ids[i] for i in [0, 2, 4, 5, 6, 7, 8, 1, 9, 3]]
+    assert [todo_item.id for todo_item in todo.todo_items] == expected
+    # Items already in order keep their positions
+    assert {ti.id: ti.position for ti in todo.todo_items if ti.id not in todo_item_ids[1:4:2]} == {
+        id: position for id, position in positions.items() if id not in todo_item_ids[1:4:2]
+    }
+
+    # Moving items before the first rank reranks the todo first
+    response = client.put(
+        f"/api/todos/{id}/reorder/batch",
+        headers={"Authorization": f"Bearer {user_1_token}"},
+        json={"order": todo_item_ids[::-1]},
+    )
+    assert response.status_code == 204
+    assert [todo_item.id for todo_item in todo.todo_items] == todo_item_ids[::-1]
+
+    for request_data in [{"order": todo_item_ids[1:]}, {}, {"moves": [{"todo_item_id": 11, "insert_idx": 0}]}]:
+        response = client.put(
+            f"/api/todos/{id}/reorder/batch", headers={"Authorization": f"Bearer {user_1_token}"}, json=request_data
+        )
+        assert response.status_code == 400
+
+    user_2_token = get_token("user2")
+    response = client.put(
+        f"/api/todos/{id}/reorder/batch",
+        headers={"Authorization": f"Bearer {user_2_token}"},
+        json={"order": todo_item_ids},
+    )
+    assert response.status_code == 400
+
+
+def test_list_todo_pages():
+    admin_token = get_token("admin")
+    response = client.get("/api/todos", headers={"Authorization": f"Bearer {admin_token}"}, params={"limit": 1})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["items"]) == 1
+    assert data["next_cursor"] is not None
+
+    response = client.get(
+        "/api/todos",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        params={"limit": 1, "cursor": data["next_cursor"]},
+    )
+    assert response.status_code == 200
+    next_data = response.json()
+    assert len(next_data["items"]) == 1
+    assert next_data["items"][0]["id"] > data["items"][0]["id"]
+    assert next_data["next_cursor"] is None
+
+    for values in [["x"], [{}], [True], [None]]:
+        response = client.get(
+            "/api/todos", headers={"Authorization": f"Bearer {admin_token}"}, params={"cursor": encode_cursor(values)}
+        )
+        assert response.status_code == 400, values
+
+
+def test_get_todo_etag():
+    user_1_token = get_token("user1")
+    response = client.get("/api/todos/1", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = client.get("/api/todos/1", headers={"Authorization": f"Bearer {user_1_token}", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    response = client.put("/api/todos/1", headers={"Authorization": f"Bearer {user_1_token}"}, json={"name": "Renamed"})
+    assert response.status_code == 200
+
+    response = client.get("/api/todos/1", headers={"Authorization": f"Bearer {user_1_token}", "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["name"] == "Renamed"
+    assert response.headers["etag"] != etag
+
+    response = client.get("/api/todos", headers={"Authorization": f"Bearer {user_1_token}"})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = client.get("/api/todos", headers={"Authorization": f"Bearer {user_1_token}", "If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.post("/api/todos", headers={"Authorization": f"Bearer {user_1_token}"}, json={"name": "New"})
+    assert response.status_code == 200
+
+    response = client.get("/api/todos", headers={"Authorization": f"Bearer {user_1_token}", "If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_list_todos_etag_after_delete_and_create(db):
+    # The same count, max, sum of ids and sum of versions as before, but not the same todos
+    user_1 = db.query(models.User).filter_by(username="user1").one()
+    db.add_all([models.Todo(id=todo_id, name=str(todo_id), owner_id=user_1.id) for todo_id in (10, 20, 30)])
+    db.flush()
+
+    headers = {"Authorization": f"Bearer {get_token('user1')}"}
+    response = client.get("/api/todos", headers=headers)
+    etag = response.headers["etag"]
+
+    db.query(models.Todo).filter(models.Todo.id.in_([10, 20])).delete(synchronize_session=False)
+    db.add_all([models.Todo(id=todo_id, name=str(todo_id), owner_id=user_1.id) for todo_id in (12, 18)])
+    db.flush()
+
+    response = client.get("/api/todos", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_list_todos_etag_is_scoped_to_the_page(db):
+    user_1 = db.query(models.User).filter_by(username="user1").one()
+    db.add_all([models.Todo(id=todo_id, name=str(todo_id), owner_id=user_1.id) for todo_id in (10, 20, 30)])
+    db.flush()
+    headers = {"Authorization": f"Bearer {get_token('user1')}"}
+    params = {"limit": 1, "cursor": encode_cursor([1])}
+
+    statements = []
+
+    def count_todo_selects(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT todo.id AS todo_id, todo.version AS todo_version \n"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", count_todo_selects)
+    try:
+        response = client.get("/api/todos", headers=headers, params=params)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_todo_selects)
+    assert [todo["id"] for todo in response.json()["items"]] == [10]
+    etag = response.headers["etag"]
+    # Only the page's todo and the one after it are read for the ETag
+    ((statement, parameters),) = statements
+    assert "LIMIT" in statement and 2 in parameters
+
+    # Todos after the next one aren't part of the page
+    db.query(models.Todo).filter_by(id=30).update({"version": models.Todo.version + 1})
+    response = client.get("/api/todos", headers={**headers, "If-None-Match": etag}, params=params)
+    assert response.status_code == 304
+
+    # The next one decides next_cursor
+    db.query(models.Todo).filter_by(id=20).delete()
+    response = client.get("/api/todos", headers={**headers, "If-None-Match": etag}, params=params)
+    assert response.status_code == 200
+
+
+def test_list_todos_include_items():
+    admin_token = get_token("admin")
+    statements = []
+
+    def count_item_selects(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT") and "FROM todo_item" in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_item_selects)
+    try:
+        response = client.get(
+            "/api/todos", headers={"Authorization": f"Bearer {admin_token}"}, params={"include": "items"}
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", count_item_selects)
+
+    assert response.status_code == 200
+    todo_1, todo_2 = sorted(response.json()["items"], key=lambda todo: todo["name"])
+    assert [todo_item["message"] for todo_item in todo_1["items"]] == [f"Paper Crane {i + 1}" for i in range(10)]
+    assert {todo_item["todo_id"] for todo_item in todo_2["items"]} == {todo_2["id"]}
+    # The items of every todo on the page come from one query, besides the ETag's versions
+    assert len(statements) == 1
+
+    response = client.get(
+        "/api/todos", headers={"Authorization": f"Bearer {admin_token}"}, params={"include": "items", "items_limit": 2}
+    )
+    assert [len(todo["items"]) for todo in response.json()["items"]] == [2, 2]
+
+    response = client.get("/api/todos", headers={"Authorization": f"Bearer {admin_token}"})
+    assert "items" not in response.json()["items"][0]
+
+    response = client.get("/api/todos", headers={"Authorization": f"Bearer {admin_token}"}, params={"include": "x"})
+    assert response.status_code == 422
+
+    user_2_token = get_token("user2")
+    response = client.get(
+        "/api/todos/1", headers={"Authorization": f"Bearer {user_2_token}"}, params={"include": "items"}
+    )
+    assert response.status_code == 400
+
+    user_1_token = get_token("user1")
+    response = client.get(
+        "/api/todos/1",
+        headers={"Authorization": f"Bearer {user_1_token}"},
+        params={"include": "items", "items_limit": 3},
+    )
+    assert response.status_code == 200
+    assert [todo_item["message"] for todo_item in response.json()["items"]] == [
+        "Paper Crane 1",
+        "Paper Crane 2",
+        "Paper Crane 3",
+    ]
@@ -0,0 +1,86 @@
+from tests.conftest import client
+from tests.test_storage_cache import FakeRedis
+from tests.utils import get_token
+from todo.backend.storage import models
+from todo.backend.storage.cache import RedisCacheBackend
+from todo.backend.user_cache import USER_CACHE, UserCache, invalidate_touched_users
+
+
+def test_update_user_role(db):
+    user_2 = db.query(models.User).filter_by(username="user2").one()
+    user_2_token = get_token("user2")
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {user_2_token}"})
+    assert response.status_code == 200
+    assert response.json()["role"] == "user"
+
+    hits = USER_CACHE.hits
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {user_2_token}"})
+    assert response.json()["role"] == "user"
+    assert USER_CACHE.hits == hits + 1
+
+    response = client.put(
+        f"/api/users/{user_2.id}", headers={"Authorization": f"Bearer {user_2_token}"}, json={"role": "admin"}
+    )
+    assert response.status_code == 403
+
+    admin_token = get_token("admin")
+    response = client.put(
+        f"/api/users/{user_2.id}", headers={"Authorization": f"Bearer {admin_token}"}, json={"role": "admin"}
+    )
+    assert response.status_code == 200
+    assert response.json()["role"] == "admin"
+
+    # Invalidated once the transaction commits, which the test session never does
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {user_2_token}"})
+    assert response.json()["role"] == "user"
+    invalidate_touched_users(db)
+
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {user_2_token}"})
+    assert response.json()["role"] == "admin"
+
+
+def test_user_cache_invalidation(db):
+    user_1 = db.query(models.User).filter_by(username="user1").one()
+    USER_CACHE.set(user_1)
+
+    # Renames and deletes invalidate by id too
+    user_1.username = "user1-renamed"
+    db.flush()
+    assert USER_CACHE.get("user1") is not None
+    invalidate_touched_users(db)
+    assert USER_CACHE.get("user1") is None
+
+    # A load that started before an invalidation may hold the old row and isn't cached
+    generation = USER_CACHE.generation
+    USER_CACHE.invalidate([user_1.id])
+    USER_CACHE.set(user_1, generation)
+    assert USER_CACHE.get("user1-renamed") is None
+    USER_CACHE.set(user_1, USER_CACHE.generation)
+    assert USER_CACHE.get("user1-renamed") is not None
+
+    user_3 = models.User(username="user3", hashed_password="", role="user")
+    db.add(user_3)
+    db.flush()
+    USER_CACHE.set(user_3)
+    db.delete(user_3)
+    db.flush()
+    invalidate_touched_users(db)
+    assert USER_CACHE.get("user3") is None
+
+
+def test_user_cache_invalidation_reaches_other_workers(db):
+    backend = RedisCacheBackend(FakeRedis())
+    worker_1, worker_2 = UserCache(10, 60, backend), UserCache(10, 60, backend)
+    user_1 = db.query(models.User).filter_by(username="user1").one()
+    worker_1.set(user_1)
+    generation = worker_2.generation
+    worker_2.set(user_1, generation)
+
+    worker_1.invalidate([user_1.id])
+    assert worker_1.get("user1") is None
+    assert worker_2.get("user1") is None
+    # A load that started before the other worker's invalidation isn't cached either
+    worker_2.set(user_1, generation)
+    assert worker_2.get("user1") is None
+    worker_2.set(user_1, worker_2.generation)
+    assert worker_2.get("user1") is not None
@@ -97,9 +97,18 @@ def todos():
 @todos.command()
 @click.option("--url", default="http://127.0.0.1:8000", envvar="TODO_URL")
 @click.option("-t", "--token", required=True, envvar="TODO_TOKEN", help="Token required to authorize this command")
-def list(url: str, token: str):
+@click.option("-l", "--limit", type=int, help="Maximum number of todos to list")
+@click.option("-c", "--cursor", help="Cursor returned as next_cursor by the previous page")
+def list(url: str, token: str, limit: Optional[int], cursor: Optional[str]):
     request_url = f"{url}/api/todos"
-    response = requests.get(request_url, headers={"Authorization": f"Bearer {token}"})
+
+    params = {}
+    if limit:
+        params["limit"] = limit
+    if cursor:
+        params["cursor"] = cursor
+
+    response = requests.get(request_url, headers={"Authorization": f"Bearer {token}"}, params=params)
     response_data = response.json()
     print(json.dumps(response_data, indent=4))
 
@@ -178,12 +187,18 @@ def todo_items():
 @click.option(
     "-tid", "--todo_id", help="ID of todo whose items will be listed. If not given, items of all todos will be listed."
 )
-def list(url: str, token: str, todo_id: int):
+@click.option("-l", "--limit", type=int, help="Maximum number of todo items to list")
+@click.option("-c", "--cursor", help="Cursor returned as next_cursor by the previous page")
+def list(url: str, token: str, todo_id: int, limit: Optional[int], cursor: Optional[str]):
     request_url = f"{url}/api/todoitems"
 
     filters = {}
     if todo_id:
         filters["todo_id"] = todo_id
+    if limit:
+        filters["limit"] = limit
+    if cursor:
+        filters["cursor"] = cursor
 
     response = requests.get(request_url, headers={"Authorization": f"Bearer {token}"}, params=filters)
     response_data = response.json()
@@ -204,6 +219,24 @@ def create(url: str, token: str, todo_id: int, message: str):
     print(json.dumps(response_data, indent=4))
 
 
+@todo_items.command(name="import")
+@click.argument("file", type=click.File("r"))
+@click.option("--url", default="http://127.0.0.1:8000", envvar="TODO_URL")
+@click.option("-t", "--token", required=True, envvar="TODO_TOKEN", help="Token required to authorize this command")
+@click.option("-tid", "--todo_id", required=True, help="ID of todo in which todo items will be placed")
+def import_(url: str, token: str, todo_id: int, file):
+    """
+    Creates a todo item for every non-empty line of FILE.
+    """
+    request_url = f"{url}/api/todoitems/bulk"
+    messages = [line.strip() for line in file if line.strip()]
+    response = requests.post(
+        request_url, headers={"Authorization": f"Bearer {token}"}, json={"todo_id": todo_id, "messages": messages}
+    )
+    response_data = response.json()
+    print(json.dumps(response_data, indent=4))
+
+
 @todo_items.command()
 @click.argument("id")
 @click.option("--url", default="http://127.0.0.1:8000", envvar="TODO_URL")
@@ -249,5 +282,47 @@ def toggle(url: str, id: int, token: str):
     print(json.dumps(response_data, indent=4))
 
 
+@todo_cli.group()
+def db():
+    """
+    Runs deploy tasks directly against the databases in TODO_DATABASE_URL and TODO_SHARD_DATABASE_URLS.
+    """
+
+
+@db.command()
+@click.option("--target", type=int, help="Stop after this migration version")
+def upgrade(target: Optional[int]):
+    from todo.backend.manage import upgrade_database
+
+    for shard_index, applied in upgrade_database(target).items():
+        for name in applied:
+            print(f"Applied {name} to shard {shard_index}")
+        if not applied:
+            print(f"Shard {shard_index} is up to date")
+
+
+@db.command(name="bootstrap-admin")
+@click.option("-u", "--username", default="admin", help="Username of the admin user")
+@click.option(
+    "-p", "--password", envvar="TODO_ADMIN_PASSWORD", help="Password of the admin user, prompted if not given"
+)
+def bootstrap_admin(username: str, password: Optional[str]):
+    from todo.backend.manage import bootstrap_admin
+
+    if bootstrap_admin(username, password or getpass()):
+        print(f"Created admin user '{username}'")
+    else:
+        print(f"User '{username}' already exists")
+
+
+@db.command(name="move-user")
+@click.argument("username")
+@click.argument("shard", type=int)
+def move_user(username: str, shard: int):
+    from todo.backend.manage import move_user
+
+    print(f"Moved {move_user(username, shard)} todos of '{username}' to shard {shard}")
+
+
 if __name__ == "__main__":
     todo_cli()
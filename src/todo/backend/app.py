@@ -1,48 +1,83 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import FastAPI, Request, Response, HTTPException
+import anyio
+from fastapi.routing import APIRoute
+from fastapi import APIRouter, FastAPI
 
+from todo.backend.config import CONFIG
+from todo.backend.events import EVENT_HUB
+from todo.backend.middleware import DBSessionMiddleware, WritePositionMiddleware
+from todo.backend.passwords import PASSWORD_HASHER
 from todo.backend.storage.database import SessionLocal
-from todo.backend.routes import todos, todo_items, users
-from todo.backend.storage.models import User
-
-
-async def db_session_middleware(request: Request, call_next):
-    response = Response("Internal server error", status_code=500)
-    try:
-        request.state.db = SessionLocal()
-        response = await call_next(request)
-        if response.status_code < 300:
-            request.state.db.commit()
-        else:
-            request.state.db.rollback()
-    except Exception:
-        request.state.db.rollback()
-        raise
-    finally:
-        request.state.db.close()
-    return response
-
-
-async def setup_bootstrap_admin():
-    try:
-        db = SessionLocal()
-        admin_user = db.query(User).filter_by(username="admin").one_or_none()
-
-        if admin_user is None:
-            admin_user = User(username="admin", hashed_password=users.hash_password("admin"), role="admin")
-            db.add(admin_user)
-            db.commit()
-    finally:
-        db.close()
+from todo.backend.storage.replicas import WRITE_LSN_COOKIE, get_primary_lsn
+from todo.backend.storage.shards import SHARDS
+from todo.backend.routes import admin, todos, todo_items, users
+from todo.backend.purge import PurgeWorker
+from todo.backend.rerank import RerankWorker
+
+
+async def setup_threadpool():
+    # Sync routes, dependencies and bcrypt all share this pool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = CONFIG.threadpool_size
+
+
+def include_async_routers(app: FastAPI):
+    from todo.backend.routes import async_todo_items, async_todos, async_users
+
+    async_routers = [async_todos.router, async_todo_items.router, async_users.router]
+    async_endpoints = {
+        (route.path, method) for router in async_routers for route in router.routes for method in route.methods
+    }
+    # Routes without an async version (reorder, bulk writes, admin...) keep running on the sync session. They
+    # go first so fixed paths like /api/todoitems/bulk/toggle aren't shadowed by async /{id}/toggle routes, and
+    # through include_router so they honour app.dependency_overrides like every other route.
+    sync_router = APIRouter()
+    for router in [todos.router, todo_items.router, users.router, admin.router]:
+        for route in router.routes:
+            if isinstance(route, APIRoute) and any(
+                (route.path, method) not in async_endpoints for method in route.methods
+            ):
+                sync_router.routes.append(route)
+
+    app.include_router(sync_router)
+    for router in async_routers:
+        app.include_router(router)
 
 
 def init_app() -> FastAPI:
+    if CONFIG.async_routes and SHARDS.enabled:
+        raise RuntimeError("TODO_ASYNC_ROUTES can't be used together with TODO_SHARD_DATABASE_URLS")
+
     app = FastAPI()
-    app.add_middleware(BaseHTTPMiddleware, dispatch=db_session_middleware)
-    app.add_event_handler("startup", setup_bootstrap_admin)
+    app.add_middleware(DBSessionMiddleware, session_factory=SessionLocal)
+    for i, session_factory in enumerate(SHARDS.session_factories[1:], 1):
+        app.add_middleware(DBSessionMiddleware, session_factory=session_factory, state_key=f"shard_db_{i}")
+    if CONFIG.replica_database_urls:
+        app.add_middleware(DBSessionMiddleware, session_factory=None, state_key="replica_db")
+    if CONFIG.async_routes:
+        from todo.backend.storage.async_database import AsyncSessionLocal
+
+        app.add_middleware(DBSessionMiddleware, session_factory=AsyncSessionLocal, state_key="async_db")
+    if CONFIG.replica_database_urls:
+        app.add_middleware(
+            WritePositionMiddleware,
+            get_position=get_primary_lsn,
+            cookie_name=WRITE_LSN_COOKIE,
+            max_age_seconds=CONFIG.replica_sticky_seconds,
+        )
+    app.add_event_handler("startup", setup_threadpool)
+    app.add_event_handler("shutdown", PASSWORD_HASHER.shutdown)
+    app.add_event_handler("shutdown", EVENT_HUB.stop)
+
+    for session_factory in SHARDS.session_factories:
+        for worker in [RerankWorker(session_factory), PurgeWorker(session_factory)]:
+            app.add_event_handler("startup", worker.start)
+            app.add_event_handler("shutdown", worker.stop)
 
-    app.include_router(todos.router)
-    app.include_router(todo_items.router)
-    app.include_router(users.router)
+    if CONFIG.async_routes:
+        include_async_routers(app)
+    else:
+        app.include_router(todos.router)
+        app.include_router(todo_items.router)
+        app.include_router(users.router)
+        app.include_router(admin.router)
 
     return app
@@ -1,4 +1,5 @@
 import os
+from typing import List
 
 
 class Config:
@@ -7,6 +8,50 @@ class Config:
         self.algorithm: str = os.environ.get("TODO_ALGORITHM", "HS256")
         self.access_token_expire_minutes: int = int(os.environ.get("TODO_ACCESS_TOKEN_EXPIRE_MINUTES", "300"))
         self.database_url: str = os.environ["TODO_DATABASE_URL"]
+        self.pool_size: int = int(os.environ.get("TODO_POOL_SIZE", "5"))
+        self.pool_max_overflow: int = int(os.environ.get("TODO_POOL_MAX_OVERFLOW", "10"))
+        self.pool_timeout_seconds: float = float(os.environ.get("TODO_POOL_TIMEOUT_SECONDS", "30"))
+        self.pool_recycle_seconds: int = int(os.environ.get("TODO_POOL_RECYCLE_SECONDS", "-1"))
+        self.pool_pre_ping: bool = os.environ.get("TODO_POOL_PRE_PING", "1") == "1"
+        self.replica_database_urls: List[str] = [
+            url for url in os.environ.get("TODO_REPLICA_DATABASE_URLS", "").split(",") if url
+        ]
+        self.replica_max_lag_bytes: int = int(os.environ.get("TODO_REPLICA_MAX_LAG_BYTES", "1048576"))
+        self.replica_lag_check_interval_seconds: float = float(
+            os.environ.get("TODO_REPLICA_LAG_CHECK_INTERVAL_SECONDS", "1")
+        )
+        # How long a client's write position cookie lives, replicas further behind than that serve it stale reads
+        self.replica_sticky_seconds: float = float(os.environ.get("TODO_REPLICA_STICKY_SECONDS", "60"))
+        self.shard_database_urls: List[str] = [
+            url for url in os.environ.get("TODO_SHARD_DATABASE_URLS", "").split(",") if url
+        ]
+        self.id_block_size: int = int(os.environ.get("TODO_ID_BLOCK_SIZE", "1000"))
+        self.async_database_url: str = os.environ.get(
+            "TODO_ASYNC_DATABASE_URL", self.database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        )
+        self.async_routes: bool = os.environ.get("TODO_ASYNC_ROUTES", "0") == "1"
+        self.threadpool_size: int = int(os.environ.get("TODO_THREADPOOL_SIZE", "40"))
+        self.password_schemes: List[str] = os.environ.get("TODO_PASSWORD_SCHEMES", "bcrypt").split(",")
+        self.bcrypt_rounds: int = int(os.environ.get("TODO_BCRYPT_ROUNDS", "12"))
+        self.argon2_time_cost: int = int(os.environ.get("TODO_ARGON2_TIME_COST", "3"))
+        self.argon2_memory_cost: int = int(os.environ.get("TODO_ARGON2_MEMORY_COST", "65536"))
+        self.password_workers: int = int(os.environ.get("TODO_PASSWORD_WORKERS", "2"))
+        self.password_queue_size: int = int(os.environ.get("TODO_PASSWORD_QUEUE_SIZE", "32"))
+        self.rerank_interval_seconds: float = float(os.environ.get("TODO_RERANK_INTERVAL_SECONDS", "5"))
+        self.rerank_chunk_size: int = int(os.environ.get("TODO_RERANK_CHUNK_SIZE", "1000"))
+        self.purge_threshold: int = int(os.environ.get("TODO_PURGE_THRESHOLD", "1000"))
+        self.purge_interval_seconds: float = float(os.environ.get("TODO_PURGE_INTERVAL_SECONDS", "5"))
+        self.purge_chunk_size: int = int(os.environ.get("TODO_PURGE_CHUNK_SIZE", "1000"))
+        self.user_cache_size: int = int(os.environ.get("TODO_USER_CACHE_SIZE", "1024"))
+        self.user_cache_ttl_seconds: float = float(os.environ.get("TODO_USER_CACHE_TTL_SECONDS", "60"))
+        # 0 turns the storage cache off unless TODO_STORAGE_CACHE_URL points it at a redis server
+        self.storage_cache_size: int = int(os.environ.get("TODO_STORAGE_CACHE_SIZE", "0"))
+        self.storage_cache_ttl_seconds: float = float(os.environ.get("TODO_STORAGE_CACHE_TTL_SECONDS", "30"))
+        self.storage_cache_url: str = os.environ.get("TODO_STORAGE_CACHE_URL", "")
+        # A redis server shared by all workers, without one events only reach streams of the same worker
+        self.events_url: str = os.environ.get("TODO_EVENTS_URL", "")
+        self.events_max_pending: int = int(os.environ.get("TODO_EVENTS_MAX_PENDING", "1000"))
+        self.events_keepalive_seconds: float = float(os.environ.get("TODO_EVENTS_KEEPALIVE_SECONDS", "15"))
 
 
 CONFIG = Config()
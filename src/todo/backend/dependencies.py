@@ -1,23 +1,40 @@
+from typing import Callable, List, Optional
+
 from fastapi import HTTPException, Request, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 
 from todo.backend.config import CONFIG
+from todo.backend.storage.cache import STORAGE_CACHE
 from todo.backend.storage.models import User
+from todo.backend.storage.replicas import REPLICAS, WRITE_LSN_COOKIE
+from todo.backend.storage.shards import SHARDS
 from todo.backend.storage.storage_manager import StorageManager
+from todo.backend.storage.async_storage_manager import AsyncStorageManager
+from todo.backend.user_cache import USER_CACHE
 
 
 def get_db(request: Request):
-    return request.state.db
+    return request.state.db.get()
+
+
+def get_session_factories() -> List[Callable[[], Session]]:
+    return SHARDS.session_factories
+
+
+def get_shard_dbs(request: Request, db: Session = Depends(get_db)) -> List[Session]:
+    return [db] + [getattr(request.state, f"shard_db_{i}").get() for i in range(1, len(SHARDS.session_factories))]
 
 
 def get_oauth2_scheme():
     return OAuth2PasswordBearer(tokenUrl="/api/token")
 
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(get_oauth2_scheme())):
+def get_token_username(token: str = Depends(get_oauth2_scheme())) -> str:
     credentials_exception = HTTPException(
         401, headers={"WWW-Authentication": "Bearer"}, detail="Could not validate credentials"
     )
@@ -30,13 +47,77 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(get_oau
     except JWTError:
         raise credentials_exception
 
+    return username
+
+
+def get_current_user(db: Session = Depends(get_db), username: str = Depends(get_token_username)):
+    user = USER_CACHE.get(username)
+    if user is not None:
+        return user
+
+    generation = USER_CACHE.generation
     user = db.query(User).filter_by(username=username).one_or_none()
 
     if user is None:
-        raise credentials_exception
+        raise HTTPException(401, headers={"WWW-Authentication": "Bearer"}, detail="Could not validate credentials")
+
+    USER_CACHE.set(user, generation)
+
+    return user
+
+
+def get_admin_user(user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(403, detail="Only admin users can access this route")
+
+    return user
+
+
+def get_read_db(request: Request) -> Optional[Session]:
+    # GET requests read from a replica when one is caught up, and past the client's last write if it made one
+    if request.method != "GET" or not REPLICAS.replicas:
+        return None
+
+    try:
+        min_lsn = int(request.cookies.get(WRITE_LSN_COOKIE, 0))
+    except ValueError:
+        min_lsn = 0
+    return request.state.replica_db.get(lambda: REPLICAS.get_session(min_lsn))
+
+
+def get_storage_manager(
+    request: Request,
+    shard_dbs: List[Session] = Depends(get_shard_dbs),
+    read_db: Optional[Session] = Depends(get_read_db),
+    user: User = Depends(get_current_user),
+):
+    if request.method != "GET":
+        request.state.wrote = True
+
+    # Only reads go through the cache, writes need rows attached to their session
+    cache = STORAGE_CACHE if request.method == "GET" else None
+    return StorageManager(shard_dbs[SHARDS.get_index(user)], user, read_db, shard_dbs, cache)
+
+
+def get_async_db(request: Request):
+    return request.state.async_db.get()
+
+
+async def get_async_current_user(db: AsyncSession = Depends(get_async_db), username: str = Depends(get_token_username)):
+    user = USER_CACHE.get(username)
+    if user is not None:
+        return user
+
+    generation = USER_CACHE.generation
+    user = (await db.execute(select(User).filter_by(username=username))).scalars().one_or_none()
+
+    if user is None:
+        raise HTTPException(401, headers={"WWW-Authentication": "Bearer"}, detail="Could not validate credentials")
+
+    USER_CACHE.set(user, generation)
 
     return user
 
 
-def get_storage_manager(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    return StorageManager(db, user)
+def get_async_storage_manager(db: AsyncSession = Depends(get_async_db), user: User = Depends(get_async_current_user)):
+    return AsyncStorageManager(db, user)
@@ -0,0 +1,68 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request, Response
+from todo.backend.storage.models import Todo
+from todo.backend.streaming import wants_ndjson
+
+# Every change to a todo or its items bumps todo.version and ids are never reused, so the (id, version) pairs
+# of the todos in id order only repeat when a list of todos or todo items would. Sums of them can repeat
+# after a delete and a create, so the ETag hashes every pair instead, read without loading any rows. Pages
+# only read the pairs of the todos they are made of, the get_*_versions_query functions return the arguments
+# of stream_columns or list_columns for them.
+TODO_VERSION_COLUMNS = [Todo.id, Todo.version]
+
+
+def get_todo_versions_query(todo_id: int) -> Dict[str, Any]:
+    return {"filters": {"id": todo_id}, "order_by": TODO_VERSION_COLUMNS}
+
+
+def get_todos_versions_query(request: Request, after: Optional[List[Any]], limit: int) -> Dict[str, Any]:
+    # The todos of the page and the one after it, which decides next_cursor. NDJSON has every todo.
+    where = [] if after is None else [Todo.id > after[0]]
+    if wants_ndjson(request):
+        return {"filters": None, "order_by": TODO_VERSION_COLUMNS, "where": where}
+    return {"filters": None, "order_by": TODO_VERSION_COLUMNS, "where": where, "limit": limit + 1}
+
+
+def get_todo_items_versions_query(
+    request: Request, todo_id: Optional[int], after: Optional[List[Any]], limit: int
+) -> Dict[str, Any]:
+    if todo_id is not None:
+        return get_todo_versions_query(todo_id)
+
+    # Pages are ordered by todo_id first, so the limit + 1 items of a page and the one after it belong to at
+    # most that many of the todos with items, starting with the cursor's todo
+    where = [] if after is None else [Todo.id >= after[0]]
+    if wants_ndjson(request):
+        return {"filters": None, "order_by": TODO_VERSION_COLUMNS, "where": where}
+    where.append(Todo.todo_items.any())
+    return {"filters": None, "order_by": TODO_VERSION_COLUMNS, "where": where, "limit": limit + 1}
+
+
+def make_etag(request: Request, user_id: int, versions: Iterable[Tuple[Any, ...]]) -> str:
+    # The same versions render differently per user, page and format
+    digest = hashlib.sha1(repr((user_id, request.url.query, request.headers.get("accept"))).encode())
+    for row in versions:
+        digest.update(repr(tuple(row)).encode())
+    return f'W/"{digest.hexdigest()}"'
+
+
+def _opaque_tag(etag: str) -> str:
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def check_etag(request: Request, response: Response, etag: str) -> Optional[Response]:
+    # Returns a 304 when the client's copy is current, otherwise tags the response
+    response.headers["ETag"] = etag
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+
+    tags = {_opaque_tag(tag.strip()) for tag in if_none_match.split(",")}
+    if "*" in tags or _opaque_tag(etag) in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return None
@@ -0,0 +1,258 @@
+import asyncio
+import contextlib
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from fastapi.logger import logger
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from todo.backend.config import CONFIG
+from todo.backend.storage.models import Todo, TodoItem
+
+# Todo item changes are collected when a session flushes and published per todo once its transaction
+# commits. Every worker subscribes to the pub/sub backend and forwards messages to its own SSE streams.
+# Deleting a todo deletes its items in the database, without an event per item, so subscribers get a single
+# todo_deleted event instead and their stream ends.
+
+EVENTS_MEDIA_TYPE = "text/event-stream"
+CHANNEL_PREFIX = "todo:events:"
+PENDING_EVENTS_KEY = "todo_events_pending"
+TODO_ITEM_EVENT_FIELDS = ("id", "message", "active", "todo_id", "owner_id", "position")
+TODO_DELETED_EVENT = "todo_deleted"
+
+
+class LocalPubSub:
+    # Stand-in for redis when every subscriber lives in this process
+    def __init__(self):
+        self.callback: Optional[Callable[[str, str], None]] = None
+
+    def start(self, callback: Callable[[str, str], None]):
+        self.callback = callback
+
+    def stop(self):
+        self.callback = None
+
+    def publish(self, channel: str, message: str):
+        if self.callback is not None:
+            self.callback(channel, message)
+
+
+class RedisPubSub:
+    def __init__(self, client: Any):
+        self.client = client
+        self._pubsub = None
+        self._thread = None
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisPubSub":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("TODO_EVENTS_URL needs the cache extra (pip install todo[cache])")
+
+        return cls(redis.Redis.from_url(url, decode_responses=True))
+
+    def start(self, callback: Callable[[str, str], None]):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(**{CHANNEL_PREFIX + "*": lambda message: callback(message["channel"], message["data"])})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+    def publish(self, channel: str, message: str):
+        self.client.publish(channel, message)
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_pending: int):
+        self.loop = loop
+        self.max_pending = max_pending
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        self.overflowed = False
+
+    def put(self, message: str):
+        # Runs on the subscriber's loop. A subscriber this far behind has to re-fetch anyway, so it gets
+        # None and its stream ends instead of buffering without bound.
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self.max_pending:
+            self.overflowed = True
+            self.queue.put_nowait(None)
+            return
+        self.queue.put_nowait(message)
+
+
+class EventHub:
+    def __init__(self, pubsub: Any, max_pending: int):
+        self.pubsub = pubsub
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._started = False
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+
+    def _ensure_started(self):
+        # Workers that never get a subscriber never open a pub/sub connection
+        with self._lock:
+            if not self._started:
+                self.pubsub.start(self._deliver)
+                self._started = True
+
+    def stop(self):
+        with self._lock:
+            if self._started:
+                self.pubsub.stop()
+                self._started = False
+
+    def publish(self, todo_id: int, events: List[Dict[str, Any]]):
+        self.pubsub.publish(f"{CHANNEL_PREFIX}{todo_id}", json.dumps(events))
+
+    def _deliver(self, channel: str, message: str):
+        # Called from whichever thread committed or read from redis
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # The subscriber's loop is closed, its stream is going away
+                pass
+
+    @contextlib.contextmanager
+    def subscribe(self, todo_id: int) -> Iterator[Subscription]:
+        self._ensure_started()
+
+        channel = f"{CHANNEL_PREFIX}{todo_id}"
+        subscription = Subscription(asyncio.get_running_loop(), self.max_pending)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscriptions = self._subscriptions.get(channel, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(channel, None)
+
+
+def make_pubsub() -> Any:
+    if CONFIG.events_url:
+        return RedisPubSub.from_url(CONFIG.events_url)
+    return LocalPubSub()
+
+
+EVENT_HUB = EventHub(make_pubsub(), CONFIG.events_max_pending)
+
+
+def get_todo_item_event_type(todo_item: TodoItem) -> Optional[str]:
+    state = inspect(todo_item)
+    if state.attrs.message.history.has_changes() or state.attrs.todo_id.history.has_changes():
+        return "updated"
+    if state.attrs.active.history.has_changes():
+        return "toggled"
+    if state.attrs.position.history.has_changes():
+        return "reordered"
+    return None
+
+
+def make_todo_item_event(event_type: str, todo_item: TodoItem) -> Dict[str, Any]:
+    values = inspect(todo_item).dict
+    return {"type": event_type, "todo_item": {field: values.get(field) for field in TODO_ITEM_EVENT_FIELDS}}
+
+
+@event.listens_for(Session, "after_flush")
+def collect_todo_item_events(session: Session, flush_context):
+    pending = session.info.setdefault(PENDING_EVENTS_KEY, [])
+    for obj in session.new:
+        if isinstance(obj, TodoItem):
+            pending.append((obj.todo_id, make_todo_item_event("created", obj)))
+    for obj in session.dirty:
+        if isinstance(obj, TodoItem):
+            event_type = get_todo_item_event_type(obj)
+            if event_type is not None:
+                pending.append((obj.todo_id, make_todo_item_event(event_type, obj)))
+        elif isinstance(obj, Todo) and obj.needs_purge and inspect(obj).attrs.needs_purge.history.added:
+            # Todos marked needs_purge are gone for clients, the purge worker deletes them without a flush
+            pending.append((obj.id, {"type": TODO_DELETED_EVENT, "todo": {"id": obj.id}}))
+    for obj in session.deleted:
+        if isinstance(obj, TodoItem):
+            pending.append((obj.todo_id, make_todo_item_event("deleted", obj)))
+        elif isinstance(obj, Todo):
+            pending.append((obj.id, {"type": TODO_DELETED_EVENT, "todo": {"id": obj.id}}))
+
+
+def add_todo_item_events(session: Session, event_type: str, rows: Iterable[Dict[str, Any]]):
+    # For bulk writes, which never flush. rows hold at least TODO_ITEM_EVENT_FIELDS.
+    pending = session.info.setdefault(PENDING_EVENTS_KEY, [])
+    for row in rows:
+        values = {field: row[field] for field in TODO_ITEM_EVENT_FIELDS}
+        pending.append((values["todo_id"], {"type": event_type, "todo_item": values}))
+
+
+def record_todo_item_events(session: Session, event_type: str, todo_item_ids: Iterable[int]):
+    # Reads the items back, for bulk writes that don't return them
+    columns = [getattr(TodoItem, field) for field in TODO_ITEM_EVENT_FIELDS]
+    rows = session.query(*columns).filter(TodoItem.id.in_(list(todo_item_ids))).order_by(TodoItem.position)
+    add_todo_item_events(session, event_type, [dict(zip(TODO_ITEM_EVENT_FIELDS, row)) for row in rows])
+
+
+@event.listens_for(Session, "after_commit")
+def publish_todo_item_events(session: Session):
+    pending = session.info.pop(PENDING_EVENTS_KEY, None)
+    if not pending:
+        return
+
+    # One message per todo keeps the events of a transaction together and in order
+    events_by_todo: Dict[int, List[Dict[str, Any]]] = {}
+    for todo_id, todo_event in pending:
+        events_by_todo.setdefault(todo_id, []).append(todo_event)
+
+    for todo_id, events in events_by_todo.items():
+        try:
+            EVENT_HUB.publish(todo_id, events)
+        except Exception:
+            # The write is already committed, subscribers catch up when they re-fetch
+            logger.exception("Publishing events of todo %s failed", todo_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_todo_item_events(session: Session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(PENDING_EVENTS_KEY, None)
+
+
+def format_event(event_type: str, data: Any) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_todo_events(todo_id: int):
+    with EVENT_HUB.subscribe(todo_id) as subscription:
+        # Anything committed before this line isn't sent, clients re-fetch once they see it
+        yield ": subscribed\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), CONFIG.events_keepalive_seconds)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the connection, and finds out when the client is gone
+                yield ": keep-alive\n\n"
+                continue
+
+            if message is None:
+                yield format_event("overflow", None)
+                return
+
+            for todo_event in json.loads(message):
+                if todo_event["type"] == TODO_DELETED_EVENT:
+                    # Its items went with it, clients drop the todo instead of waiting for item events
+                    yield format_event(TODO_DELETED_EVENT, todo_event["todo"])
+                    return
+                yield format_event(todo_event["type"], todo_event["todo_item"])
@@ -0,0 +1,107 @@
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from todo.backend.config import CONFIG
+
+from todo.backend.passwords import hash_password
+from todo.backend.storage import migrations
+from todo.backend.storage.database import SessionLocal
+from todo.backend.storage.models import Todo, TodoItem, User
+from todo.backend.storage.shards import SHARDS
+
+# One-shot deploy tasks, run through `todo-cli db ...` rather than in every worker's startup
+
+
+def upgrade_database(target: Optional[int] = None) -> Dict[int, List[str]]:
+    # Every shard has the whole schema, the primary (shard 0) is upgraded first
+    return {
+        index: migrations.upgrade(session_factory.kw["bind"], target)
+        for index, session_factory in enumerate(SHARDS.session_factories)
+    }
+
+
+def bootstrap_admin(username: str, password: str) -> bool:
+    db: Session = SessionLocal()
+    try:
+        if db.query(User.id).filter_by(username=username).one_or_none() is not None:
+            return False
+
+        db.add(User(username=username, hashed_password=hash_password(password), role="admin"))
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def delete_user_rows(db: Session, user_id: int):
+    db.query(TodoItem).filter_by(owner_id=user_id).delete(synchronize_session=False)
+    db.query(Todo).filter_by(owner_id=user_id).delete(synchronize_session=False)
+
+
+def copy_user_rows(source: Session, target: Session, user_id: int) -> int:
+    todo_table, todo_item_table = Todo.__table__, TodoItem.__table__
+    todo_rows = source.execute(select(todo_table).where(todo_table.c.owner_id == user_id)).mappings().all()
+    todo_item_rows = (
+        source.execute(select(todo_item_table).where(todo_item_table.c.owner_id == user_id)).mappings().all()
+    )
+    if todo_rows:
+        target.execute(insert(todo_table), [dict(row) for row in todo_rows])
+    if todo_item_rows:
+        target.execute(insert(todo_item_table), [dict(row) for row in todo_item_rows])
+
+    return len(todo_rows)
+
+
+def move_user(username: str, shard_index: int, wait_seconds: float = CONFIG.user_cache_ttl_seconds) -> int:
+    # Fences the user's writes on their shard, copies their todos and items to shard_index, points the user at
+    # it, then deletes the old rows. Setting moving waits for the writes in flight, which hold a lock on the
+    # user's row (see StorageManager._fence), and later ones fail with 503. Workers that cached the user keep
+    # reading the old shard until their copy expires, so the old rows are deleted wait_seconds later. No lock
+    # is held in the meantime, and a move that fails half way can be run again.
+    if not 0 <= shard_index < len(SHARDS.session_factories):
+        raise ValueError(f"Shard {shard_index} doesn't exist")
+
+    primary = SHARDS.session_factories[0]()
+    try:
+        user = primary.query(User).filter_by(username=username).one()
+        source_index = SHARDS.get_index(user)
+        if source_index == shard_index:
+            return 0
+        # Nothing is held on the primary while the user's row is written from the other sessions
+        primary.rollback()
+
+        source = SHARDS.session_factories[source_index]()
+        target = SHARDS.session_factories[shard_index]()
+        try:
+            source.query(User).filter_by(id=user.id).update({"moving": True}, synchronize_session=False)
+            source.commit()
+
+            # Rows left behind by a move that failed before pointing the user at shard_index
+            delete_user_rows(target, user.id)
+            if shard_index != 0:
+                SHARDS.ensure_user_stub(target, user)
+            moved = copy_user_rows(source, target, user.id)
+            target.commit()
+
+            primary.refresh(user, with_for_update=True)
+            if SHARDS.get_index(user) != source_index:
+                raise RuntimeError(f"User '{username}' was moved by someone else")
+            user.shard_id = shard_index
+            user.moving = False
+            primary.commit()
+
+            time.sleep(wait_seconds)
+            delete_user_rows(source, user.id)
+            if source_index != 0:
+                source.query(User).filter_by(id=user.id).delete(synchronize_session=False)
+            source.commit()
+
+            return moved
+        finally:
+            source.close()
+            target.close()
+    finally:
+        primary.close()
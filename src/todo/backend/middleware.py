@@ -0,0 +1,102 @@
+from typing import Any, Callable, Optional
+
+from fastapi.logger import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class LazySession:
+    def __init__(self, session_factory: Optional[Callable[[], Any]]):
+        self.session_factory = session_factory
+        self.session: Optional[Any] = None
+
+    def get(self, session_factory: Optional[Callable[[], Any]] = None) -> Any:
+        # session_factory overrides the middleware's one for sessions that depend on the request
+        if self.session is None:
+            self.session = (session_factory or self.session_factory)()
+        return self.session
+
+    async def finish(self, commit: bool):
+        # Sync sessions block on the database, so they are committed from the threadpool
+        if self.session is None:
+            return
+
+        session, self.session = self.session, None
+        if isinstance(session, AsyncSession):
+            try:
+                await (session.commit() if commit else session.rollback())
+            finally:
+                await session.close()
+        else:
+            try:
+                await run_in_threadpool(session.commit if commit else session.rollback)
+            finally:
+                await run_in_threadpool(session.close)
+
+
+# Puts a LazySession into request.state under state_key. Requests that never call get_db never open a
+# session, and the transaction is finished before the response starts so the connection goes back to the
+# pool while the body is still being sent.
+class DBSessionMiddleware:
+    def __init__(self, app: ASGIApp, session_factory: Optional[Callable[[], Any]], state_key: str = "db"):
+        self.app = app
+        self.session_factory = session_factory
+        self.state_key = state_key
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        lazy_session = LazySession(self.session_factory)
+        scope.setdefault("state", {})[self.state_key] = lazy_session
+
+        async def send_after_finish(message: Message):
+            if message["type"] == "http.response.start":
+                # If the commit fails nothing has been sent yet, so the error still turns into a 500
+                await lazy_session.finish(commit=message["status"] < 300)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_after_finish)
+        finally:
+            await lazy_session.finish(commit=False)
+
+
+# Sets a cookie with the primary's write position on successful responses to requests that wrote, flagged with
+# request.state.wrote. Added after the DBSessionMiddlewares so it wraps them and the position is read once their
+# transactions committed. Every worker routes the client's next reads by it, not just the one that served the write.
+class WritePositionMiddleware:
+    def __init__(self, app: ASGIApp, get_position: Callable[[], int], cookie_name: str, max_age_seconds: float):
+        self.app = app
+        self.get_position = get_position
+        self.cookie_name = cookie_name
+        self.max_age_seconds = max_age_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_position(message: Message):
+            if (
+                message["type"] == "http.response.start"
+                and message["status"] < 300
+                and scope.get("state", {}).get("wrote")
+            ):
+                try:
+                    position = await run_in_threadpool(self.get_position)
+                except Exception:
+                    # The write went through, the client only loses read-your-writes for this one
+                    logger.exception("Failed to read the write position")
+                else:
+                    MutableHeaders(scope=message).append(
+                        "set-cookie",
+                        f"{self.cookie_name}={position}; Max-Age={int(self.max_age_seconds)}; Path=/; HttpOnly; "
+                        "SameSite=lax",
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_with_position)
@@ -0,0 +1,68 @@
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, Optional, Type
+
+from fastapi import HTTPException
+
+from todo.backend.storage.async_storage_manager import AsyncStorageManager
+from todo.backend.storage.storage_manager import OwnerIdGeneric, StorageManager
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str, order_by: List[Any]) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(400, detail="Invalid cursor")
+
+    if not isinstance(values, list) or len(values) != len(order_by):
+        raise HTTPException(400, detail="Invalid cursor")
+
+    # Values of the wrong type would only fail in the database. bool is an int, but never a valid one here.
+    for value, column in zip(values, order_by):
+        if type(value) is not column.type.python_type:
+            raise HTTPException(400, detail="Invalid cursor")
+
+    return values
+
+
+def make_page(items: List[Any], order_by: List[Any], limit: int) -> dict:
+    # items holds up to limit + 1 rows, the extra one only tells us whether there is a next page
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in order_by])
+
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def paginate(
+    sm: StorageManager,
+    model_cls: Type[OwnerIdGeneric],
+    filters: Optional[Dict[str, Any]],
+    order_by: List[Any],
+    limit: int,
+    cursor: Optional[str] = None,
+) -> dict:
+    # order_by must be unique per row so it can be used as the keyset for the next page
+    after = decode_cursor(cursor, order_by) if cursor is not None else None
+    return make_page(sm.list(model_cls, filters, order_by, limit=limit + 1, after=after), order_by, limit)
+
+
+async def paginate_async(
+    sm: AsyncStorageManager,
+    model_cls: Type[OwnerIdGeneric],
+    filters: Optional[Dict[str, Any]],
+    order_by: List[Any],
+    limit: int,
+    cursor: Optional[str] = None,
+) -> dict:
+    after = decode_cursor(cursor, order_by) if cursor is not None else None
+    return make_page(await sm.list(model_cls, filters, order_by, limit=limit + 1, after=after), order_by, limit)
@@ -0,0 +1,102 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.logger import logger
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+from todo.backend.config import CONFIG
+
+
+def make_crypt_context() -> CryptContext:
+    # The first scheme hashes new passwords, hashes in any other scheme or with other cost settings are
+    # rehashed the next time their user logs in
+    settings = {}
+    if "bcrypt" in CONFIG.password_schemes:
+        settings["bcrypt__rounds"] = CONFIG.bcrypt_rounds
+    if "argon2" in CONFIG.password_schemes:
+        settings["argon2__time_cost"] = CONFIG.argon2_time_cost
+        settings["argon2__memory_cost"] = CONFIG.argon2_memory_cost
+
+    return CryptContext(schemes=CONFIG.password_schemes, deprecated="auto", **settings)
+
+
+pwd_context = make_crypt_context()
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = CONFIG.password_workers, queue_size: int = CONFIG.password_queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                # spawn rather than fork, the server process has threads (threadpool, rerank worker)
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _reset_executor(self, executor: Executor):
+        # Only the first request to see the broken pool replaces it
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, func: Callable, *args):
+        # A worker that dies (killed, out of memory) breaks the whole pool, so it is replaced and the call
+        # retried once on the new one
+        for _ in range(2):
+            executor = self._get_executor()
+            try:
+                return await asyncio.wrap_future(executor.submit(func, *args))
+            except BrokenProcessPool:
+                logger.warning("Password process pool is broken, starting a new one")
+                self._reset_executor(executor)
+
+        raise HTTPException(503, headers={"Retry-After": "1"}, detail="Password hashing is unavailable, try again")
+
+    async def _run(self, func: Callable, *args):
+        with self._lock:
+            if self.pending >= self.workers + self.queue_size:
+                raise HTTPException(503, headers={"Retry-After": "1"}, detail="Too many password requests, try again")
+            self.pending += 1
+
+        try:
+            if self.workers == 0:
+                return await run_in_threadpool(func, *args)
+            return await self._submit(func, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(verify_and_update_password, password, hashed_password)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+PASSWORD_HASHER = PasswordHasher()
@@ -0,0 +1,64 @@
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from todo.backend.config import CONFIG
+from todo.backend.storage.cache import record_touched_rows
+from todo.backend.storage.models import Todo, TodoItem
+from todo.backend.worker import PeriodicWorker
+
+
+class PurgeWorker(PeriodicWorker):
+    # Deletes todos marked needs_purge, chunk_size items per transaction and then the todo itself, so
+    # deleting a huge todo never holds a request or a long transaction
+    name = "purge-worker"
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        interval_seconds: float = CONFIG.purge_interval_seconds,
+        chunk_size: int = CONFIG.purge_chunk_size,
+    ):
+        super().__init__(interval_seconds)
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            todo_ids = [todo_id for todo_id, in db.query(Todo.id).filter_by(needs_purge=True).order_by(Todo.id)]
+        finally:
+            db.close()
+
+        for todo_id in todo_ids:
+            self.purge(todo_id)
+
+        return len(todo_ids)
+
+    def purge(self, todo_id: int) -> int:
+        deleted = 0
+        while True:
+            db = self.session_factory()
+            try:
+                # Query.delete skips the flush listeners, so the cached rows of the todo are invalidated by hand
+                owner_id = db.query(Todo.owner_id).filter_by(id=todo_id).scalar()
+                record_touched_rows(db, Todo, [{"id": todo_id, "owner_id": owner_id}])
+
+                chunk = db.query(TodoItem.id).filter_by(todo_id=todo_id).limit(self.chunk_size)
+                count = (
+                    db.query(TodoItem)
+                    .filter(TodoItem.id.in_(chunk.scalar_subquery()))
+                    .delete(synchronize_session=False)
+                )
+                if not count:
+                    db.query(Todo).filter_by(id=todo_id, needs_purge=True).delete(synchronize_session=False)
+                    db.commit()
+                    return deleted
+
+                db.commit()
+                deleted += count
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
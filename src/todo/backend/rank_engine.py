@@ -0,0 +1,204 @@
+from typing import List, Optional
+
+# Ranks are base 26 fractions written with the digits "a" (0) to "z" (25). All arithmetic happens on
+# bytearrays of digit values so a rank costs O(L) to compute, no matter how long the keys get.
+
+INITIAL_RANK = "n"
+MAX_RANK_LENGTH = 128
+
+_BASE = 26
+_ALPHABET = b"abcdefghijklmnopqrstuvwxyz"
+_TO_DIGITS = bytes.maketrans(_ALPHABET, bytes(range(_BASE)))
+_FROM_DIGITS = bytes.maketrans(bytes(range(_BASE)), _ALPHABET)
+
+
+def _to_digits(rank: str, length: int) -> bytearray:
+    if not rank or not rank.isascii() or not rank.islower() or not rank.isalpha():
+        raise ValueError(f"Invalid rank {rank!r}. Ranks must be non-empty strings of lowercase letters.")
+
+    return bytearray(rank.ljust(length, "a"), "ascii").translate(_TO_DIGITS)
+
+
+def _from_digits(digits: bytearray) -> str:
+    return digits.translate(_FROM_DIGITS).decode("ascii")
+
+
+def rank_midpoint(lower: str, upper: str) -> str:
+    length = max(len(lower), len(upper))
+    lower_digits = _to_digits(lower, length)
+    upper_digits = _to_digits(upper, length)
+
+    # Add the two ranks digit by digit, then halve the sum from the most significant digit down
+    total = bytearray(length)
+    carry = 0
+    for i in range(length - 1, -1, -1):
+        digit_sum = lower_digits[i] + upper_digits[i] + carry
+        carry = digit_sum >= _BASE
+        total[i] = digit_sum - _BASE if carry else digit_sum
+
+    remainder = carry
+    for i in range(length):
+        current = remainder * _BASE + total[i]
+        total[i] = current >> 1
+        remainder = current & 1
+
+    if total == lower_digits:
+        rank = lower.ljust(length, "a") + "n"
+    else:
+        rank = _from_digits(total).rstrip("a")
+
+    if not lower < rank < upper:
+        raise ValueError(f"No rank exists between {lower!r} and {upper!r}")
+
+    return rank
+
+
+def rank_after(rank: str) -> str:
+    digits = _to_digits(rank, len(rank))
+
+    i = len(digits) - 1
+    while i >= 0 and digits[i] == _BASE - 1:
+        i -= 1
+
+    if i < 0:
+        # Every digit is already "z", so double the length to leave room for later appends
+        return rank + "a" * (len(rank) - 1) + "b"
+
+    digits[i] += 1
+    if i < len(digits) - 1:
+        digits[i + 1 :] = bytes(len(digits) - i - 1)
+        digits[-1] = 1
+
+    return _from_digits(digits)
+
+
+def rank_before(rank: str) -> str:
+    digits = _to_digits(rank, len(rank))
+
+    # Subtract one, twice if that would leave a trailing "a", since "xa" has no room between it and "x"
+    while True:
+        i = len(digits) - 1
+        while i >= 0 and digits[i] == 0:
+            i -= 1
+        if i < 0:
+            break
+
+        digits[i] -= 1
+        digits[i + 1 :] = bytes([_BASE - 1]) * (len(digits) - i - 1)
+        if digits[-1] != 0:
+            break
+
+    if i < 0:
+        # No room left at this length, so double it the same way rank_after does
+        stripped = rank.rstrip("a")
+        if not stripped:
+            raise ValueError(f"No rank exists before {rank!r}")
+        return stripped[:-1] + chr(ord(stripped[-1]) - 1) + "z" * len(stripped)
+
+    return _from_digits(digits)
+
+
+def rank_between(lower: Optional[str], upper: Optional[str]) -> str:
+    if lower is None and upper is None:
+        return INITIAL_RANK
+    if lower is None:
+        return rank_before(upper)
+    if upper is None:
+        return rank_after(lower)
+
+    return rank_midpoint(lower, upper)
+
+
+def _digits_to_int(digits: bytearray) -> int:
+    value = 0
+    for digit in digits:
+        value = value * _BASE + digit
+    return value
+
+
+def _int_to_digits(value: int, length: int) -> bytearray:
+    digits = bytearray(length)
+    for i in range(length - 1, -1, -1):
+        value, digits[i] = divmod(value, _BASE)
+    return digits
+
+
+def rank_range(count: int, lower: Optional[str] = None, upper: Optional[str] = None) -> List[str]:
+    if count <= 0:
+        return []
+
+    lower_value = _digits_to_int(_to_digits(lower, len(lower))) if lower is not None else 0
+    upper_value = _digits_to_int(_to_digits(upper, len(upper))) if upper is not None else 1
+    lower_length = len(lower) if lower is not None else 0
+    upper_length = len(upper) if upper is not None else 0
+
+    if lower_value * _BASE**upper_length >= upper_value * _BASE**lower_length:
+        raise ValueError(f"No ranks exist between {lower!r} and {upper!r}")
+
+    # Find the shortest length with room for count ranks strictly between the bounds, where at
+    # that length the bounds are floor(lower * 26**length) and ceil(upper * 26**length)
+    length = 0
+    while True:
+        length += 1
+        if length >= lower_length:
+            start = lower_value * _BASE ** (length - lower_length)
+        else:
+            start = lower_value // _BASE ** (lower_length - length)
+        if length >= upper_length:
+            end = upper_value * _BASE ** (length - upper_length)
+        else:
+            end = -(-upper_value // _BASE ** (upper_length - length))
+
+        span = end - start
+        if span > count:
+            break
+
+    return [
+        _from_digits(_int_to_digits(start + (i + 1) * span // (count + 1), length)).rstrip("a") for i in range(count)
+    ]
+
+
+def rank_reorder(ranks: List[str]) -> List[Optional[str]]:
+    # ranks are the current ranks listed in the new order. The longest run of them that is already
+    # increasing keeps its ranks (None) and every other item gets a rank between its kept neighbours.
+    tails: List[int] = []
+    previous = [-1] * len(ranks)
+    for i, rank in enumerate(ranks):
+        # Binary search for the first tail whose rank is >= rank, ranks must stay strictly increasing
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ranks[tails[mid]] < rank:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo > 0:
+            previous[i] = tails[lo - 1]
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+
+    kept = set()
+    i = tails[-1] if tails else -1
+    while i >= 0:
+        kept.add(i)
+        i = previous[i]
+
+    new_ranks: List[Optional[str]] = [None] * len(ranks)
+    start = 0
+    while start < len(ranks):
+        if start in kept:
+            start += 1
+            continue
+
+        end = start
+        while end < len(ranks) and end not in kept:
+            end += 1
+
+        lower = ranks[start - 1] if start > 0 else None
+        upper = ranks[end] if end < len(ranks) else None
+        new_ranks[start:end] = rank_range(end - start, lower, upper)
+        start = end
+
+    return new_ranks
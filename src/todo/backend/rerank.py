@@ -0,0 +1,127 @@
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from todo.backend.config import CONFIG
+from todo.backend.events import TODO_ITEM_EVENT_FIELDS, add_todo_item_events
+from todo.backend.rank_engine import rank_range
+from todo.backend.storage.models import Todo, TodoItem, bump_todo_versions, write_positions
+from todo.backend.worker import PeriodicWorker
+
+
+class RerankStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.todos_reranked = 0
+        self.rows_rewritten = 0
+        self.seconds_spent = 0.0
+        self.key_length_histogram: Dict[int, int] = {}
+
+    def record(self, key_lengths: List[int], rows_rewritten: int, seconds_spent: float):
+        with self._lock:
+            self.todos_reranked += 1
+            self.rows_rewritten += rows_rewritten
+            self.seconds_spent += seconds_spent
+            for key_length in key_lengths:
+                # Bucket key lengths by the next power of two
+                bucket = 1 << (key_length - 1).bit_length()
+                self.key_length_histogram[bucket] = self.key_length_histogram.get(bucket, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "todos_reranked": self.todos_reranked,
+                "rows_rewritten": self.rows_rewritten,
+                "seconds_spent": self.seconds_spent,
+                "key_length_histogram": dict(sorted(self.key_length_histogram.items())),
+            }
+
+
+RERANK_STATS = RerankStats()
+
+
+def get_rerank_moves(current: List[Tuple[int, str]], targets: List[str], limit: int) -> List[dict]:
+    # Items whose rank goes down are rewritten first to last and items whose rank goes up last to first.
+    # Any prefix of these moves leaves every item between its neighbours, so each chunk can commit on its own.
+    down = [(todo_item_id, target) for (todo_item_id, pos), target in zip(current, targets) if target < pos]
+    up = [(todo_item_id, target) for (todo_item_id, pos), target in zip(current, targets) if target > pos]
+
+    moves = down + up[::-1]
+    return [{"id": todo_item_id, "position": target} for todo_item_id, target in moves[:limit]]
+
+
+class RerankWorker(PeriodicWorker):
+    name = "rerank-worker"
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        interval_seconds: float = CONFIG.rerank_interval_seconds,
+        chunk_size: int = CONFIG.rerank_chunk_size,
+        stats: RerankStats = RERANK_STATS,
+    ):
+        super().__init__(interval_seconds)
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.stats = stats
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            todo_ids = [todo_id for todo_id, in db.query(Todo.id).filter_by(needs_rerank=True).order_by(Todo.id)]
+        finally:
+            db.close()
+
+        for todo_id in todo_ids:
+            self.rerank(todo_id)
+
+        return len(todo_ids)
+
+    def rerank(self, todo_id: int):
+        start = time.perf_counter()
+        key_lengths = None
+        rows_rewritten = 0
+        moves = None
+        version = None
+
+        while True:
+            db = self.session_factory()
+            try:
+                # Request paths that write positions lock the todo row too, so nothing moves under this chunk
+                todo = db.query(Todo).filter_by(id=todo_id).with_for_update().one_or_none()
+                if todo is None:
+                    return
+
+                # The items are read once. They are read again only if a request changed the todo between two
+                # chunks, which every write does through its version.
+                if moves is None or todo.version != version:
+                    # With the event fields, so every chunk's events are built without reading its rows back
+                    columns = [getattr(TodoItem, field) for field in TODO_ITEM_EVENT_FIELDS]
+                    query = db.query(*columns).filter_by(todo_id=todo_id).order_by(TodoItem.position, TodoItem.id)
+                    todo_items = {row.id: dict(zip(TODO_ITEM_EVENT_FIELDS, row)) for row in query}
+                    current = [(todo_item_id, todo_item["position"]) for todo_item_id, todo_item in todo_items.items()]
+                    if key_lengths is None:
+                        key_lengths = [len(pos) for _, pos in current]
+                    moves = get_rerank_moves(current, rank_range(len(current)), len(current))
+
+                if not moves:
+                    todo.needs_rerank = False
+                    db.commit()
+                    break
+
+                chunk, moves = moves[: self.chunk_size], moves[self.chunk_size :]
+                write_positions(db, {move["id"]: move["position"] for move in chunk})
+                bump_todo_versions(db, [todo_id])
+                add_todo_item_events(db, "reordered", [{**todo_items[move["id"]], **move} for move in chunk])
+                version = todo.version
+                db.commit()
+                rows_rewritten += len(chunk)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        self.stats.record(key_lengths, rows_rewritten, time.perf_counter() - start)
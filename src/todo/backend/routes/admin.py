@@ -0,0 +1,75 @@
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+
+from todo.backend.dependencies import get_admin_user
+from todo.backend.rerank import RERANK_STATS
+from todo.backend.storage.cache import STORAGE_CACHE
+from todo.backend.storage.database import get_pool_stats
+from todo.backend.user_cache import USER_CACHE
+
+
+class RerankStatsSchema(BaseModel):
+    todos_reranked: int
+    rows_rewritten: int
+    seconds_spent: float
+    key_length_histogram: Dict[int, int]
+
+
+class UserCacheStatsSchema(BaseModel):
+    hits: int
+    misses: int
+    size: int
+
+
+class StorageCacheStatsSchema(BaseModel):
+    hits: int
+    misses: int
+    hit_ratio: float
+    invalidations: int
+    size: Optional[int]
+
+
+class PoolStatsSchema(BaseModel):
+    size: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    checkouts: int
+    timeouts: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+    checkout_seconds_total: float
+    checkout_seconds_max: float
+
+
+class PoolsStatsSchema(BaseModel):
+    # By engine name: primary, replica_<n> and shard_<n>
+    pools: Dict[str, PoolStatsSchema]
+
+
+router = APIRouter(
+    prefix="/api/admin",
+    dependencies=[Depends(get_admin_user)],
+)
+
+
+@router.get("/rerank", response_model=RerankStatsSchema)
+def get_rerank_stats():
+    return RERANK_STATS.snapshot()
+
+
+@router.get("/user-cache", response_model=UserCacheStatsSchema)
+def get_user_cache_stats():
+    return USER_CACHE.snapshot()
+
+
+@router.get("/storage-cache", response_model=StorageCacheStatsSchema)
+def get_storage_cache_stats():
+    return STORAGE_CACHE.snapshot()
+
+
+@router.get("/pool", response_model=PoolsStatsSchema)
+def get_pools_stats():
+    return {"pools": get_pool_stats()}
@@ -0,0 +1,112 @@
+from typing import Callable, List, Optional
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from todo.backend.dependencies import (
+    get_async_current_user,
+    get_async_db,
+    get_async_storage_manager,
+    get_session_factories,
+)
+from todo.backend.etags import check_etag, get_todo_items_versions_query, make_etag
+from todo.backend.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, paginate_async
+from todo.backend.rank_engine import MAX_RANK_LENGTH, rank_between
+from todo.backend.routes.todo_items import (
+    PageTodoItemSchema,
+    TodoItemCreateSchema,
+    TodoItemSchema,
+    TodoItemUpdateSchema,
+)
+from todo.backend.storage.async_storage_manager import AsyncStorageManager
+from todo.backend.storage.models import Todo, TodoItem
+from todo.backend.streaming import stream_ndjson, wants_ndjson
+
+router = APIRouter(
+    prefix="/api/todoitems",
+    dependencies=[Depends(get_async_current_user)],
+)
+
+
+@router.get("", response_model=PageTodoItemSchema)
+async def list_todo_items(
+    request: Request,
+    response: Response,
+    todo_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sm: AsyncStorageManager = Depends(get_async_storage_manager),
+    session_factories: List[Callable[[], Session]] = Depends(get_session_factories),
+):
+    order_by = [TodoItem.todo_id, TodoItem.position, TodoItem.id]
+    after = decode_cursor(cursor, order_by) if cursor is not None else None
+    versions_query = get_todo_items_versions_query(request, todo_id, after, limit)
+    etag = make_etag(request, sm.user.id, await sm.list_columns(Todo, **versions_query))
+    not_modified = check_etag(request, response, etag)
+    if not_modified is not None:
+        return not_modified
+
+    filters = {}
+    if todo_id is not None:
+        filters["todo_id"] = todo_id
+
+    if wants_ndjson(request):
+        stream = stream_ndjson(session_factories, sm.user.id, TodoItem, TodoItemSchema, filters, order_by, after)
+        stream.headers["ETag"] = etag
+        return stream
+
+    return await paginate_async(sm, TodoItem, filters, order_by, limit, cursor)
+
+
+@router.post("", response_model=TodoItemSchema)
+async def create_todo_items(
+    request_data: TodoItemCreateSchema,
+    sm: AsyncStorageManager = Depends(get_async_storage_manager),
+    db: AsyncSession = Depends(get_async_db),
+):
+    todo = await sm.get(Todo, {"id": request_data.todo_id}, for_update=True)
+    last_position = await db.run_sync(lambda _: todo.get_last_position())
+    todo_item = TodoItem(
+        todo_id=todo.id,
+        owner_id=todo.owner_id,
+        message=request_data.message,
+        position=rank_between(last_position, None),
+    )
+    if len(todo_item.position) > MAX_RANK_LENGTH:
+        todo.needs_rerank = True
+
+    db.add(todo_item)
+    await db.flush()
+
+    return todo_item
+
+
+@router.get("/{id}", response_model=TodoItemSchema)
+async def get_todo_item(id: int, sm: AsyncStorageManager = Depends(get_async_storage_manager)):
+    return await sm.get(TodoItem, {"id": id})
+
+
+@router.put("/{id}", response_model=TodoItemSchema)
+async def update_todo_item(
+    id: int, request_data: TodoItemUpdateSchema, sm: AsyncStorageManager = Depends(get_async_storage_manager)
+):
+    return await sm.update(TodoItem, {"id": id}, request_data.dict())
+
+
+@router.delete("/{id}", response_model=TodoItemSchema)
+async def delete_todo_item(id: int, sm: AsyncStorageManager = Depends(get_async_storage_manager)):
+    return await sm.delete(TodoItem, {"id": id})
+
+
+@router.put("/{id}/toggle", response_model=TodoItemSchema)
+async def toggle_todo_item(
+    id: int, sm: AsyncStorageManager = Depends(get_async_storage_manager), db: AsyncSession = Depends(get_async_db)
+):
+    todo_item = await sm.get(TodoItem, {"id": id})
+    todo_item.active = not todo_item.active
+
+    db.add(todo_item)
+    await db.flush()
+
+    return todo_item
@@ -0,0 +1,117 @@
+from typing import Callable, List, Optional
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy.orm import Session
+
+from todo.backend.config import CONFIG
+from todo.backend.dependencies import get_async_current_user, get_async_storage_manager, get_session_factories
+from todo.backend.etags import check_etag, get_todo_versions_query, get_todos_versions_query, make_etag
+from todo.backend.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, paginate_async
+from todo.backend.routes.todos import (
+    INCLUDE_QUERY,
+    ITEMS_LIMIT_QUERY,
+    TODO_ITEMS_ORDER_BY,
+    PageTodoWithItemsSchema,
+    TodoCreateUpdateSchema,
+    TodoSchema,
+    TodoWithItemsSchema,
+    check_include,
+    embed_todo_items,
+)
+from todo.backend.storage.async_storage_manager import AsyncStorageManager
+from todo.backend.storage.models import Todo, TodoItem
+from todo.backend.streaming import stream_ndjson, wants_ndjson
+
+router = APIRouter(
+    prefix="/api/todos",
+    dependencies=[Depends(get_async_current_user)],
+)
+
+
+@router.get("", response_model=PageTodoWithItemsSchema, response_model_exclude_unset=True)
+async def list_todos(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include: Optional[str] = INCLUDE_QUERY,
+    items_limit: Optional[int] = ITEMS_LIMIT_QUERY,
+    sm: AsyncStorageManager = Depends(get_async_storage_manager),
+    session_factories: List[Callable[[], Session]] = Depends(get_session_factories),
+):
+    check_include(request, include)
+    order_by = [Todo.id]
+    after = decode_cursor(cursor, order_by) if cursor is not None else None
+    etag = make_etag(
+        request, sm.user.id, await sm.list_columns(Todo, **get_todos_versions_query(request, after, limit))
+    )
+    not_modified = check_etag(request, response, etag)
+    if not_modified is not None:
+        return not_modified
+
+    if wants_ndjson(request):
+        stream = stream_ndjson(session_factories, sm.user.id, Todo, TodoSchema, None, order_by, after)
+        stream.headers["ETag"] = etag
+        return stream
+
+    page = await paginate_async(sm, Todo, None, order_by, limit, cursor)
+    if include == "items":
+        todo_ids = [todo.id for todo in page["items"]]
+        todo_items = await sm.list_in(TodoItem, "todo_id", todo_ids, TODO_ITEMS_ORDER_BY, items_limit)
+        page["items"] = embed_todo_items(page["items"], todo_items)
+
+    return page
+
+
+@router.post("", response_model=TodoSchema)
+async def create_todo(
+    request_data: TodoCreateUpdateSchema, sm: AsyncStorageManager = Depends(get_async_storage_manager)
+):
+    return await sm.create(Todo, request_data.dict())
+
+
+@router.get("/{id}", response_model=TodoWithItemsSchema, response_model_exclude_unset=True)
+async def get_todo(
+    id: int,
+    request: Request,
+    response: Response,
+    include: Optional[str] = INCLUDE_QUERY,
+    items_limit: Optional[int] = ITEMS_LIMIT_QUERY,
+    sm: AsyncStorageManager = Depends(get_async_storage_manager),
+):
+    etag = make_etag(request, sm.user.id, await sm.list_columns(Todo, **get_todo_versions_query(id)))
+    not_modified = check_etag(request, response, etag)
+    if not_modified is not None:
+        return not_modified
+
+    todo = await sm.get(Todo, {"id": id})
+    if include == "items":
+        todo_items = await sm.list_in(TodoItem, "todo_id", [todo.id], TODO_ITEMS_ORDER_BY, items_limit)
+        return embed_todo_items([todo], todo_items)[0]
+
+    return todo
+
+
+@router.put("/{id}", response_model=TodoSchema)
+async def update_todo(
+    id: int, request_data: TodoCreateUpdateSchema, sm: AsyncStorageManager = Depends(get_async_storage_manager)
+):
+    return await sm.update(Todo, {"id": id}, request_data.dict())
+
+
+@router.delete("/{id}", response_model=TodoSchema)
+async def delete_todo(id: int, response: Response, sm: AsyncStorageManager = Depends(get_async_storage_manager)):
+    # Same as the sync route, huge todos are left to the purge worker
+    todo = await sm.get(Todo, {"id": id}, for_update=True)
+
+    count = await sm.db.run_sync(lambda session: todo.count_todo_items(CONFIG.purge_threshold + 1))
+    if count > CONFIG.purge_threshold:
+        todo.needs_purge = True
+        await sm.db.flush()
+        response.status_code = 202
+        return todo
+
+    await sm.db.delete(todo)
+    await sm.db.flush()
+
+    return todo
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from todo.backend.config import CONFIG
+from todo.backend.dependencies import get_async_current_user, get_async_db, get_async_storage_manager
+from todo.backend.passwords import PASSWORD_HASHER
+from todo.backend.routes.users import Token, UserCreateSchema, UserSchema, UserUpdateSchema, create_oauth_token
+from todo.backend.storage.async_storage_manager import AsyncStorageManager
+from todo.backend.storage.models import User
+
+router = APIRouter(prefix="/api")
+
+
+@router.post("/token", response_model=Token)
+async def create_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(User).filter_by(username=form_data.username))).scalars().one_or_none()
+    verified, new_hashed_password = False, None
+    if user is not None:
+        verified, new_hashed_password = await PASSWORD_HASHER.verify_and_update(
+            form_data.password, user.hashed_password
+        )
+
+    if not verified:
+        raise HTTPException(
+            status_code=401,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if new_hashed_password is not None:
+        user.hashed_password = new_hashed_password
+        await db.flush()
+
+    access_token_expires = timedelta(minutes=CONFIG.access_token_expire_minutes)
+
+    token = create_oauth_token({"sub": form_data.username, "exp": datetime.utcnow() + access_token_expires})
+
+    return {"access_token": token, "token_type": "bearer"}
+
+
+@router.post("/users", response_model=UserSchema)
+async def create_user(request_data: UserCreateSchema, db: AsyncSession = Depends(get_async_db)):
+    hashed_password = await PASSWORD_HASHER.hash(request_data.password)
+    user = User(username=request_data.username, hashed_password=hashed_password, role="user")
+    db.add(user)
+
+    try:
+        await db.flush()
+    except IntegrityError as e:
+        if "already exists" in str(e):
+            raise HTTPException(400, detail=f"Username '{request_data.username}' already taken")
+        raise
+
+    return user
+
+
+@router.get("/users/me", response_model=UserSchema)
+async def get_user_self(user: User = Depends(get_async_current_user)):
+    return user
+
+
+@router.put("/users/{id}", response_model=UserSchema)
+async def update_user(
+    id: int,
+    request_data: UserUpdateSchema,
+    sm: AsyncStorageManager = Depends(get_async_storage_manager),
+    user: User = Depends(get_async_current_user),
+):
+    update_data = request_data.dict(exclude_unset=True)
+
+    if "password" in update_data:
+        update_user = await sm.get(User, {"id": id})
+        if user.id != update_user.id:
+            raise HTTPException(403, detail="Passwords can only be updated for same user as requester")
+
+        update_data["hashed_password"] = await PASSWORD_HASHER.hash(update_data.pop("password"))
+
+    if "role" in update_data:
+        if user.role != "admin":
+            raise HTTPException(403, detail="Roles can only be updated by admin users")
+
+    return await sm.update(User, {"id": id}, update_data)
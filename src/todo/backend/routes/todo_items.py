@@ -1,25 +1,45 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import not_
 from sqlalchemy.orm import Session
-from todo.backend.dependencies import get_db, get_current_user, get_storage_manager
-from todo.backend.storage.models import Todo, TodoItem
-from todo.backend.ranking import get_lexical_rank
+from todo.backend.etags import check_etag, get_todo_items_versions_query, make_etag
+from todo.backend.dependencies import get_current_user, get_session_factories, get_storage_manager
+from todo.backend.events import add_todo_item_events
+from todo.backend.storage.models import Todo, TodoItem, bump_todo_versions
+from todo.backend.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, paginate
+from todo.backend.streaming import stream_ndjson, wants_ndjson
+from todo.backend.rank_engine import MAX_RANK_LENGTH, rank_between, rank_range
 from pydantic import BaseModel
 
 from todo.backend.storage.storage_manager import StorageManager
 
-MAX_RANK_LENGTH = 128
-
 
 class TodoItemCreateSchema(BaseModel):
     todo_id: int
     message: str
 
 
+class TodoItemBulkCreateSchema(BaseModel):
+    todo_id: int
+    messages: List[str]
+
+
 class TodoItemUpdateSchema(BaseModel):
     message: str
 
 
+class TodoItemBulkSelectSchema(BaseModel):
+    # Items are selected by ids, by todo_id, or by both, optionally narrowed down by active
+    ids: Optional[List[int]] = None
+    todo_id: Optional[int] = None
+    active: Optional[bool] = None
+
+
+class TodoItemBulkToggleSchema(TodoItemBulkSelectSchema):
+    # Every selected item is set to set_active, or flipped when it is missing
+    set_active: Optional[bool] = None
+
+
 class TodoItemSchema(BaseModel):
     id: int
     message: str
@@ -35,57 +55,136 @@ class ListTodoItemSchema(BaseModel):
     items: List[TodoItemSchema]
 
 
+class PageTodoItemSchema(ListTodoItemSchema):
+    next_cursor: Optional[str]
+
+
+MAX_BULK_CREATE_ITEMS = 10000
+MAX_BULK_SELECT_IDS = 10000
+
 router = APIRouter(
     prefix="/api/todoitems",
     dependencies=[Depends(get_current_user)],
 )
 
 
-@router.get("", response_model=ListTodoItemSchema)
-def list_todo_items(todo_id: Optional[int] = None, sm: StorageManager = Depends(get_storage_manager)):
+@router.get("", response_model=PageTodoItemSchema)
+def list_todo_items(
+    request: Request,
+    response: Response,
+    todo_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sm: StorageManager = Depends(get_storage_manager),
+    session_factories: List[Callable[[], Session]] = Depends(get_session_factories),
+):
+    order_by = [TodoItem.todo_id, TodoItem.position, TodoItem.id]
+    after = decode_cursor(cursor, order_by) if cursor is not None else None
+    versions_query = get_todo_items_versions_query(request, todo_id, after, limit)
+    etag = make_etag(request, sm.user.id, sm.stream_columns(Todo, **versions_query))
+    not_modified = check_etag(request, response, etag)
+    if not_modified is not None:
+        return not_modified
+    sm.pin_cache_version(etag)
+
     filters = {}
     if todo_id is not None:
         filters["todo_id"] = todo_id
 
-    todo_items = sm.list(TodoItem, filters, [TodoItem.todo_id, TodoItem.position])
-    return {"items": todo_items}
+    if wants_ndjson(request):
+        stream = stream_ndjson(session_factories, sm.user.id, TodoItem, TodoItemSchema, filters, order_by, after)
+        stream.headers["ETag"] = etag
+        return stream
 
+    return paginate(sm, TodoItem, filters, order_by, limit, cursor)
 
-@router.post("", response_model=TodoItemSchema)
-def create_todo_items(
-    request_data: TodoItemCreateSchema, sm: StorageManager = Depends(get_storage_manager), db: Session = Depends(get_db)
-):
-    todo = sm.get(Todo, {"id": request_data.todo_id})
-    todo_item = TodoItem(todo_id=request_data.todo_id, message=request_data.message)
-
-    needs_reorder = False
-    if len(todo.todo_items) == 0:
-        todo_item.position = "b"
-    elif len(todo.todo_items) == 1:
-        todo_item.position = "z"
-    else:
-        todo_item.position = "z"
-
-        prev_last = todo.todo_items[-1]
-        prev_penultimate = todo.todo_items[-2]
-        new_lex_rank = get_lexical_rank(prev_penultimate.position, todo_item.position)
-        if len(new_lex_rank) > MAX_RANK_LENGTH:
-            needs_reorder = True
-        prev_last.position = new_lex_rank
-        db.add(prev_last)
 
+@router.post("", response_model=TodoItemSchema)
+def create_todo_items(request_data: TodoItemCreateSchema, sm: StorageManager = Depends(get_storage_manager)):
+    todo = sm.get(Todo, {"id": request_data.todo_id}, for_update=True)
+    todo_item = TodoItem(
+        todo_id=request_data.todo_id,
+        owner_id=todo.owner_id,
+        message=request_data.message,
+        position=rank_between(todo.get_last_position(), None),
+    )
+    if len(todo_item.position) > MAX_RANK_LENGTH:
+        todo.needs_rerank = True
+
+    db = sm.get_db(todo)
     db.add(todo_item)
     db.flush()
 
-    if needs_reorder:
-        db.refresh(todo)
-        todo.rerank_todo_items()
-        db.add(todo)
-        db.flush()
-
     return todo_item
 
 
+@router.post("/bulk", response_model=ListTodoItemSchema)
+def bulk_create_todo_items(
+    request_data: TodoItemBulkCreateSchema,
+    sm: StorageManager = Depends(get_storage_manager),
+):
+    if len(request_data.messages) > MAX_BULK_CREATE_ITEMS:
+        raise HTTPException(400, detail=f"Can't create more than {MAX_BULK_CREATE_ITEMS} todo items at once")
+
+    todo = sm.get(Todo, {"id": request_data.todo_id}, for_update=True)
+    positions = rank_range(len(request_data.messages), todo.get_last_position())
+    todo_items = [
+        TodoItem(todo_id=request_data.todo_id, owner_id=todo.owner_id, message=message, position=position)
+        for message, position in zip(request_data.messages, positions)
+    ]
+
+    if any(len(position) > MAX_RANK_LENGTH for position in positions):
+        todo.needs_rerank = True
+
+    # psycopg2 sends the whole flush as multi-row INSERT ... RETURNING statements
+    db = sm.get_db(todo)
+    db.add_all(todo_items)
+    db.flush()
+
+    return {"items": todo_items}
+
+
+def get_bulk_selection(request_data: TodoItemBulkSelectSchema) -> Tuple[Dict[str, Any], Optional[List[int]]]:
+    if request_data.ids is None and request_data.todo_id is None:
+        raise HTTPException(400, detail="Either ids or todo_id is required")
+    if request_data.ids is not None and len(request_data.ids) > MAX_BULK_SELECT_IDS:
+        raise HTTPException(400, detail=f"Can't select more than {MAX_BULK_SELECT_IDS} todo items at once")
+
+    filters = {"todo_id": request_data.todo_id, "active": request_data.active}
+    return {key: value for key, value in filters.items() if value is not None}, request_data.ids
+
+
+def after_bulk_write(event_type: str) -> Callable[[Session, List[Dict[str, Any]]], None]:
+    # Bulk and single statement writes skip the flush listeners, so versions and events are handled here
+    def after_write(db: Session, rows: List[Dict[str, Any]]):
+        bump_todo_versions(db, {row["todo_id"] for row in rows})
+        add_todo_item_events(db, event_type, rows)
+
+    return after_write
+
+
+def sort_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # RETURNING has no order
+    return sorted(rows, key=lambda row: (row["todo_id"], row["position"], row["id"]))
+
+
+@router.put("/bulk/toggle", response_model=ListTodoItemSchema)
+def bulk_toggle_todo_items(request_data: TodoItemBulkToggleSchema, sm: StorageManager = Depends(get_storage_manager)):
+    filters, ids = get_bulk_selection(request_data)
+    active = not_(TodoItem.active) if request_data.set_active is None else request_data.set_active
+    rows = sm.bulk_update(TodoItem, filters, {"active": active}, ids, after_bulk_write("toggled"))
+
+    return {"items": sort_rows(rows)}
+
+
+@router.post("/bulk/delete", response_model=ListTodoItemSchema)
+def bulk_delete_todo_items(request_data: TodoItemBulkSelectSchema, sm: StorageManager = Depends(get_storage_manager)):
+    filters, ids = get_bulk_selection(request_data)
+    rows = sm.bulk_delete(TodoItem, filters, ids, after_bulk_write("deleted"))
+
+    return {"items": sort_rows(rows)}
+
+
 @router.get("/{id}", response_model=TodoItemSchema)
 def get_todo_item(id: int, sm: StorageManager = Depends(get_storage_manager)):
     return sm.get(TodoItem, {"id": id})
@@ -93,20 +192,14 @@ def get_todo_item(id: int, sm: StorageManager = Depends(get_storage_manager)):
 
 @router.put("/{id}", response_model=TodoItemSchema)
 def update_todo_item(id: int, request_data: TodoItemUpdateSchema, sm: StorageManager = Depends(get_storage_manager)):
-    return sm.update(TodoItem, {"id": id}, request_data.dict())
+    return sm.update(TodoItem, {"id": id}, request_data.dict(), after_bulk_write("updated"))
 
 
 @router.delete("/{id}", response_model=TodoItemSchema)
 def delete_todo_item(id: int, sm: StorageManager = Depends(get_storage_manager)):
-    return sm.delete(TodoItem, {"id": id})
+    return sm.delete(TodoItem, {"id": id}, after_bulk_write("deleted"))
 
 
 @router.put("/{id}/toggle", response_model=TodoItemSchema)
-def toggle_todo_item(id: int, sm: StorageManager = Depends(get_storage_manager), db: Session = Depends(get_db)):
-    todo_item = sm.get(TodoItem, {"id": id})
-    todo_item.active = not todo_item.active
-
-    db.add(todo_item)
-    db.flush()
-
-    return todo_item
+def toggle_todo_item(id: int, sm: StorageManager = Depends(get_storage_manager)):
+    return sm.update(TodoItem, {"id": id}, {"active": not_(TodoItem.active)}, after_bulk_write("toggled"))
@@ -1,11 +1,18 @@
-from typing import List
-
-from fastapi import APIRouter, Depends, HTTPException, Response
-from todo.backend.dependencies import get_db, get_current_user, get_storage_manager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from todo.backend.events import EVENTS_MEDIA_TYPE, record_todo_item_events, stream_todo_events
+from todo.backend.etags import check_etag, get_todo_versions_query, get_todos_versions_query, make_etag
+from todo.backend.config import CONFIG
+from todo.backend.dependencies import get_current_user, get_session_factories, get_storage_manager
 from sqlalchemy.orm import Session
-from todo.backend.storage.models import Todo, TodoItem, User
+from todo.backend.storage.models import Todo, TodoItem, User, bump_todo_versions, write_positions
 from todo.backend.storage.storage_manager import StorageManager
-from todo.backend.ranking import get_lexical_rank
+from todo.backend.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, paginate
+from todo.backend.routes.todo_items import TodoItemSchema
+from todo.backend.streaming import stream_ndjson, wants_ndjson
+from todo.backend.rank_engine import MAX_RANK_LENGTH, rank_between, rank_reorder
 from pydantic import BaseModel
 
 
@@ -18,6 +25,12 @@ class TodoReorderSchema(BaseModel):
     insert_idx: int
 
 
+class TodoBatchReorderSchema(BaseModel):
+    # Either moves applied one after the other, or the ids of every item of the todo in their new order
+    moves: Optional[List[TodoReorderSchema]] = None
+    order: Optional[List[int]] = None
+
+
 class TodoSchema(BaseModel):
     id: int
     name: str
@@ -31,16 +44,77 @@ class ListTodoSchema(BaseModel):
     items: List[TodoSchema]
 
 
+class PageTodoSchema(ListTodoSchema):
+    next_cursor: Optional[str]
+
+
+class TodoWithItemsSchema(TodoSchema):
+    # Only set with include=items, routes using it leave it out otherwise (response_model_exclude_unset)
+    items: Optional[List[TodoItemSchema]]
+
+
+class PageTodoWithItemsSchema(PageTodoSchema):
+    items: List[TodoWithItemsSchema]
+
+
+TODO_ITEMS_ORDER_BY = [TodoItem.todo_id, TodoItem.position, TodoItem.id]
+INCLUDE_QUERY = Query(None, regex="^items$")
+ITEMS_LIMIT_QUERY = Query(None, ge=1, le=MAX_PAGE_SIZE)
+
+
+def check_include(request: Request, include: Optional[str]):
+    if include is not None and wants_ndjson(request):
+        raise HTTPException(400, detail="include isn't supported for NDJSON")
+
+
+def embed_todo_items(todos: List[Todo], todo_items: List[TodoItem]) -> List[dict]:
+    # todo_items come sorted by TODO_ITEMS_ORDER_BY, so every todo's list stays in position order
+    items_by_todo: Dict[int, List[TodoItem]] = {todo.id: [] for todo in todos}
+    for todo_item in todo_items:
+        items_by_todo[todo_item.todo_id].append(todo_item)
+
+    return [{**TodoSchema.from_orm(todo).dict(), "items": items_by_todo[todo.id]} for todo in todos]
+
+
 router = APIRouter(
     prefix="/api/todos",
     dependencies=[Depends(get_current_user)],
 )
 
 
-@router.get("", response_model=ListTodoSchema)
-def list_todos(sm: StorageManager = Depends(get_storage_manager)):
-    todos = sm.list(Todo)
-    return {"items": todos}
+@router.get("", response_model=PageTodoWithItemsSchema, response_model_exclude_unset=True)
+def list_todos(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include: Optional[str] = INCLUDE_QUERY,
+    items_limit: Optional[int] = ITEMS_LIMIT_QUERY,
+    sm: StorageManager = Depends(get_storage_manager),
+    session_factories: List[Callable[[], Session]] = Depends(get_session_factories),
+):
+    check_include(request, include)
+    order_by = [Todo.id]
+    after = decode_cursor(cursor, order_by) if cursor is not None else None
+    etag = make_etag(request, sm.user.id, sm.stream_columns(Todo, **get_todos_versions_query(request, after, limit)))
+    not_modified = check_etag(request, response, etag)
+    if not_modified is not None:
+        return not_modified
+    sm.pin_cache_version(etag)
+
+    if wants_ndjson(request):
+        stream = stream_ndjson(session_factories, sm.user.id, Todo, TodoSchema, None, order_by, after)
+        stream.headers["ETag"] = etag
+        return stream
+
+    page = paginate(sm, Todo, None, order_by, limit, cursor)
+    if include == "items":
+        # One query for the items of the whole page
+        todo_ids = [todo.id for todo in page["items"]]
+        todo_items = sm.list_in(TodoItem, "todo_id", todo_ids, TODO_ITEMS_ORDER_BY, items_limit)
+        page["items"] = embed_todo_items(page["items"], todo_items)
+
+    return page
 
 
 @router.post("", response_model=TodoSchema)
@@ -60,19 +134,84 @@ def create_todo(request_data: TodoCreateUpdateSchema, sm: StorageManager = Depen
     return sm.create(Todo, request_data.dict())
 
 
-@router.get("/{id}", response_model=TodoSchema)
-def get_todo(id: int, sm: StorageManager = Depends(get_storage_manager)):
-    return sm.get(Todo, {"id": id})
+@router.get("/{id}", response_model=TodoWithItemsSchema, response_model_exclude_unset=True)
+def get_todo(
+    id: int,
+    request: Request,
+    response: Response,
+    include: Optional[str] = INCLUDE_QUERY,
+    items_limit: Optional[int] = ITEMS_LIMIT_QUERY,
+    sm: StorageManager = Depends(get_storage_manager),
+):
+    etag = make_etag(request, sm.user.id, sm.stream_columns(Todo, **get_todo_versions_query(id)))
+    not_modified = check_etag(request, response, etag)
+    if not_modified is not None:
+        return not_modified
+    sm.pin_cache_version(etag)
+
+    todo = sm.get(Todo, {"id": id})
+    if include == "items":
+        todo_items = sm.list_in(TodoItem, "todo_id", [todo.id], TODO_ITEMS_ORDER_BY, items_limit)
+        return embed_todo_items([todo], todo_items)[0]
+
+    return todo
+
+
+@router.get("/{id}/events")
+def get_todo_events(id: int, sm: StorageManager = Depends(get_storage_manager)):
+    # Checked before the stream starts, the stream itself never touches the database
+    sm.get(Todo, {"id": id})
+    return StreamingResponse(
+        stream_todo_events(id),
+        media_type=EVENTS_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.put("/{id}", response_model=TodoSchema)
 def update_todo(id: int, request_data: TodoCreateUpdateSchema, sm: StorageManager = Depends(get_storage_manager)):
-    return sm.update(Todo, {"id": id}, request_data.dict())
+    # The UPDATE skips the flush listener that bumps versions
+    return sm.update(Todo, {"id": id}, {**request_data.dict(), "version": Todo.version + 1})
 
 
 @router.delete("/{id}", response_model=TodoSchema)
-def delete_todo(id: int, sm: StorageManager = Depends(get_storage_manager)):
-    return sm.delete(Todo, {"id": id})
+def delete_todo(id: int, response: Response, sm: StorageManager = Depends(get_storage_manager)):
+    todo = sm.get(Todo, {"id": id}, for_update=True)
+    db = sm.get_db(todo)
+
+    if todo.count_todo_items(CONFIG.purge_threshold + 1) > CONFIG.purge_threshold:
+        # Hidden right away, the purge worker deletes the items in chunks and then the todo
+        todo.needs_purge = True
+        db.flush()
+        response.status_code = 202
+        return todo
+
+    db.delete(todo)
+    db.flush()
+
+    return todo
+
+
+def get_neighbour_positions(db: Session, todo_item: TodoItem, insert_idx: int) -> Tuple[Optional[str], Optional[str]]:
+    # Positions of the items that will sit on either side of todo_item once it is moved to insert_idx
+    query = (
+        db.query(TodoItem.position)
+        .filter(TodoItem.todo_id == todo_item.todo_id, TodoItem.id != todo_item.id)
+        .order_by(TodoItem.position, TodoItem.id)
+    )
+
+    if insert_idx <= 0:
+        return None, query.limit(1).scalar()
+
+    neighbours = [position for position, in query.offset(insert_idx - 1).limit(2)]
+    if len(neighbours) == 2:
+        return neighbours[0], neighbours[1]
+    if len(neighbours) == 1:
+        return neighbours[0], None
+
+    # insert_idx is past the end of the list so todo_item becomes the last item
+    last_position = query.order_by(None).order_by(TodoItem.position.desc(), TodoItem.id.desc()).limit(1).scalar()
+    return last_position, None
 
 
 @router.put("/{id}/reorder", status_code=204)
@@ -80,41 +219,100 @@ def reorder_todo(
     id: int,
     request_data: TodoReorderSchema,
     sm: StorageManager = Depends(get_storage_manager),
-    db: Session = Depends(get_db),
 ):
-    todo = sm.get(Todo, {"id": id})
+    todo = sm.get(Todo, {"id": id}, for_update=True)
+    todo_item = sm.get(TodoItem, {"id": request_data.todo_item_id, "todo_id": id})
+    db = sm.get_db(todo)
+
+    lower, upper = get_neighbour_positions(db, todo_item, request_data.insert_idx)
+    if lower is None and upper is None:
+        return Response(status_code=204)
+
+    if (lower is None or lower < todo_item.position) and (upper is None or todo_item.position < upper):
+        return Response(status_code=204)
+
+    try:
+        position = rank_between(lower, upper)
+    except ValueError:
+        # There is no room at all between the neighbours, so this rerank can't wait for the worker
+        todo.rerank_todo_items()
+        lower, upper = get_neighbour_positions(db, todo_item, request_data.insert_idx)
+        position = rank_between(lower, upper)
+
+    if len(position) > MAX_RANK_LENGTH:
+        todo.needs_rerank = True
+
+    todo_item.position = position
+    db.add(todo_item)
+    db.flush()
+    db.expire(todo, ["todo_items"])
 
-    todo_item_id = request_data.todo_item_id
-    insert_idx = request_data.insert_idx
-
-    if insert_idx < 0:
-        insert_idx = 0
-    if insert_idx >= len(todo.todo_items):
-        insert_idx = len(todo.todo_items) - 1
-
-    todo_item = sm.get(TodoItem, {"id": todo_item_id, "todo_id": id})
-    todo_idx = todo.todo_items.index(todo_item)
-
-    todo.todo_items.pop(todo_idx)
-    todo.todo_items.insert(insert_idx, todo_item)
-    if len(todo.todo_items) == 1:
-        return
-
-    if len(todo.todo_items) == 2:
-        todo.todo_items[0].position = "b"
-        todo.todo_items[1].position = "z"
-    elif insert_idx == 0:
-        todo_item.position = "b"
-        todo.todo_items[1].position = get_lexical_rank(todo.todo_items[0].position, todo.todo_items[2].position)
-    elif insert_idx == len(todo.todo_items) - 1:
-        todo_item.position = "z"
-        todo.todo_items[-2].position = get_lexical_rank(todo.todo_items[-3].position, todo.todo_items[-1].position)
-    else:
-        todo_item.position = get_lexical_rank(
-            todo.todo_items[insert_idx - 1].position, todo.todo_items[insert_idx + 1].position
+    return Response(status_code=204)
+
+
+def get_batch_order(current: List[int], request_data: TodoBatchReorderSchema) -> List[int]:
+    if (request_data.moves is None) == (request_data.order is None):
+        raise HTTPException(400, detail="Exactly one of moves and order is required")
+
+    if request_data.order is not None:
+        if sorted(request_data.order) != sorted(current):
+            raise HTTPException(400, detail="Order must list every item of the todo once")
+        return request_data.order
+
+    order = list(current)
+    todo_item_ids = set(current)
+    for move in request_data.moves:
+        if move.todo_item_id not in todo_item_ids:
+            raise HTTPException(400, detail="TodoItem doesn't exist")
+        order.remove(move.todo_item_id)
+        order.insert(max(move.insert_idx, 0), move.todo_item_id)
+
+    return order
+
+
+@router.put("/{id}/reorder/batch", status_code=204)
+def batch_reorder_todo(
+    id: int,
+    request_data: TodoBatchReorderSchema,
+    sm: StorageManager = Depends(get_storage_manager),
+):
+    todo = sm.get(Todo, {"id": id}, for_update=True)
+    db = sm.get_db(todo)
+
+    def get_current() -> List[Tuple[int, str]]:
+        return (
+            db.query(TodoItem.id, TodoItem.position)
+            .filter_by(todo_id=id)
+            .order_by(TodoItem.position, TodoItem.id)
+            .all()
         )
 
-    db.add(todo)
-    db.flush()
+    current = get_current()
+    order = get_batch_order([todo_item_id for todo_item_id, _ in current], request_data)
+
+    try:
+        positions = dict(current)
+        new_positions = rank_reorder([positions[todo_item_id] for todo_item_id in order])
+    except ValueError:
+        # Items have to go before the first possible rank, so rerank now like single reorders do
+        todo.rerank_todo_items()
+        positions = dict(get_current())
+        new_positions = rank_reorder([positions[todo_item_id] for todo_item_id in order])
+
+    moves = {todo_item_id: position for todo_item_id, position in zip(order, new_positions) if position is not None}
+    if not moves:
+        return Response(status_code=204)
+
+    if any(len(position) > MAX_RANK_LENGTH for position in moves.values()):
+        todo.needs_rerank = True
+
+    # Every new position in UPDATE ... SET position = CASE id ... END statements, not one per item
+    write_positions(db, moves)
+    bump_todo_versions(db, [id])
+    record_todo_item_events(db, "reordered", moves)
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, TodoItem) and obj.id in moves:
+            db.expire(obj, ["position"])
+    db.expire(todo, ["todo_items"])
 
     return Response(status_code=204)
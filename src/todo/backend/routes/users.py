@@ -4,23 +4,19 @@ from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from sqlalchemy.exc import IntegrityError
 from jose import jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from todo.backend.dependencies import get_db, get_current_user, get_storage_manager
 from todo.backend.storage.models import User
+from todo.backend.storage.shards import SHARDS
 from todo.backend.config import CONFIG
+from todo.backend.passwords import PASSWORD_HASHER, hash_password
 from todo.backend.storage.storage_manager import StorageManager
 
 router = APIRouter(prefix="/api")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-class AuthenticationException(Exception):
-    pass
-
 
 class UserSchema(BaseModel):
     id: int
@@ -46,36 +42,35 @@ class Token(BaseModel):
     token_type: str
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-
-def authenticate_user(db: Session, username: str, password: str) -> User:
-    user = db.query(User).filter_by(username=username).one_or_none()
-    if user is None:
-        raise AuthenticationException(f"User '{username}' doesn't exist")
-
-    if not pwd_context.verify(password, user.hashed_password):
-        raise AuthenticationException(f"Incorrect password for user '{username}'")
-
-    return user
-
-
 def create_oauth_token(claims: dict) -> str:
     return jwt.encode(claims, CONFIG.secret_key, algorithm=CONFIG.algorithm)
 
 
+# The password routes are async so that bcrypt runs on PASSWORD_HASHER without holding a threadpool worker,
+# while their database calls still go through run_in_threadpool
+
+
 @router.post("/token", response_model=Token)
-def create_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    try:
-        authenticate_user(db, form_data.username, form_data.password)
-    except AuthenticationException as e:
+async def create_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(db.query(User).filter_by(username=form_data.username).one_or_none)
+    verified, new_hashed_password = False, None
+    if user is not None:
+        verified, new_hashed_password = await PASSWORD_HASHER.verify_and_update(
+            form_data.password, user.hashed_password
+        )
+
+    if not verified:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    if new_hashed_password is not None:
+        # Hash uses an old scheme or cost settings, so replace it while we have the plain password
+        user.hashed_password = new_hashed_password
+        await run_in_threadpool(db.flush)
+
     access_token_expires = timedelta(minutes=CONFIG.access_token_expire_minutes)
 
     token = create_oauth_token({"sub": form_data.username, "exp": datetime.utcnow() + access_token_expires})
@@ -84,17 +79,22 @@ def create_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
 
 
 @router.post("/users", response_model=UserSchema)
-def create_user(request_data: UserCreateSchema, db: Session = Depends(get_db)):
-    user = User(username=request_data.username, hashed_password=hash_password(request_data.password), role="user")
+async def create_user(request_data: UserCreateSchema, db: Session = Depends(get_db)):
+    hashed_password = await PASSWORD_HASHER.hash(request_data.password)
+    user = User(username=request_data.username, hashed_password=hashed_password, role="user")
     db.add(user)
 
     try:
-        db.flush()
+        await run_in_threadpool(db.flush)
     except IntegrityError as e:
         if "already exists" in str(e):
             raise HTTPException(400, detail=f"Username '{request_data.username}' already taken")
         raise
 
+    if SHARDS.enabled:
+        await run_in_threadpool(SHARDS.place_user, user)
+        await run_in_threadpool(db.flush)
+
     return user
 
 
@@ -104,7 +104,7 @@ def get_user_self(user: User = Depends(get_current_user)):
 
 
 @router.put("/users/{id}", response_model=UserSchema)
-def update_user(
+async def update_user(
     id: int,
     request_data: UserUpdateSchema,
     sm: StorageManager = Depends(get_storage_manager),
@@ -113,17 +113,17 @@ def update_user(
     update_data = request_data.dict(exclude_unset=True)
 
     if "password" in update_data:
-        update_user = sm.get(User, {"id": id})
+        update_user = await run_in_threadpool(sm.get, User, {"id": id})
         if user.id != update_user.id:
             raise HTTPException(403, detail="Passwords can only be updated for same user as requester")
 
-        update_data["hashed_password"] = hash_password(update_data.pop("password"))
+        update_data["hashed_password"] = await PASSWORD_HASHER.hash(update_data.pop("password"))
 
     if "role" in update_data:
         if user.role != "admin":
             raise HTTPException(403, detail="Roles can only be updated by admin users")
 
-    return sm.update(User, {"id": id}, update_data)
+    return await run_in_threadpool(sm.update, User, {"id": id}, update_data)
 
 
 # Authorization: Bearer <token>
@@ -0,0 +1,14 @@
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from todo.backend.config import CONFIG
+from todo.backend.storage.database import ENGINES, get_pool_options
+from todo.backend.storage.pool import InstrumentedAsyncAdaptedQueuePool
+
+async_engine = create_async_engine(
+    CONFIG.async_database_url, poolclass=InstrumentedAsyncAdaptedQueuePool, **get_pool_options()
+)
+# Its stats are reported with the sync engines', the pool is shared with its sync_engine
+ENGINES["async"] = async_engine.sync_engine
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False
+)
@@ -0,0 +1,152 @@
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from fastapi import HTTPException
+from sqlalchemy import func, inspect, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from todo.backend.storage.models import Todo, TodoItem, User
+from todo.backend.storage.storage_manager import OwnerIdGeneric
+
+
+class AsyncStorageManager:
+    def __init__(self, db: AsyncSession, user: User):
+        self.db = db
+        self.user = user
+        self._purging_todo_ids: Optional[List[int]] = None
+
+    async def _get_purging_todo_ids(self) -> List[int]:
+        # Same as StorageManager._get_purging_todo_ids
+        if self._purging_todo_ids is None:
+            query = select(Todo.id).filter_by(needs_purge=True)
+            if self.user.role == "user":
+                query = query.filter_by(owner_id=self.user.owner_id)
+            self._purging_todo_ids = (await self.db.execute(query)).scalars().all()
+
+        return self._purging_todo_ids
+
+    async def _select(self, model_cls: Type[OwnerIdGeneric], filters: Optional[Dict[str, Any]] = None) -> Select:
+        query = select(model_cls)
+
+        if self.user.role == "user":
+            query = query.filter_by(owner_id=self.user.owner_id)
+
+        if model_cls is Todo:
+            query = query.filter_by(needs_purge=False)
+        elif model_cls is TodoItem:
+            purging_todo_ids = await self._get_purging_todo_ids()
+            if purging_todo_ids:
+                query = query.filter(TodoItem.todo_id.notin_(purging_todo_ids))
+
+        if filters:
+            query = query.filter_by(**filters)
+
+        return query
+
+    async def _one(self, query: Select, model_cls: Type[OwnerIdGeneric]) -> OwnerIdGeneric:
+        item = (await self.db.execute(query)).scalars().one_or_none()
+
+        if item is None:
+            raise HTTPException(400, detail=f"{model_cls.__name__} doesn't exist")
+
+        return item
+
+    async def list(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]] = None,
+        order_by: Optional[List[Any]] = None,
+        limit: Optional[int] = None,
+        after: Optional[List[Any]] = None,
+    ) -> List[OwnerIdGeneric]:
+        query = await self._select(model_cls, filters)
+
+        if after is not None:
+            query = query.filter(tuple_(*order_by) > tuple_(*after))
+
+        if order_by:
+            query = query.order_by(*order_by)
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        return (await self.db.execute(query)).scalars().all()
+
+    async def list_in(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        key: str,
+        values: List[Any],
+        order_by: List[Any],
+        limit_per_value: Optional[int] = None,
+    ) -> List[OwnerIdGeneric]:
+        # Same as StorageManager.list_in
+        if not values:
+            return []
+
+        column = getattr(model_cls, key)
+        query = (await self._select(model_cls)).filter(column.in_(values))
+
+        if limit_per_value is not None:
+            row_number = func.row_number().over(partition_by=column, order_by=order_by).label("row_number")
+            ranked = query.with_only_columns(model_cls.id, row_number).subquery()
+            query = (await self._select(model_cls)).filter(
+                model_cls.id.in_(select(ranked.c.id).where(ranked.c.row_number <= limit_per_value))
+            )
+
+        return (await self.db.execute(query.order_by(*order_by))).scalars().all()
+
+    async def list_columns(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]],
+        order_by: List[Any],
+        limit: Optional[int] = None,
+        where: Optional[List[Any]] = None,
+    ) -> List[Tuple[Any, ...]]:
+        # Same rows as StorageManager.stream_columns, there is only one database here
+        query = (await self._select(model_cls, filters)).filter(*where or []).with_only_columns(*order_by)
+        return (await self.db.execute(query.order_by(*order_by).limit(limit))).all()
+
+    async def create(self, model_cls: Type[OwnerIdGeneric], data: Dict[str, Any]) -> OwnerIdGeneric:
+        data = data.copy()
+        if "owner_id" in inspect(model_cls).columns:
+            data["owner_id"] = self.user.id
+
+        item = model_cls(**data)
+
+        self.db.add(item)
+        await self.db.flush()
+
+        return item
+
+    async def get(
+        self, model_cls: Type[OwnerIdGeneric], filters: Dict[str, Any], for_update: bool = False
+    ) -> OwnerIdGeneric:
+        query = await self._select(model_cls, filters)
+
+        if for_update:
+            query = query.with_for_update()
+
+        return await self._one(query, model_cls)
+
+    async def update(
+        self, model_cls: Type[OwnerIdGeneric], filters: Dict[str, Any], data: Dict[str, Any]
+    ) -> OwnerIdGeneric:
+        item = await self._one(await self._select(model_cls, filters), model_cls)
+
+        for key, val in data.items():
+            setattr(item, key, val)
+
+        self.db.add(item)
+        await self.db.flush()
+
+        return item
+
+    async def delete(self, model_cls: Type[OwnerIdGeneric], filters: Dict[str, Any]) -> OwnerIdGeneric:
+        item = await self._one(await self._select(model_cls, filters), model_cls)
+
+        await self.db.delete(item)
+        await self.db.flush()
+
+        return item
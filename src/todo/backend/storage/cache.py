@@ -0,0 +1,269 @@
+import abc
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from todo.backend.config import CONFIG
+from todo.backend.storage.models import BUMPED_TODO_IDS_KEY, OwnerIdMixin, Todo, TodoItem, User
+
+# Entries are tagged with the todo they are filtered on, or else the owner they are scoped to ("*" for
+# admins, who see every owner). Every tag has a generation stored in the backend next to the entries and
+# entry keys include the generations of their tags, so invalidating a tag is a single write of a new
+# generation that works the same for in-process and shared backends. Stale entries are never read again
+# and age out of the LRU or the external store's TTL.
+
+CACHED_MODELS = (Todo, TodoItem)
+ALL_OWNERS = "*"
+TOUCHED_TAGS_KEY = "storage_cache_touched_tags"
+
+
+class CacheBackend(abc.ABC):
+    # Whether every worker sees the same entries
+    shared = False
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None):
+        pass
+
+    @abc.abstractmethod
+    def clear(self):
+        pass
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class InProcessCacheBackend(CacheBackend):
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Optional[float], str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None):
+        expires_at = time.monotonic() + ttl_seconds if ttl_seconds is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> Optional[int]:
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisCacheBackend(CacheBackend):
+    # client is anything with redis-py's get/set/delete/scan_iter, which the eviction policy of the
+    # server (allkeys-lru) bounds
+    shared = True
+
+    def __init__(self, client: Any, prefix: str = "todo:storage:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisCacheBackend":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("TODO_STORAGE_CACHE_URL needs the cache extra (pip install todo[cache])")
+
+        return cls(redis.Redis.from_url(url, decode_responses=True))
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None):
+        self.client.set(self.prefix + key, value, px=int(ttl_seconds * 1000) if ttl_seconds is not None else None)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+
+def get_scope(user: User) -> str:
+    return str(user.owner_id) if user.role == "user" else ALL_OWNERS
+
+
+def get_tags(model_cls: Type[OwnerIdMixin], scope: str, filters: Optional[Dict[str, Any]]) -> List[str]:
+    filters = filters or {}
+    todo_id = filters.get("id") if model_cls is Todo else filters.get("todo_id")
+    if todo_id is not None:
+        return [f"todo:{todo_id}"]
+    return [f"owner:{scope}"]
+
+
+def get_touched_tags(owner_id: Optional[int], todo_id: Optional[int]) -> Set[str]:
+    tags = {f"owner:{ALL_OWNERS}"}
+    if owner_id is not None:
+        tags.add(f"owner:{owner_id}")
+    if todo_id is not None:
+        tags.add(f"todo:{todo_id}")
+    return tags
+
+
+class StorageCache:
+    def __init__(self, backend: Optional[CacheBackend], ttl_seconds: float):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def caches(self, model_cls: Type[OwnerIdMixin]) -> bool:
+        return self.enabled and model_cls in CACHED_MODELS
+
+    def _get_generation(self, tag: str) -> str:
+        generation = self.backend.get(f"generation:{tag}")
+        if generation is None:
+            # Never fall back to a default, an evicted generation must not bring back older entries
+            generation = uuid.uuid4().hex
+            self.backend.set(f"generation:{tag}", generation)
+        return generation
+
+    def make_key(
+        self, model_cls: Type[OwnerIdMixin], user: User, filters: Optional[Dict[str, Any]], *params: Any
+    ) -> str:
+        scope = get_scope(user)
+        generations = [(tag, self._get_generation(tag)) for tag in get_tags(model_cls, scope, filters)]
+        key = json.dumps([model_cls.__name__, scope, sorted((filters or {}).items()), generations, params], default=str)
+        return "entry:" + hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, model_cls: Type[OwnerIdMixin], key: str) -> Optional[List[OwnerIdMixin]]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        # Detached copies, so nothing the request does to them reaches the cache or the database
+        items = []
+        for row in json.loads(value):
+            item = model_cls(**row)
+            make_transient_to_detached(item)
+            items.append(item)
+        return items
+
+    def set(self, model_cls: Type[OwnerIdMixin], key: str, items: Iterable[OwnerIdMixin]):
+        keys = [column.key for column in inspect(model_cls).column_attrs]
+        rows = [{key: getattr(item, key) for key in keys} for item in items]
+        self.backend.set(key, json.dumps(rows), self.ttl_seconds)
+
+    def invalidate(self, tags: Iterable[str]):
+        for tag in tags:
+            self.backend.set(f"generation:{tag}", uuid.uuid4().hex)
+            with self._lock:
+                self.invalidations += 1
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "size": self.backend.size() if self.enabled else 0,
+            }
+
+
+def make_backend() -> Optional[CacheBackend]:
+    if CONFIG.storage_cache_url:
+        return RedisCacheBackend.from_url(CONFIG.storage_cache_url)
+    if CONFIG.storage_cache_size > 0:
+        return InProcessCacheBackend(CONFIG.storage_cache_size)
+    return None
+
+
+STORAGE_CACHE = StorageCache(make_backend(), CONFIG.storage_cache_ttl_seconds)
+
+
+@event.listens_for(Session, "after_flush")
+def collect_touched_tags(session: Session, flush_context):
+    if not STORAGE_CACHE.enabled:
+        return
+
+    tags = session.info.setdefault(TOUCHED_TAGS_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Todo):
+            tags.update(get_touched_tags(obj.owner_id, obj.id))
+        elif isinstance(obj, TodoItem):
+            tags.update(get_touched_tags(obj.owner_id, obj.todo_id))
+            for todo_id in inspect(obj).attrs.todo_id.history.deleted or ():
+                tags.update(get_touched_tags(obj.owner_id, todo_id))
+
+
+def record_touched_rows(session: Session, model_cls: Type[OwnerIdMixin], rows: Iterable[Dict[str, Any]]):
+    # For bulk statements, which never flush
+    if not STORAGE_CACHE.enabled or model_cls not in CACHED_MODELS:
+        return
+
+    tags = session.info.setdefault(TOUCHED_TAGS_KEY, set())
+    for row in rows:
+        tags.update(get_touched_tags(row.get("owner_id"), row["id"] if model_cls is Todo else row.get("todo_id")))
+
+
+@event.listens_for(Session, "before_commit")
+def collect_bumped_tags(session: Session):
+    # Bulk position rewrites never flush, but they do bump the versions of their todos
+    if not STORAGE_CACHE.enabled:
+        return
+
+    tags = session.info.setdefault(TOUCHED_TAGS_KEY, set())
+    todos = {obj.id: obj for obj in session.identity_map.values() if isinstance(obj, Todo)}
+    for todo_id in session.info.get(BUMPED_TODO_IDS_KEY, ()):
+        owner_id = inspect(todos[todo_id]).dict.get("owner_id") if todo_id in todos else None
+        tags.update(get_touched_tags(owner_id, todo_id))
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_touched_tags(session: Session):
+    # Invalidating only once the writes are visible keeps readers from caching the old rows again
+    session.info.pop(BUMPED_TODO_IDS_KEY, None)
+    tags = session.info.pop(TOUCHED_TAGS_KEY, None)
+    if tags:
+        STORAGE_CACHE.invalidate(tags)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_touched_tags(session: Session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(BUMPED_TODO_IDS_KEY, None)
+        session.info.pop(TOUCHED_TAGS_KEY, None)
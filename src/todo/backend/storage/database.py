@@ -1,9 +1,37 @@
+from typing import Dict
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from todo.backend.config import CONFIG
+from todo.backend.storage.pool import InstrumentedQueuePool
+
+# Every engine by name (primary, replica_<n>, shard_<n>, async), for the pool stats
+ENGINES: Dict[str, Engine] = {}
+
+
+def get_pool_options() -> dict:
+    return {
+        "pool_size": CONFIG.pool_size,
+        "max_overflow": CONFIG.pool_max_overflow,
+        "pool_timeout": CONFIG.pool_timeout_seconds,
+        "pool_recycle": CONFIG.pool_recycle_seconds,
+        "pool_pre_ping": CONFIG.pool_pre_ping,
+    }
+
+
+def make_engine(url: str, name: str) -> Engine:
+    ENGINES[name] = create_engine(url, poolclass=InstrumentedQueuePool, **get_pool_options())
+    return ENGINES[name]
+
+
+def get_pool_stats() -> Dict[str, dict]:
+    # engine.pool is looked up every time, dispose() swaps it for a new pool
+    return {name: engine.pool.snapshot() for name, engine in ENGINES.items()}
+
 
-engine = create_engine(CONFIG.database_url, pool_pre_ping=True)
+engine = make_engine(CONFIG.database_url, "primary")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
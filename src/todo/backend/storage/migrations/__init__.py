@@ -0,0 +1,89 @@
+import importlib
+import pkgutil
+from types import ModuleType
+from typing import List, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, select, text
+from sqlalchemy.engine import Connection, Engine
+
+# Migrations are the v<NNNN>_<name>.py modules in this package, each with an upgrade(connection) function.
+# They run in version order, each in its own transaction together with its schema_version row. Databases
+# created with create_all before this package existed are upgraded too, so migrations check what already
+# exists before changing it.
+#
+# A migration that sets TRANSACTIONAL = False gets upgrade(engine) instead and commits its own transactions, for
+# data migrations too large to run in one. It must be safe to re-run, since a failure can leave it half applied
+# without its schema_version row.
+
+metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False, server_default=func.now()),
+)
+
+# Arbitrary key for pg_advisory_xact_lock, so two deploys can't run migrations at the same time
+ADVISORY_LOCK_KEY = 7_415_202
+
+
+def get_migrations() -> List[ModuleType]:
+    names = sorted(info.name for info in pkgutil.iter_modules(__path__) if info.name.startswith("v"))
+    return [importlib.import_module(f"{__name__}.{name}") for name in names]
+
+
+def get_version(module: ModuleType) -> int:
+    return int(module.__name__.rsplit(".", 1)[-1][1:5])
+
+
+def get_name(module: ModuleType) -> str:
+    return module.__name__.rsplit(".", 1)[-1]
+
+
+def get_current_version(connection: Connection) -> int:
+    schema_version.create(connection, checkfirst=True)
+    return connection.scalar(select(func.max(schema_version.c.version))) or 0
+
+
+def apply(connection: Connection, module: ModuleType):
+    connection.execute(schema_version.insert().values(version=get_version(module), name=get_name(module)))
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[str]:
+    applied = []
+    for module in get_migrations():
+        version = get_version(module)
+        if target is not None and version > target:
+            break
+
+        if getattr(module, "TRANSACTIONAL", True):
+            with engine.begin() as connection:
+                if connection.dialect.name == "postgresql":
+                    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                if version <= get_current_version(connection):
+                    continue
+
+                module.upgrade(connection)
+                apply(connection, module)
+        else:
+            # A session lock, held on its own connection while the migration commits on others
+            with engine.connect() as lock_connection:
+                is_postgresql = lock_connection.dialect.name == "postgresql"
+                if is_postgresql:
+                    lock_connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                try:
+                    with engine.begin() as connection:
+                        if version <= get_current_version(connection):
+                            continue
+
+                    module.upgrade(engine)
+                    with engine.begin() as connection:
+                        apply(connection, module)
+                finally:
+                    if is_postgresql:
+                        lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+
+        applied.append(get_name(module))
+
+    return applied
@@ -0,0 +1,38 @@
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, MetaData, String, Table
+from sqlalchemy.engine import Connection
+
+# The schema as it was before migrations existed. Later migrations change it, so it is spelled out here
+# instead of coming from the models.
+
+metadata = MetaData()
+
+Table(
+    "user",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("username", String, unique=True),
+    Column("hashed_password", String, nullable=False),
+    Column("role", String, nullable=False),
+)
+
+Table(
+    "todo",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String, nullable=False),
+    Column("owner_id", Integer, ForeignKey("user.id")),
+)
+
+Table(
+    "todo_item",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("message", String, nullable=False),
+    Column("position", String, nullable=False),
+    Column("active", Boolean, nullable=False, default=True),
+    Column("todo_id", Integer, ForeignKey("todo.id")),
+)
+
+
+def upgrade(connection: Connection):
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,10 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection):
+    if "needs_rerank" not in {column["name"] for column in inspect(connection).get_columns("todo")}:
+        connection.execute(text("ALTER TABLE todo ADD COLUMN needs_rerank BOOLEAN NOT NULL DEFAULT false"))
+    connection.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_todo_item_todo_id_position ON todo_item (todo_id, position)")
+    )
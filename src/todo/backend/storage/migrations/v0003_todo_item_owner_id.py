@@ -0,0 +1,44 @@
+from sqlalchemy import Column, Integer, MetaData, Table, func, inspect, select, text
+from sqlalchemy.engine import Engine
+
+# Commits each backfill batch on its own, see TRANSACTIONAL in the migrations package
+TRANSACTIONAL = False
+BATCH_SIZE = 10000
+
+metadata = MetaData()
+todo = Table("todo", metadata, Column("id", Integer), Column("owner_id", Integer))
+todo_item = Table("todo_item", metadata, Column("id", Integer), Column("todo_id", Integer), Column("owner_id", Integer))
+
+
+def backfill_todo_item_owner_id(bind: Engine, batch_size: int = BATCH_SIZE) -> int:
+    # Commits one id range at a time so no transaction holds row locks on the whole table
+    with bind.connect() as connection:
+        max_id = connection.scalar(select(func.max(todo_item.c.id))) or 0
+    owner_id = select(todo.c.owner_id).where(todo.c.id == todo_item.c.todo_id).scalar_subquery()
+
+    updated = 0
+    for start in range(0, max_id + 1, batch_size):
+        with bind.begin() as connection:
+            result = connection.execute(
+                todo_item.update()
+                .where(todo_item.c.id >= start, todo_item.c.id < start + batch_size)
+                .where(todo_item.c.owner_id.is_distinct_from(owner_id))
+                .values(owner_id=owner_id)
+            )
+            updated += result.rowcount
+
+    return updated
+
+
+def upgrade(engine: Engine):
+    with engine.begin() as connection:
+        if "owner_id" not in {column["name"] for column in inspect(connection).get_columns("todo_item")}:
+            connection.execute(text('ALTER TABLE todo_item ADD COLUMN owner_id INTEGER REFERENCES "user" (id)'))
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_todo_item_owner_id_todo_id_position "
+                "ON todo_item (owner_id, todo_id, position)"
+            )
+        )
+
+    backfill_todo_item_owner_id(engine)
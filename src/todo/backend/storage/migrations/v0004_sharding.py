@@ -0,0 +1,8 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection):
+    if "shard_id" not in {column["name"] for column in inspect(connection).get_columns("user")}:
+        connection.execute(text('ALTER TABLE "user" ADD COLUMN shard_id INTEGER'))
+    connection.execute(text("CREATE TABLE IF NOT EXISTS id_block (name VARCHAR PRIMARY KEY, next_id BIGINT NOT NULL)"))
@@ -0,0 +1,7 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection):
+    if "version" not in {column["name"] for column in inspect(connection).get_columns("todo")}:
+        connection.execute(text("ALTER TABLE todo ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
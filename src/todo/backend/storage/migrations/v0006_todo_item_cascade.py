@@ -0,0 +1,23 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection):
+    if "needs_purge" not in {column["name"] for column in inspect(connection).get_columns("todo")}:
+        connection.execute(text("ALTER TABLE todo ADD COLUMN needs_purge BOOLEAN NOT NULL DEFAULT false"))
+
+    # SQLite can't alter constraints, its databases are only ever created fresh from the models
+    if connection.dialect.name != "postgresql":
+        return
+
+    for foreign_key in inspect(connection).get_foreign_keys("todo_item"):
+        if foreign_key["referred_table"] == "todo" and foreign_key["options"].get("ondelete") != "CASCADE":
+            connection.execute(text(f'ALTER TABLE todo_item DROP CONSTRAINT "{foreign_key["name"]}"'))
+            # NOT VALID skips the scan of existing rows, so the locks taken here are only held briefly. The scan
+            # is v0008's VALIDATE, which runs after this transaction has committed and released them.
+            connection.execute(
+                text(
+                    "ALTER TABLE todo_item ADD CONSTRAINT todo_item_todo_id_fkey FOREIGN KEY (todo_id) "
+                    "REFERENCES todo (id) ON DELETE CASCADE NOT VALID"
+                )
+            )
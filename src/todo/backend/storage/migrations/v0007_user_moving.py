@@ -0,0 +1,7 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection):
+    if "moving" not in {column["name"] for column in inspect(connection).get_columns("user")}:
+        connection.execute(text('ALTER TABLE "user" ADD COLUMN moving BOOLEAN NOT NULL DEFAULT false'))
@@ -0,0 +1,16 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# Its own migration so that it runs in a transaction of its own. VALIDATE scans todo_item under a SHARE UPDATE
+# EXCLUSIVE lock, which lets reads and writes through, while v0006's ALTERs took locks that block them.
+
+
+def upgrade(connection: Connection):
+    if connection.dialect.name != "postgresql":
+        return
+
+    not_valid = connection.scalar(
+        text("SELECT count(*) FROM pg_constraint WHERE conname = 'todo_item_todo_id_fkey' AND NOT convalidated")
+    )
+    if not_valid:
+        connection.execute(text("ALTER TABLE todo_item VALIDATE CONSTRAINT todo_item_todo_id_fkey"))
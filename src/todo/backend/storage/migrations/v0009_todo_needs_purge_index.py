@@ -0,0 +1,16 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# CREATE INDEX CONCURRENTLY can't run in a transaction, see TRANSACTIONAL in the migrations package
+TRANSACTIONAL = False
+
+
+def upgrade(engine: Engine):
+    with engine.connect() as connection:
+        concurrently = ""
+        if connection.dialect.name == "postgresql":
+            connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+            concurrently = "CONCURRENTLY "
+        connection.execute(
+            text(f"CREATE INDEX {concurrently}IF NOT EXISTS ix_todo_needs_purge ON todo (id) WHERE needs_purge")
+        )
@@ -1,8 +1,25 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
-from sqlalchemy.orm import relationship, declared_attr, declarative_mixin, synonym
-from sqlalchemy.ext.associationproxy import association_proxy
-
-from todo.backend.ranking import get_lexical_rank
+import itertools
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Integer,
+    String,
+    Boolean,
+    case,
+    ForeignKey,
+    Index,
+    Table,
+    event,
+    inspect,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.orm import Session, relationship, declared_attr, declarative_mixin, synonym, object_session
+
+from todo.backend.rank_engine import rank_range
 from todo.backend.storage.database import Base
 
 
@@ -20,49 +37,166 @@ class User(OwnerIdMixin, Base):
     username = Column(String, unique=True)
     hashed_password = Column(String, nullable=False)
     role = Column(String, nullable=False)
+    # Shard holding the user's todos and todo items, None is the primary database (shard 0)
+    shard_id = Column(Integer, nullable=True)
+    # Set on the user's row in their shard while manage.move_user copies their rows away, writes are refused
+    moving = Column(Boolean, nullable=False, default=False)
 
     @declared_attr
     def owner_id(cls):
         return synonym("id")
 
 
+# Next free id per sharded table, handed out to processes in blocks so ids stay unique across shards
+id_block = Table(
+    "id_block",
+    Base.metadata,
+    Column("name", String, primary_key=True),
+    Column("next_id", BigInteger, nullable=False),
+)
+
+
 class Todo(OwnerIdMixin, Base):
     __tablename__ = "todo"
+    __table_args__ = (
+        # Only ever holds the few todos waiting for the purge worker
+        Index("ix_todo_needs_purge", "id", postgresql_where=text("needs_purge"), sqlite_where=text("needs_purge")),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String, nullable=False)
+    needs_rerank = Column(Boolean, nullable=False, default=False)
+    # Bumped whenever the todo or any of its items change, used as the ETag of the todo and its items
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Set instead of deleting todos with too many items to delete in a request, hides the todo until the purge
+    # worker has deleted it
+    needs_purge = Column(Boolean, nullable=False, default=False)
+    # Items are deleted by the database's ON DELETE CASCADE, without being loaded first
     todo_items = relationship(
-        "TodoItem", back_populates="todo", cascade="all, delete-orphan", order_by="TodoItem.position"
+        "TodoItem",
+        back_populates="todo",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="TodoItem.position",
     )
 
-    def rerank_todo_items(self):
-        self.todo_items[0].position = "b"
-        self.todo_items[-1].position = "z"
+    def count_todo_items(self, limit: int) -> int:
+        # Stops counting at limit, so it stays cheap on huge todos
+        db = object_session(self)
+        return db.query(TodoItem.id).filter_by(todo_id=self.id).limit(limit).count()
 
-        self._rerank_todo_items(0, len(self.todo_items) - 1)
+    def get_last_position(self) -> Optional[str]:
+        db = object_session(self)
+        query = db.query(TodoItem.position).filter_by(todo_id=self.id)
+        return query.order_by(TodoItem.position.desc(), TodoItem.id.desc()).limit(1).scalar()
 
-    def _rerank_todo_items(self, start_idx, end_idx):
-        if end_idx - start_idx <= 1:
-            return
+    def rerank_todo_items(self):
+        # Imported here, the events module needs these models
+        from todo.backend.events import record_todo_item_events
 
-        mid_idx = (start_idx + end_idx) // 2
-        mid_ti = self.todo_items[mid_idx]
-        mid_ti.position = get_lexical_rank(self.todo_items[start_idx].position, self.todo_items[end_idx].position)
+        db = object_session(self)
+        query = db.query(TodoItem.id).filter_by(todo_id=self.id).order_by(TodoItem.position, TodoItem.id)
+        todo_item_ids = [todo_item_id for todo_item_id, in query]
+        positions = rank_range(len(todo_item_ids))
 
-        self._rerank_todo_items(start_idx, mid_idx)
-        self._rerank_todo_items(mid_idx, end_idx)
+        write_positions(db, dict(zip(todo_item_ids, positions)))
+        bump_todo_versions(db, [self.id])
+        record_todo_item_events(db, "reordered", todo_item_ids)
+        db.expire(self, ["todo_items"])
+        for obj in list(db.identity_map.values()):
+            if isinstance(obj, TodoItem) and obj.todo_id == self.id:
+                db.expire(obj, ["position"])
 
 
 class TodoItem(OwnerIdMixin, Base):
     __tablename__ = "todo_item"
+    __table_args__ = (
+        Index("ix_todo_item_todo_id_position", "todo_id", "position"),
+        Index("ix_todo_item_owner_id_todo_id_position", "owner_id", "todo_id", "position"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     message = Column(String, nullable=False)
     position = Column(String, nullable=False)
     active = Column(Boolean, nullable=False, default=True)
-    todo_id = Column(Integer, ForeignKey(Todo.id))
+    todo_id = Column(Integer, ForeignKey(Todo.id, ondelete="CASCADE"))
     todo = relationship("Todo", back_populates="todo_items")
 
-    @declared_attr
-    def owner_id(cls):
-        return association_proxy("todo", "owner_id")
+
+# Items per UPDATE when writing positions, keeps the CASE and IN lists of huge todos at a sane size
+POSITION_CHUNK_SIZE = 1000
+
+
+def write_positions(db: Session, positions: Dict[int, str], chunk_size: int = POSITION_CHUNK_SIZE):
+    # One UPDATE ... SET position = CASE id ... per chunk. bulk_update_mappings would be an executemany, one
+    # round trip per item.
+    todo_item_ids = list(positions)
+    for start in range(0, len(todo_item_ids), chunk_size):
+        chunk = {todo_item_id: positions[todo_item_id] for todo_item_id in todo_item_ids[start : start + chunk_size]}
+        db.execute(
+            update(TodoItem)
+            .where(TodoItem.id.in_(chunk))
+            .values(position=case(chunk, value=TodoItem.id))
+            .execution_options(synchronize_session=False)
+        )
+
+
+# TodoItem.owner_id is a copy of todo.owner_id so ownership filters on items don't need to join todo
+
+
+def get_todo_owner_id(connection, todo_item: TodoItem) -> int:
+    todo = todo_item.__dict__.get("todo")
+    if todo is not None and todo.id == todo_item.todo_id:
+        return todo.owner_id
+    return connection.scalar(select(Todo.owner_id).where(Todo.id == todo_item.todo_id))
+
+
+@event.listens_for(TodoItem, "before_insert")
+def set_todo_item_owner_id(mapper, connection, target: TodoItem):
+    if target.owner_id is None:
+        target.owner_id = get_todo_owner_id(connection, target)
+
+
+@event.listens_for(TodoItem, "before_update")
+def move_todo_item_owner_id(mapper, connection, target: TodoItem):
+    attrs = inspect(target).attrs
+    if attrs.todo_id.history.has_changes() and not attrs.owner_id.history.has_changes():
+        target.owner_id = get_todo_owner_id(connection, target)
+
+
+# Ids of the todos bumped in the session's current transaction, for listeners that act on commit
+BUMPED_TODO_IDS_KEY = "bumped_todo_ids"
+
+
+def bump_todo_versions(db: Session, todo_ids: Iterable[int]):
+    # Bulk writes skip the flush below, so they bump versions through this directly
+    todo_ids = set(todo_ids)
+    if not todo_ids:
+        return
+
+    db.info.setdefault(BUMPED_TODO_IDS_KEY, set()).update(todo_ids)
+    db.execute(update(Todo).where(Todo.id.in_(todo_ids)).values(version=Todo.version + 1))
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, Todo) and obj.id in todo_ids:
+            db.expire(obj, ["version"])
+
+
+@event.listens_for(Session, "before_flush")
+def bump_todo_versions_on_flush(db: Session, flush_context, instances):
+    todo_ids = set()
+    for obj in itertools.chain(db.new, db.dirty, db.deleted):
+        if isinstance(obj, TodoItem) and (obj in db.new or obj in db.deleted or db.is_modified(obj)):
+            # An item moved to another todo changes both lists
+            todo_ids.update(inspect(obj).attrs.todo_id.history.deleted or ())
+            todo_ids.add(obj.todo_id)
+        elif isinstance(obj, Todo) and obj in db.dirty and db.is_modified(obj):
+            todo_ids.add(obj.id)
+
+    todo_ids.discard(None)
+    bump_todo_versions(db, todo_ids)
+
+
+@event.listens_for(Todo, "after_update")
+def sync_todo_items_owner_id(mapper, connection, target: Todo):
+    if inspect(target).attrs.owner_id.history.has_changes():
+        connection.execute(update(TodoItem).where(TodoItem.todo_id == target.id).values(owner_id=target.owner_id))
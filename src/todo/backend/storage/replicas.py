@@ -0,0 +1,105 @@
+import itertools
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from fastapi.logger import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from todo.backend.config import CONFIG
+from todo.backend.storage.database import engine as primary_engine
+from todo.backend.storage.database import make_engine
+
+# Positions are compared in Python as integers, so a replica's replay position can also be checked against the
+# position a client carried over from a write served by another worker
+PRIMARY_LSN_QUERY = text("SELECT pg_current_wal_lsn()::text")
+REPLICA_LSN_QUERY = text("SELECT pg_last_wal_replay_lsn()::text")
+
+# Holds the primary's position after a request's writes committed, reads route to replicas that replayed past it
+WRITE_LSN_COOKIE = "todo_write_lsn"
+
+
+def parse_lsn(lsn: str) -> int:
+    high, low = lsn.split("/")
+    return int(high, 16) << 32 | int(low, 16)
+
+
+def get_primary_lsn() -> int:
+    with primary_engine.connect() as connection:
+        return parse_lsn(connection.scalar(PRIMARY_LSN_QUERY))
+
+
+def get_replica_lag(engine: Engine) -> Tuple[int, int]:
+    # Bytes of WAL the replica has yet to replay and its replay position. Unlike the age of the last replayed
+    # transaction the lag stays 0 while the primary is idle. The primary is read first, a replica that replays
+    # past it in between counts as caught up.
+    primary_lsn = get_primary_lsn()
+    with engine.connect() as connection:
+        replay_lsn = connection.scalar(REPLICA_LSN_QUERY)
+    if replay_lsn is None:
+        raise ValueError("Not a replica, pg_last_wal_replay_lsn() is NULL")
+    replay_lsn = parse_lsn(replay_lsn)
+    return max(primary_lsn - replay_lsn, 0), replay_lsn
+
+
+class Replica:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self.lag_bytes: Optional[int] = None
+        self.replay_lsn = 0
+        self.checked_at = float("-inf")
+
+
+class ReplicaSet:
+    def __init__(
+        self,
+        engines: List[Engine],
+        max_lag_bytes: int = CONFIG.replica_max_lag_bytes,
+        lag_check_interval_seconds: float = CONFIG.replica_lag_check_interval_seconds,
+        lag_query: Callable[[Engine], Tuple[int, int]] = get_replica_lag,
+    ):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.max_lag_bytes = max_lag_bytes
+        self.lag_check_interval_seconds = lag_check_interval_seconds
+        self.lag_query = lag_query
+        self._lock = threading.Lock()
+        self._next = itertools.cycle(self.replicas)
+
+    def _check_lag(self, replica: Replica) -> Optional[Tuple[int, int]]:
+        # One request per interval runs the query, outside the lock, the others use the last result
+        now = time.monotonic()
+        with self._lock:
+            if replica.checked_at + self.lag_check_interval_seconds >= now:
+                return None if replica.lag_bytes is None else (replica.lag_bytes, replica.replay_lsn)
+            replica.checked_at = now
+
+        try:
+            lag_bytes, replay_lsn = self.lag_query(replica.engine)
+        except Exception:
+            logger.exception("Failed to check replica lag, skipping replica")
+            lag_bytes, replay_lsn = None, 0
+
+        with self._lock:
+            replica.lag_bytes, replica.replay_lsn = lag_bytes, replay_lsn
+        return None if lag_bytes is None else (lag_bytes, replay_lsn)
+
+    def get_session(self, min_lsn: int = 0) -> Optional[Session]:
+        # min_lsn is the client's last write position, replicas that haven't replayed it yet would hide that write
+        if not self.replicas:
+            return None
+
+        with self._lock:
+            candidates = [next(self._next) for _ in self.replicas]
+
+        for replica in candidates:
+            lag = self._check_lag(replica)
+            if lag is not None and lag[0] <= self.max_lag_bytes and lag[1] >= min_lsn:
+                return replica.session_factory()
+
+        return None
+
+
+REPLICAS = ReplicaSet([make_engine(url, f"replica_{i}") for i, url in enumerate(CONFIG.replica_database_urls)])
@@ -0,0 +1,117 @@
+import threading
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import event, func, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from todo.backend.config import CONFIG
+from todo.backend.storage.database import SessionLocal, engine, make_engine
+from todo.backend.storage.models import Todo, TodoItem, User, id_block
+
+# Users live on the primary database, which is also shard 0. A user's todos and todo items live on the
+# shard in user.shard_id. Every shard other than the primary keeps a stub row per placed user so the
+# owner_id foreign keys still hold there.
+
+SHARDED_MODELS = (Todo, TodoItem)
+SHARDED_TABLES = {model_cls.__tablename__: model_cls.__table__ for model_cls in SHARDED_MODELS}
+
+
+class IdAllocator:
+    # Sequences are per database, so sharded tables take their ids from blocks reserved in the
+    # primary's id_block table instead
+    def __init__(self, primary: Engine, block_size: int = CONFIG.id_block_size):
+        self.primary = primary
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks: Dict[str, Tuple[int, int]] = {}
+
+    def _reserve_block(self, table_name: str, size: int) -> int:
+        while True:
+            with self.primary.begin() as connection:
+                result = connection.execute(
+                    update(id_block).where(id_block.c.name == table_name).values(next_id=id_block.c.next_id + size)
+                )
+                if result.rowcount:
+                    return connection.scalar(select(id_block.c.next_id).where(id_block.c.name == table_name)) - size
+
+            # First block for this table, start after the rows created before sharding was turned on
+            table = SHARDED_TABLES[table_name]
+            try:
+                with self.primary.begin() as connection:
+                    start = (connection.scalar(select(func.max(table.c.id))) or 0) + 1
+                    connection.execute(id_block.insert().values(name=table_name, next_id=start + size))
+                    return start
+            except IntegrityError:
+                # Another process created the row first
+                continue
+
+    def allocate(self, table_name: str, count: int) -> List[int]:
+        with self._lock:
+            start, end = self._blocks.get(table_name, (0, 0))
+            if end - start < count:
+                size = max(self.block_size, count)
+                start = self._reserve_block(table_name, size)
+                end = start + size
+
+            self._blocks[table_name] = (start + count, end)
+            return list(range(start, start + count))
+
+
+class ShardSet:
+    def __init__(self, session_factories: List[Callable[[], Session]], id_allocator: IdAllocator):
+        self.session_factories = session_factories
+        self.id_allocator = id_allocator
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.session_factories) > 1
+
+    def get_index(self, user: User) -> int:
+        return user.shard_id or 0
+
+    def choose_index(self, user: User) -> int:
+        return user.id % len(self.session_factories)
+
+    def ensure_user_stub(self, db: Session, user: User):
+        if db.query(User.id).filter_by(id=user.id).one_or_none() is None:
+            db.add(User(id=user.id, username=None, hashed_password="", role=user.role))
+            db.flush()
+
+    def place_user(self, user: User):
+        # Called for new users. Users created before sharding was turned on stay on the primary.
+        index = self.choose_index(user)
+        if index != 0:
+            db = self.session_factories[index]()
+            try:
+                self.ensure_user_stub(db, user)
+                db.commit()
+            finally:
+                db.close()
+        user.shard_id = index
+
+
+SHARDS = ShardSet(
+    [SessionLocal]
+    + [
+        sessionmaker(autocommit=False, autoflush=False, bind=make_engine(url, f"shard_{i}"))
+        for i, url in enumerate(CONFIG.shard_database_urls, 1)
+    ],
+    IdAllocator(engine),
+)
+
+
+@event.listens_for(Session, "before_flush")
+def allocate_sharded_ids(session: Session, flush_context, instances):
+    if not SHARDS.enabled:
+        return
+
+    new_items: Dict[str, list] = {}
+    for item in session.new:
+        if isinstance(item, SHARDED_MODELS) and item.id is None:
+            new_items.setdefault(item.__tablename__, []).append(item)
+
+    for table_name, items in new_items.items():
+        for item, item_id in zip(items, SHARDS.id_allocator.allocate(table_name, len(items))):
+            item.id = item_id
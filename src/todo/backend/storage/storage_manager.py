@@ -1,94 +1,456 @@
-from typing import Any, Dict, List, Optional, Type, TypeVar
+import heapq
+import itertools
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type, TypeVar
 
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from todo.backend.storage.models import OwnerIdMixin, User
+from sqlalchemy.orm import Query, Session, make_transient_to_detached, object_session
+from todo.backend.storage.cache import StorageCache, record_touched_rows
+from todo.backend.storage.models import OwnerIdMixin, Todo, TodoItem, User
+from todo.backend.user_cache import USER_CACHE, record_touched_users
 
-from sqlalchemy import inspect
+from sqlalchemy import delete, func, inspect, select, tuple_, update
 
 OwnerIdGeneric = TypeVar("OwnerIdGeneric", bound=OwnerIdMixin)
 
 
 class StorageManager:
-    def __init__(self, db: Session, user: User):
+    def __init__(
+        self,
+        db: Session,
+        user: User,
+        read_db: Optional[Session] = None,
+        shard_dbs: Optional[List[Session]] = None,
+        cache: Optional[StorageCache] = None,
+    ):
+        # db is the shard holding the user's own rows and shard_dbs every shard, primary first. Reads that
+        # don't lock go to read_db (a replica of the primary) when there is one, and get and list results
+        # go through cache when it is set.
         self.db = db
         self.user = user
-
-    def list(
-        self,
-        model_cls: Type[OwnerIdGeneric],
-        filters: Optional[Dict[str, Any]] = None,
-        order_by: Optional[List[Any]] = None,
-    ) -> OwnerIdGeneric:
-        query = self.db.query(model_cls)
+        self.read_db = read_db
+        self.shard_dbs = shard_dbs or [db]
+        self.cache = cache
+        self.cache_version: Optional[str] = None
+        self._purging_todo_ids: Dict[Session, List[int]] = {}
+
+    def _get_dbs(self, model_cls: Type[OwnerIdGeneric], writable: bool = False) -> List[Session]:
+        # Users only live on the primary, admins see the todos of every shard
+        if model_cls is User:
+            dbs = self.shard_dbs[:1]
+        elif self.user.role == "user":
+            dbs = [self.db]
+        else:
+            dbs = self.shard_dbs
+
+        if self.read_db is not None and not writable:
+            dbs = [self.read_db if db is self.shard_dbs[0] else db for db in dbs]
+
+        return dbs
+
+    def _fence(self, db: Session, owner_ids: Iterable[int]):
+        # Writes to sharded rows hold a share lock on their owners' rows in that shard until they commit, which
+        # manage.move_user waits for before copying. Owners that are being moved, or that no longer live in the
+        # shard because the cached user is out of date, can't be written to.
+        owner_ids = set(owner_ids)
+        if len(self.shard_dbs) == 1 or not owner_ids:
+            return
+
+        owners = db.query(User.id, User.shard_id, User.moving).filter(User.id.in_(owner_ids)).with_for_update(read=True)
+        placed_ids = {
+            owner.id
+            for owner in owners
+            if not owner.moving and (db is not self.shard_dbs[0] or (owner.shard_id or 0) == 0)
+        }
+        if placed_ids != owner_ids:
+            USER_CACHE.invalidate(owner_ids - placed_ids)
+            raise HTTPException(
+                503, headers={"Retry-After": "1"}, detail="User is being moved to another shard, try again"
+            )
+
+    def _get_purging_todo_ids(self, db: Session) -> List[int]:
+        # Read once per session from the small ix_todo_needs_purge, so item queries can leave out the items of
+        # purging todos without joining todo
+        if db not in self._purging_todo_ids:
+            query = db.query(Todo.id).filter_by(needs_purge=True)
+            if self.user.role == "user":
+                query = query.filter_by(owner_id=self.user.owner_id)
+            self._purging_todo_ids[db] = [todo_id for todo_id, in query]
+
+        return self._purging_todo_ids[db]
+
+    def _query(self, db: Session, model_cls: Type[OwnerIdGeneric], filters: Optional[Dict[str, Any]] = None) -> Query:
+        query = db.query(model_cls)
 
         if self.user.role == "user":
             query = query.filter_by(owner_id=self.user.owner_id)
 
+        if model_cls is Todo:
+            # Todos waiting for the purge worker are already deleted as far as requests are concerned, and so
+            # are their items
+            query = query.filter_by(needs_purge=False)
+        elif model_cls is TodoItem:
+            purging_todo_ids = self._get_purging_todo_ids(db)
+            if purging_todo_ids:
+                query = query.filter(TodoItem.todo_id.notin_(purging_todo_ids))
+
         if filters:
             query = query.filter_by(**filters)
 
+        return query
+
+    def _list_query(
+        self,
+        db: Session,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]] = None,
+        order_by: Optional[List[Any]] = None,
+        after: Optional[List[Any]] = None,
+    ) -> Query:
+        query = self._query(db, model_cls, filters)
+
+        if after is not None:
+            query = query.filter(tuple_(*order_by) > tuple_(*after))
+
         if order_by:
             query = query.order_by(*order_by)
 
-        return query.all()
+        return query
 
-    def create(self, model_cls: Type[OwnerIdGeneric], data: Dict[str, Any]) -> OwnerIdGeneric:
-        data = data.copy()
-        if "owner_id" in inspect(model_cls).columns:
-            data["owner_id"] = self.user.id
+    def _merge(
+        self, results: List[Iterator[OwnerIdGeneric]], order_by: Optional[List[Any]]
+    ) -> Iterator[OwnerIdGeneric]:
+        # Every shard returns its rows already sorted, so fanned out results only need merging
+        if len(results) == 1:
+            return iter(results[0])
+        if not order_by:
+            return itertools.chain(*results)
 
-        item = model_cls(**data)
+        return heapq.merge(*results, key=lambda item: tuple(getattr(item, column.key) for column in order_by))
 
-        self.db.add(item)
-        self.db.flush()
+    def _one(self, dbs: List[Session], model_cls: Type[OwnerIdGeneric], filters: Dict[str, Any], for_update: bool):
+        for db in dbs:
+            query = self._query(db, model_cls, filters)
 
-        return item
+            if for_update:
+                query = query.with_for_update()
+
+            item = query.one_or_none()
+            if item is not None:
+                return item
+
+        raise HTTPException(400, detail=f"{model_cls.__name__} doesn't exist")
 
-    def get(self, model_cls: Type[OwnerIdGeneric], filters: Dict[str, Any]) -> OwnerIdGeneric:
-        query = self.db.query(model_cls).filter_by(**filters)
+    def _cached(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]],
+        load: Callable[[], List[OwnerIdGeneric]],
+        *params: Any,
+    ) -> List[OwnerIdGeneric]:
+        if self.cache is None or not self.cache.caches(model_cls):
+            return load()
+
+        key = self.cache.make_key(model_cls, self.user, filters, self.cache_version, *params)
+        items = self.cache.get(model_cls, key)
+        if items is None:
+            items = load()
+            self.cache.set(model_cls, key, items)
+
+        return items
+
+    def pin_cache_version(self, version: str):
+        # Routes that send an ETag read it from the database before the body, which may come from the cache.
+        # Keying the entries on it means a body cached before a change, and not yet invalidated in this
+        # process, is never sent with the ETag of a newer version.
+        self.cache_version = version
+
+    def _bulk_criteria(
+        self, model_cls: Type[OwnerIdGeneric], filters: Optional[Dict[str, Any]], ids: Optional[List[int]]
+    ) -> List[Any]:
+        criteria = [getattr(model_cls, key) == value for key, value in (filters or {}).items()]
 
         if self.user.role == "user":
-            query = query.filter_by(owner_id=self.user.owner_id)
+            criteria.append(model_cls.owner_id == self.user.owner_id)
 
-        item = query.one_or_none()
+        if model_cls is Todo:
+            criteria.append(Todo.needs_purge.is_(False))
+        elif model_cls is TodoItem:
+            # Todo ids are unique across shards, so one list covers every shard written to
+            purging_todo_ids = [
+                todo_id for db in self._get_dbs(model_cls, writable=True) for todo_id in self._get_purging_todo_ids(db)
+            ]
+            if purging_todo_ids:
+                criteria.append(TodoItem.todo_id.notin_(purging_todo_ids))
 
-        if item is None:
+        if ids is not None:
+            criteria.append(model_cls.id.in_(ids))
+
+        return criteria
+
+    def _bulk_write(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        criteria: List[Any],
+        statement: Any,
+        after_write: Optional[Callable[[Session, List[Dict[str, Any]]], None]],
+    ) -> List[Dict[str, Any]]:
+        # One statement per shard that returns the written rows, nothing is loaded into the session
+        columns = list(model_cls.__table__.columns)
+        statement = statement.where(*criteria).execution_options(synchronize_session=False)
+
+        rows = []
+        for db in self._get_dbs(model_cls, writable=True):
+            if db.get_bind().dialect.full_returning:
+                db_rows = [dict(row._mapping) for row in db.execute(statement.returning(*columns))]
+            else:
+                # Without UPDATE/DELETE ... RETURNING the rows are locked and read around the statement instead
+                db_rows = [
+                    dict(row._mapping) for row in db.execute(select(*columns).where(*criteria).with_for_update())
+                ]
+                db.execute(statement)
+                if not statement.is_delete:
+                    ids = [row["id"] for row in db_rows]
+                    db_rows = [dict(row._mapping) for row in db.execute(select(*columns).where(model_cls.id.in_(ids)))]
+
+            if not db_rows:
+                continue
+
+            # Objects the session already holds are now out of date. Their identity is read from the state, as
+            # reading obj.id could load an expired object whose row is gone.
+            ids = {row["id"] for row in db_rows}
+            for obj in list(db.identity_map.values()):
+                if not isinstance(obj, model_cls) or inspect(obj).identity[0] not in ids:
+                    continue
+                if statement.is_delete:
+                    db.expunge(obj)
+                else:
+                    db.expire(obj)
+
+            if model_cls is not User:
+                self._fence(db, {row["owner_id"] for row in db_rows})
+            record_touched_rows(db, model_cls, db_rows)
+            record_touched_users(db, model_cls, db_rows)
+            if after_write is not None:
+                after_write(db, db_rows)
+            rows.extend(db_rows)
+
+        return rows
+
+    def _in_query(
+        self,
+        db: Session,
+        model_cls: Type[OwnerIdGeneric],
+        key: str,
+        values: List[Any],
+        order_by: List[Any],
+        limit_per_value: Optional[int],
+    ) -> Query:
+        column = getattr(model_cls, key)
+        query = self._query(db, model_cls).filter(column.in_(values))
+
+        if limit_per_value is not None:
+            # Numbers the rows of every value in order, still a single statement
+            row_number = func.row_number().over(partition_by=column, order_by=order_by).label("row_number")
+            ranked = query.with_entities(model_cls.id, row_number).subquery()
+            query = self._query(db, model_cls).filter(
+                model_cls.id.in_(select(ranked.c.id).where(ranked.c.row_number <= limit_per_value))
+            )
+
+        return query.order_by(*order_by)
+
+    def _needs_orm(self, model_cls: Type[OwnerIdGeneric], keys: Optional[Iterable[str]] = None) -> bool:
+        # Single statements skip the mapper's cascades and events. Deletes can skip them when the database
+        # does every cascade itself, updates when they leave alone relationship keys and owner_id, which the
+        # events copy onto related rows.
+        mapper = inspect(model_cls)
+        if keys is None:
+            return any(rel.cascade.delete and not rel.passive_deletes for rel in mapper.relationships)
+
+        synced_keys = {"owner_id"}.union(column.key for rel in mapper.relationships for column in rel.local_columns)
+        return bool(synced_keys.intersection(keys))
+
+    def _write_one(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Dict[str, Any],
+        statement: Any,
+        after_write: Optional[Callable[[Session, List[Dict[str, Any]]], None]],
+    ) -> OwnerIdGeneric:
+        rows = self._bulk_write(model_cls, self._bulk_criteria(model_cls, filters, None), statement, after_write)
+        if not rows:
             raise HTTPException(400, detail=f"{model_cls.__name__} doesn't exist")
 
+        # A detached copy of the written row, like the ones the cache hands out
+        item = model_cls(**rows[0])
+        make_transient_to_detached(item)
         return item
 
-    def update(self, model_cls: Type[OwnerIdGeneric], filters: Dict[str, Any], data: Dict[str, Any]) -> OwnerIdGeneric:
-        query = self.db.query(model_cls).filter_by(**filters)
+    def bulk_update(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]],
+        values: Dict[str, Any],
+        ids: Optional[List[int]] = None,
+        after_write: Optional[Callable[[Session, List[Dict[str, Any]]], None]] = None,
+    ) -> List[Dict[str, Any]]:
+        criteria = self._bulk_criteria(model_cls, filters, ids)
+        return self._bulk_write(model_cls, criteria, update(model_cls).values(values), after_write)
+
+    def bulk_delete(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]],
+        ids: Optional[List[int]] = None,
+        after_write: Optional[Callable[[Session, List[Dict[str, Any]]], None]] = None,
+    ) -> List[Dict[str, Any]]:
+        criteria = self._bulk_criteria(model_cls, filters, ids)
+        return self._bulk_write(model_cls, criteria, delete(model_cls), after_write)
+
+    def get_db(self, item: OwnerIdGeneric) -> Session:
+        # The session of the shard item was loaded from, for writing to it
+        db = object_session(item) or self.db
+        if not isinstance(item, User):
+            self._fence(db, [item.owner_id])
+        return db
 
-        if self.user.role == "user":
-            query = query.filter_by(owner_id=self.user.owner_id)
+    def list(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]] = None,
+        order_by: Optional[List[Any]] = None,
+        limit: Optional[int] = None,
+        after: Optional[List[Any]] = None,
+    ) -> List[OwnerIdGeneric]:
+        def load():
+            queries = [self._list_query(db, model_cls, filters, order_by, after) for db in self._get_dbs(model_cls)]
 
-        item = query.one_or_none()
+            if limit is not None:
+                queries = [query.limit(limit) for query in queries]
 
-        if item is None:
-            raise HTTPException(400, detail=f"{model_cls.__name__} doesn't exist")
+            return list(itertools.islice(self._merge([query.all() for query in queries], order_by), limit))
 
-        for key, val in data.items():
-            setattr(item, key, val)
+        order_keys = [column.key for column in order_by or []]
+        return self._cached(model_cls, filters, load, "list", order_keys, limit, after)
+
+    def list_in(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        key: str,
+        values: List[Any],
+        order_by: List[Any],
+        limit_per_value: Optional[int] = None,
+    ) -> List[OwnerIdGeneric]:
+        # The rows whose key is any of values, with one IN query per shard instead of one query per value.
+        # order_by must start with key, limit_per_value keeps only the first rows of every value.
+        if not values:
+            return []
+
+        def load():
+            queries = [
+                self._in_query(db, model_cls, key, values, order_by, limit_per_value) for db in self._get_dbs(model_cls)
+            ]
+            return list(self._merge([query.all() for query in queries], order_by))
+
+        order_keys = [column.key for column in order_by]
+        return self._cached(model_cls, None, load, "list_in", key, sorted(values), order_keys, limit_per_value)
+
+    def stream(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]] = None,
+        order_by: Optional[List[Any]] = None,
+        after: Optional[List[Any]] = None,
+        batch_size: int = 500,
+    ) -> Iterator[OwnerIdGeneric]:
+        # yield_per reads rows through a server-side cursor, batch_size rows at a time
+        return self._merge(
+            [
+                self._list_query(db, model_cls, filters, order_by, after).yield_per(batch_size)
+                for db in self._get_dbs(model_cls)
+            ],
+            order_by,
+        )
+
+    def stream_columns(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Optional[Dict[str, Any]],
+        order_by: List[Any],
+        limit: Optional[int] = None,
+        where: Optional[List[Any]] = None,
+        batch_size: int = 500,
+    ) -> Iterator[Tuple[Any, ...]]:
+        # Just the order_by columns of the rows, in order, without loading any model_cls objects. where takes
+        # criteria that filters can't express.
+        queries = []
+        for db in self._get_dbs(model_cls):
+            query = self._list_query(db, model_cls, filters, order_by).filter(*where or [])
+            if limit is not None:
+                query = query.limit(limit)
+            queries.append(query.with_entities(*order_by).yield_per(batch_size))
+
+        return itertools.islice(self._merge(queries, order_by), limit)
+
+    def create(self, model_cls: Type[OwnerIdGeneric], data: Dict[str, Any]) -> OwnerIdGeneric:
+        data = data.copy()
+        if "owner_id" in inspect(model_cls).columns:
+            data["owner_id"] = self.user.id
+
+        item = model_cls(**data)
 
-        self.db.add(item)
-        self.db.flush()
+        db = self.shard_dbs[0] if model_cls is User else self.db
+        if model_cls is not User:
+            self._fence(db, [self.user.id])
+        db.add(item)
+        db.flush()
 
         return item
 
-    def delete(self, model_cls: Type[OwnerIdGeneric], filters: Dict[str, Any]) -> OwnerIdGeneric:
-        query = self.db.query(model_cls).filter_by(**filters)
+    def get(self, model_cls: Type[OwnerIdGeneric], filters: Dict[str, Any], for_update: bool = False) -> OwnerIdGeneric:
+        def load():
+            return [self._one(self._get_dbs(model_cls, writable=for_update), model_cls, filters, for_update)]
 
-        if self.user.role == "user":
-            query = query.filter_by(owner_id=self.user.owner_id)
+        if for_update:
+            return load()[0]
 
-        item = query.one_or_none()
+        return self._cached(model_cls, filters, load, "get")[0]
 
-        if item is None:
-            raise HTTPException(400, detail=f"{model_cls.__name__} doesn't exist")
+    def update(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Dict[str, Any],
+        data: Dict[str, Any],
+        after_write: Optional[Callable[[Session, List[Dict[str, Any]]], None]] = None,
+    ) -> OwnerIdGeneric:
+        # One UPDATE ... RETURNING when possible. after_write only runs then, the ORM path leaves versions and
+        # events to the flush listeners.
+        if data and not self._needs_orm(model_cls, data):
+            return self._write_one(model_cls, filters, update(model_cls).values(data), after_write)
+
+        item = self._one(self._get_dbs(model_cls, writable=True), model_cls, filters, for_update=False)
+
+        for key, val in data.items():
+            setattr(item, key, val)
+
+        db = self.get_db(item)
+        db.add(item)
+        db.flush()
+
+        return item
+
+    def delete(
+        self,
+        model_cls: Type[OwnerIdGeneric],
+        filters: Dict[str, Any],
+        after_write: Optional[Callable[[Session, List[Dict[str, Any]]], None]] = None,
+    ) -> OwnerIdGeneric:
+        if not self._needs_orm(model_cls):
+            return self._write_one(model_cls, filters, delete(model_cls), after_write)
+
+        item = self._one(self._get_dbs(model_cls, writable=True), model_cls, filters, for_update=False)
 
-        self.db.delete(item)
-        self.db.flush()
+        db = self.get_db(item)
+        db.delete(item)
+        db.flush()
 
         return item
@@ -0,0 +1,41 @@
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from todo.backend.storage.models import User
+from todo.backend.storage.storage_manager import OwnerIdGeneric, StorageManager
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 500
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def stream_ndjson(
+    session_factories: List[Callable[[], Session]],
+    user_id: int,
+    model_cls: Type[OwnerIdGeneric],
+    schema: Type[BaseModel],
+    filters: Optional[Dict[str, Any]],
+    order_by: List[Any],
+    after: Optional[List[Any]] = None,
+) -> StreamingResponse:
+    # The body is written after the request's session has been committed and closed, so rows are read
+    # through a session owned by the stream itself
+    def generate():
+        shard_dbs = [session_factory() for session_factory in session_factories]
+        try:
+            user = shard_dbs[0].query(User).filter_by(id=user_id).one()
+            sm = StorageManager(shard_dbs[user.shard_id or 0], user, shard_dbs=shard_dbs)
+            for item in sm.stream(model_cls, filters, order_by, after, STREAM_BATCH_SIZE):
+                yield schema.from_orm(item).json() + "\n"
+        finally:
+            for db in shard_dbs:
+                db.close()
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
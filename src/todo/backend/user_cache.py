@@ -0,0 +1,139 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple, Type
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from todo.backend.config import CONFIG
+from todo.backend.storage.cache import STORAGE_CACHE, CacheBackend
+from todo.backend.storage.models import User
+
+# Users written in a session's transaction are collected on flush and invalidated once it commits, so no
+# request can cache the old row again after the invalidation. Loads that started before an invalidation
+# pass the generation they started at to set, which then drops them.
+# With a shared storage cache backend (redis) the generation lives there and every worker drops its entries
+# once another worker invalidates a user. Without one invalidations only reach the worker that made the
+# change, and the others keep the old row, and role, for up to TODO_USER_CACHE_TTL_SECONDS.
+
+TOUCHED_USER_IDS_KEY = "user_cache_touched_user_ids"
+GENERATION_KEY = "generation:users"
+
+
+class UserCache:
+    def __init__(self, max_size: int, ttl_seconds: float, backend: Optional[CacheBackend] = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[str, Tuple[float, Any, User]]" = OrderedDict()
+
+    @property
+    def generation(self) -> Any:
+        if self.backend is None:
+            return self._generation
+
+        generation = self.backend.get(GENERATION_KEY)
+        if generation is None:
+            # Like the storage cache's tags, an evicted generation must not bring back older entries
+            generation = uuid.uuid4().hex
+            self.backend.set(GENERATION_KEY, generation)
+        return generation
+
+    def get(self, username: str) -> Optional[User]:
+        generation = self.generation
+        with self._lock:
+            entry = self._users.get(username)
+            # In-process entries are dropped by invalidate itself, shared generations catch other workers' ones
+            stale = entry is not None and self.backend is not None and entry[1] != generation
+            if entry is None or entry[0] < time.monotonic() or stale:
+                self.misses += 1
+                return None
+
+            self._users.move_to_end(username)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, user: User, generation: Optional[Any] = None):
+        # generation is self.generation from before user was loaded
+        if self.max_size <= 0:
+            return
+
+        # Cache a detached copy so it never expires with, or gets flushed by, the session it was loaded in
+        cached_user = User(
+            id=user.id,
+            username=user.username,
+            hashed_password=user.hashed_password,
+            role=user.role,
+            shard_id=user.shard_id,
+        )
+        make_transient_to_detached(cached_user)
+
+        current_generation = self.generation
+        with self._lock:
+            if generation is not None and generation != current_generation:
+                # Some user was invalidated while this one was loaded, it may be the old row
+                return
+
+            self._users[user.username] = (time.monotonic() + self.ttl_seconds, current_generation, cached_user)
+            self._users.move_to_end(user.username)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_ids: Iterable[int]):
+        # By id, a renamed user is still cached under the old username
+        user_ids = set(user_ids)
+        if self.backend is not None:
+            self.backend.set(GENERATION_KEY, uuid.uuid4().hex)
+        with self._lock:
+            self._generation += 1
+            for username, (_, _, user) in list(self._users.items()):
+                if user.id in user_ids:
+                    del self._users[username]
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._users)}
+
+
+USER_CACHE = UserCache(
+    CONFIG.user_cache_size,
+    CONFIG.user_cache_ttl_seconds,
+    STORAGE_CACHE.backend if STORAGE_CACHE.enabled and STORAGE_CACHE.backend.shared else None,
+)
+
+
+def record_touched_users(session: Session, model_cls: Type[Any], rows: Iterable[Dict[str, Any]]):
+    # For bulk statements, which never flush
+    if model_cls is User:
+        session.info.setdefault(TOUCHED_USER_IDS_KEY, set()).update(row["id"] for row in rows)
+
+
+@event.listens_for(Session, "after_flush")
+def collect_touched_users(session: Session, flush_context):
+    user_ids = {obj.id for obj in itertools.chain(session.new, session.dirty, session.deleted) if isinstance(obj, User)}
+    if user_ids:
+        session.info.setdefault(TOUCHED_USER_IDS_KEY, set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_touched_users(session: Session):
+    user_ids = session.info.pop(TOUCHED_USER_IDS_KEY, None)
+    if user_ids:
+        USER_CACHE.invalidate(user_ids)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_touched_users(session: Session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(TOUCHED_USER_IDS_KEY, None)
@@ -0,0 +1,37 @@
+import abc
+import threading
+from typing import Optional
+
+from fastapi.logger import logger
+
+
+class PeriodicWorker(abc.ABC):
+    # Calls run_once every interval_seconds on a daemon thread, from app startup until shutdown
+    name = "worker"
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("%s failed", self.name)
+
+    @abc.abstractmethod
+    def run_once(self) -> int:
+        pass
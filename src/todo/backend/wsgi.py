@@ -3,12 +3,11 @@ import logging
 from fastapi.logger import logger as fastapi_logger
 
 from todo.backend.app import init_app
-from todo.backend.storage.database import Base, engine
 
+# Schema changes and the admin user are handled once per deploy by `todo-cli db upgrade` and
+# `todo-cli db bootstrap-admin`, so workers start without touching the database
 app = init_app()
 
-Base.metadata.create_all(bind=engine)
-
 if "gunicorn" in os.environ.get("SERVER_SOFTWARE", ""):
     gunicorn_error_logger = logging.getLogger("gunicorn.error")
     gunicorn_logger = logging.getLogger("gunicorn")